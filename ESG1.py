@@ -1,8 +1,44 @@
+import html
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from functools import lru_cache, partial
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
 
+from greeninvest.aggregation import (GROUP_COLUMNS, MODE_BOTTOM, MODE_GROUP, MODE_HISTOGRAM,
+                                     MODE_PRODUCTS, MODE_TOP, available_modes, overview_chart_data)
+from greeninvest.comparator import (CATEGORIES, MAX_COMPARE, best_choice, comparison_frame,
+                                     comparison_verdict, index_for)
+from greeninvest.filters import (GREENWASHING_ALL, GREENWASHING_NONE, GREENWASHING_ONLY,
+                                 PAGE_SIZES, SORT_COLUMNS, filter_key, filter_positions,
+                                 page_positions)
+from greeninvest.demo import demo_catalog, demo_portfolios, generate_esg_data, generate_esg_history
+from greeninvest.fetcher import partner_refresher
+from greeninvest.history import history_indicators, load_history
+from greeninvest.ingest import REJECTED_DIR, feed_poller, live_universe
+from greeninvest.loader import load_universe, to_columnar
+from greeninvest.marketplace import SORT_INVESTMENT, SORT_RELEVANCE, SORT_RETURN, load_catalog
+from greeninvest.lookthrough import load_lookthrough, lookthrough_universe
+from greeninvest.metrics import cache_stats, observe, summary, timed, timer, write_prometheus
+from greeninvest.metrics import enabled as metrics_enabled
+from greeninvest.optimizer import optimize, problem_arrays
+from greeninvest.portfolio import load_portfolios
+from greeninvest.recommendations import profile_bucket, recommend, warm_up
+from greeninvest.reports import FORMATS, comparison_reports, export_zip, portfolio_reports
+from greeninvest.rules import default_engine
+from greeninvest.scenarios import (CONFIDENCE, DEFAULT_SCENARIO, HORIZON_YEARS, SCENARIOS, VOLATILITY,
+                                   loss_histogram, portfolio_losses, price_paths, product_losses,
+                                   scenario_losses, scenario_paths, tail_stats)
+from greeninvest.similarity import greener_alternatives
+from greeninvest.snapshot import current_snapshot
+from greeninvest.submissions import submission_queue
+
 # Configurazione pagina
 st.set_page_config(
     page_title="GreenInvest+",
@@ -52,37 +88,133 @@ def local_css():
     </style>
     """, unsafe_allow_html=True)
 
-# Funzione per generare dati ESG simulati
-def generate_esg_data():
-    # Creazione di 5 strumenti finanziari simulati
-    products = [
-        "EcoGreen ETF", 
-        "Sustainability Fund", 
-        "Blue Ocean Bond", 
-        "Carbon Zero Index", 
-        "Future Energy Trust"
-    ]
-    
-    esg_scores = [85, 72, 93, 65, 78]
-    co2_emissions = [120, 200, 50, 180, 150]  # Tonnellate di CO2 (scope 1-2-3)
-    green_activities = [25, 65, 82, 60, 45]   # Percentuale di attività green
-    
-    # Calcola greenwashing flag (ESG score > 80 ma % attività green < 30%)
-    greenwashing = [(score > 80 and green < 30) for score, green in zip(esg_scores, green_activities)]
-    
-    # Creazione del DataFrame
-    data = pd.DataFrame({
-        'product': products,
-        'esg_score': esg_scores,
-        'co2_emissions': co2_emissions,
-        'green_activities': green_activities,
-        'greenwashing_flag': greenwashing
-    })
+# Dati simulati in formato colonnare, costruiti una sola volta per processo
+@st.cache_resource(show_spinner=False)
+def _demo_universe():
+    return to_columnar(generate_esg_data())
+
+# Universo configurato dall'esterno (snapshot condivisa o file) invece dei dati dimostrativi
+def external_universe():
+    return bool(os.environ.get('GREENINVEST_SNAPSHOT') or os.environ.get('GREENINVEST_UNIVERSE'))
+
+# Funzione per caricare l'universo ESG (snapshot in GREENINVEST_SNAPSHOT, file indicato da
+# GREENINVEST_UNIVERSE o dati simulati)
+# Il DataFrame è condiviso tra sessioni (e, da una snapshot, tra processi): va trattato in sola lettura
+def load_esg_data():
+    snapshot = os.environ.get('GREENINVEST_SNAPSHOT')
+    source = os.environ.get('GREENINVEST_UNIVERSE')
+    if snapshot:
+        data = current_snapshot(snapshot).data
+    elif source:
+        data = load_universe(source, verify_hash=os.environ.get('GREENINVEST_VERIFY_HASH') == '1')
+    else:
+        data = _demo_universe()
+    
+    # Valori di fondi ed ETF derivati dagli emittenti sottostanti (look-through), se configurato
+    issuers = os.environ.get('GREENINVEST_ISSUERS')
+    constituents = os.environ.get('GREENINVEST_CONSTITUENTS')
+    if issuers and constituents:
+        data = lookthrough_universe(data, load_lookthrough(issuers, constituents))
     
+    # Aggiornamenti incrementali dai feed dei partner (cartella di deposito e/o API HTTP)
+    feed_dir = os.environ.get('GREENINVEST_FEED_DIR')
+    partners = os.environ.get('GREENINVEST_PARTNERS')
+    if feed_dir or partners:
+        live = live_universe(data)
+        if feed_dir:
+            # I file depositati sono applicati da un thread di sfondo: qui non si attendono mai
+            poller = feed_poller(feed_dir).attach(live)
+            if poller.error is not None:
+                st.sidebar.warning(f"Feed dei partner non disponibile: {poller.error}")
+            elif poller.rejected:
+                name, error = poller.rejected[-1]
+                st.sidebar.warning(f"{len(poller.rejected)} file di feed scartati e spostati in "
+                                   f"{REJECTED_DIR}/ (ultimo: {name}, {error})")
+        if partners:
+            # Le API sono interrogate da un thread di sfondo: qui non si attende mai la rete
+            partner_refresher(partners).attach(live.ingest)
+        data = live.data
     return data
 
-# Funzione per visualizzare ESG score con barra colorata
-def display_esg_score(score):
+# Funzione per mostrare lo stato dell'ultimo aggiornamento dalle API dei partner
+def display_partner_feeds():
+    partners = os.environ.get('GREENINVEST_PARTNERS')
+    if not partners:
+        return
+    snapshot = partner_refresher(partners).snapshot
+    st.markdown('<h2 class="sub-header">Aggiornamento dati dai partner</h2>', unsafe_allow_html=True)
+    if snapshot['error'] is not None:
+        st.warning(f"Ultimo aggiornamento dei dati dei partner non riuscito: {snapshot['error']}")
+    if snapshot['refreshed_at'] is None:
+        if snapshot['error'] is None:
+            st.info("Primo aggiornamento dei dati dei partner in corso...")
+        return
+    labels = {
+        'cache': "In cache", 'fetched': "Aggiornato", 'not_modified': "Invariato",
+        'stale': "Non raggiungibile (dati precedenti)", 'error': "Non disponibile",
+        'invalid': "Contenuto non valido",
+    }
+    st.dataframe(pd.DataFrame({
+        'Partner': [e['partner'] for e in snapshot['endpoints']],
+        'Endpoint': [e['url'] for e in snapshot['endpoints']],
+        'Stato': [labels[e['status']] for e in snapshot['endpoints']],
+        'Errore': [e['error'] or '' for e in snapshot['endpoints']],
+    }), hide_index=True)
+    st.caption(f"Ultimo aggiornamento: {pd.Timestamp(snapshot['refreshed_at'], unit='s'):%d/%m/%Y %H:%M:%S} UTC "
+               f"({snapshot['duration']:.1f} s)")
+
+# Funzione per caricare i portafogli (file indicato da GREENINVEST_HOLDINGS o dimostrativi)
+def load_portfolio_data(data):
+    source = os.environ.get('GREENINVEST_HOLDINGS')
+    if source:
+        return load_portfolios(data, source)
+    if external_universe():
+        return None
+    return demo_portfolios(data)
+
+# Storico simulato dei prodotti dimostrativi, costruito una sola volta per processo
+@st.cache_resource(show_spinner=False)
+def _demo_history():
+    return generate_esg_history(generate_esg_data())
+
+# Funzione per caricare lo storico ESG (cartella indicata da GREENINVEST_HISTORY o simulato)
+def load_history_data():
+    source = os.environ.get('GREENINVEST_HISTORY')
+    if source:
+        return load_history(source)
+    if external_universe():
+        return None
+    return _demo_history()
+
+# Catalogo dimostrativo del marketplace, costruito una sola volta per processo
+@st.cache_resource(show_spinner=False)
+def _demo_catalog():
+    return demo_catalog()
+
+# Funzione per caricare il catalogo del marketplace (file indicato da GREENINVEST_MARKETPLACE o dimostrativo)
+def load_marketplace():
+    source = os.environ.get('GREENINVEST_MARKETPLACE')
+    if source:
+        return load_catalog(source)
+    return _demo_catalog()
+
+# Funzione per salvare un modulo inviato (scrittura sul database in sfondo, a gruppi)
+def save_submission(form, payload):
+    try:
+        queue = submission_queue(os.environ.get('GREENINVEST_SUBMISSIONS_DB'))
+        queue.submit(form, payload)
+    except (OSError, sqlite3.Error) as e:
+        st.error(f"Impossibile salvare i dati inviati: {e}")
+        return False
+    if queue.last_error is not None:
+        # I dati sono nel journal: verranno scritti appena il database torna disponibile
+        st.warning(f"Database momentaneamente non disponibile: {queue.backlog} moduli in attesa "
+                   f"di salvataggio ({queue.last_error}).")
+    return True
+
+# HTML della barra colorata dell'ESG score (costruito una volta per valore)
+@lru_cache(maxsize=1024)
+def esg_score_html(score):
     if score >= 80:
         color = "green"
     elif score >= 60:
@@ -90,13 +222,71 @@ def display_esg_score(score):
     else:
         color = "red"
     
-    st.markdown(f"""
+    return f"""
     <div style="margin-bottom: 10px;">
         <span style="font-weight: bold;">ESG Score: {score}/100</span>
         <div style="background-color: #f0f0f0; border-radius: 5px; height: 20px; width: 100%;">
             <div style="background-color: {color}; width: {score}%; height: 100%; border-radius: 5px;"></div>
         </div>
     </div>
+    """
+
+# Funzione per visualizzare ESG score con barra colorata
+def display_esg_score(score):
+    st.markdown(esg_score_html(score), unsafe_allow_html=True)
+
+# Partner: (nome, ruolo, colore del logo, descrizione)
+PARTNERS = [
+    ("Intesa Sanpaolo", "Incumbent Finanziario", "#2E86C1",
+     """Intesa Sanpaolo fornisce accesso ai dati ESG dei propri prodotti finanziari, 
+                   arricchendo GreenInvest+ con una vasta gamma di strumenti d'investimento certificati."""),
+    ("Clarity AI", "Startup Innovativa", "#1E8449",
+     """Clarity AI utilizza tecnologie di Intelligenza Artificiale per analizzare l'impatto ESG 
+                   delle aziende, fornendo a GreenInvest+ dati affidabili e trasparenti."""),
+    ("Coop", "Partner di diverso settore", "#E74C3C",
+     """Coop collabora con GreenInvest+ per promuovere l'educazione finanziaria sostenibile 
+                   tra i suoi soci, offrendo workshop e contenuti formativi."""),
+]
+
+# HTML della card di un partner (costruito una sola volta)
+@lru_cache(maxsize=None)
+def partner_card_html(name, role, color, description):
+    return f"""
+            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; height: 300px;">
+                <h3 style="color: #2E86C1">{name}</h3>
+                <p><i>{role}</i></p>
+                <div style="background-color: {color}; color: white; text-align: center; padding: 10px; border-radius: 5px; width: 150px; margin: 10px 0;">
+                    <strong>{name}</strong>
+                </div>
+                <p>{description}</p>
+            </div>
+            """
+
+# HTML della card di un prodotto del marketplace (in cache per le offerte più viste);
+# i testi vengono dal catalogo dei partner, quindi sono sempre trattati come testo
+@lru_cache(maxsize=1024)
+def marketplace_card_html(name, partner, min_investment, expected_return, impact):
+    name, partner, impact = html.escape(str(name)), html.escape(str(partner)), html.escape(str(impact))
+    return f"""
+            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; margin-bottom: 1rem;">
+                <h3>{name}</h3>
+                <p><b>Partner:</b> {partner}</p>
+                <p><b>Investimento minimo:</b> €{min_investment}</p>
+                <p><b>Rendimento atteso:</b> {expected_return}</p>
+                <p><b>Impatto:</b> {impact}</p>
+                <button style="background-color: #2E86C1; color: white; border: none; padding: 0.5rem 1rem; border-radius: 5px; cursor: pointer;">
+                    Scopri di più
+                </button>
+            </div>
+            """
+
+# Funzione per mostrare l'alert di greenwashing con i messaggi delle regole colpite
+def display_greenwashing_alert(rules_code):
+    messages = "<br>".join(default_engine().messages(rules_code))
+    st.markdown(f"""
+    <div class="red-alert">
+        ⚠️ <b>Greenwashing Alert</b>: {messages}
+    </div>
     """, unsafe_allow_html=True)
 
 # Funzione per creare un grafico di confronto semplificato
@@ -122,9 +312,12 @@ def create_comparison_chart(product1, product2, values1, values2, categories):
         st.write("---")
 
 # Funzione per comparare prodotti
+@timed('compare_products')
 def compare_products(data, product1, product2):
-    df1 = data[data['product'] == product1].iloc[0]
-    df2 = data[data['product'] == product2].iloc[0]
+    # Lookup O(1) tramite l'indice prodotti (costruito una volta per universo)
+    index = index_for(data)
+    df1 = data.iloc[index.position(product1)]
+    df2 = data.iloc[index.position(product2)]
     
     col1, col2 = st.columns(2)
     
@@ -134,11 +327,7 @@ def compare_products(data, product1, product2):
         st.metric("Emissioni CO₂ (tonnellate)", df1['co2_emissions'])
         st.metric("Attività Green (%)", df1['green_activities'])
         if df1['greenwashing_flag']:
-            st.markdown("""
-            <div class="red-alert">
-                ⚠️ <b>Greenwashing Alert</b>: Alto ESG score ma bassa percentuale di attività green.
-            </div>
-            """, unsafe_allow_html=True)
+            display_greenwashing_alert(df1['greenwashing_rules'])
     
     with col2:
         st.subheader(product2)
@@ -146,33 +335,26 @@ def compare_products(data, product1, product2):
         st.metric("Emissioni CO₂ (tonnellate)", df2['co2_emissions'])
         st.metric("Attività Green (%)", df2['green_activities'])
         if df2['greenwashing_flag']:
-            st.markdown("""
-            <div class="red-alert">
-                ⚠️ <b>Greenwashing Alert</b>: Alto ESG score ma bassa percentuale di attività green.
-            </div>
-            """, unsafe_allow_html=True)
+            display_greenwashing_alert(df2['greenwashing_rules'])
     
     # Suggerimento comparativo
     st.markdown("### Analisi comparativa")
     
-    if df1['esg_score'] > df2['esg_score'] and not df1['greenwashing_flag']:
-        st.markdown(f"""
-        <div class="green-alert">
-            🔍 <b>{product1} è più sostenibile di {product2}</b> con un ESG Score superiore 
-            (+{df1['esg_score'] - df2['esg_score']} punti) e minori emissioni CO₂.
-        </div>
-        """, unsafe_allow_html=True)
-    elif df2['esg_score'] > df1['esg_score'] and not df2['greenwashing_flag']:
+    winner, margin = comparison_verdict(df1['esg_score'], df1['greenwashing_flag'],
+                                        df2['esg_score'], df2['greenwashing_flag'])
+    
+    if winner is not None:
+        better, worse = (product1, product2) if winner == 0 else (product2, product1)
         st.markdown(f"""
         <div class="green-alert">
-            🔍 <b>{product2} è più sostenibile di {product1}</b> con un ESG Score superiore 
-            (+{df2['esg_score'] - df1['esg_score']} punti) e minori emissioni CO₂.
+            🔍 <b>{html.escape(better)} è più sostenibile di {html.escape(worse)}</b> con un ESG Score superiore 
+            (+{margin} punti) e minori emissioni CO₂.
         </div>
         """, unsafe_allow_html=True)
     else:
         st.markdown(f"""
         <div class="green-alert">
-            🔍 La comparazione tra <b>{product1}</b> e <b>{product2}</b> richiede un'analisi più dettagliata. 
+            🔍 La comparazione tra <b>{html.escape(product1)}</b> e <b>{html.escape(product2)}</b> richiede un'analisi più dettagliata. 
             Controlla i livelli di attività green e verifica eventuali segnali di greenwashing.
         </div>
         """, unsafe_allow_html=True)
@@ -180,26 +362,516 @@ def compare_products(data, product1, product2):
     # Grafico comparativo 
     st.subheader("Grafico comparativo")
     
-    # Creare dati per grafico 
-    categories = ['ESG Score', 'Basse Emissioni', 'Attività Green']
+    # Valori normalizzati (meno emissioni = valore più alto) con max_co2 precalcolato
+    values1, values2 = index.score_matrix([product1, product2]).tolist()
     
-    # Normalizzare i valori per il grafico 
-    max_co2 = max(data['co2_emissions'])
+    # Usiamo la funzione di confronto semplificata che usa componenti nativi Streamlit
+    create_comparison_chart(product1, product2, values1, values2, CATEGORIES)
+
+# Funzione per confrontare N prodotti con la matrice normalizzata
+def compare_many_products(data, products):
+    frame = comparison_frame(data, products).sort_values('Punteggio complessivo', ascending=False)
     
-    values1 = [
-        df1['esg_score']/100,
-        1 - (df1['co2_emissions']/max_co2),  # Invertiamo per far sì che meno emissioni = valore più alto
-        df1['green_activities']/100
-    ]
+    st.write(f"### Confronto tra {len(products)} prodotti")
     
-    values2 = [
-        df2['esg_score']/100,
-        1 - (df2['co2_emissions']/max_co2),
-        df2['green_activities']/100
-    ]
+    # Tabella unica con barre di avanzamento, al posto di N x 3 componenti separati
+    progress = {
+        category: st.column_config.ProgressColumn(category, min_value=0, max_value=1, format="percent")
+        for category in CATEGORIES + ['Punteggio complessivo']
+    }
+    st.dataframe(
+        frame,
+        hide_index=True,
+        column_config={
+            'product': 'Prodotto',
+            'esg_score': 'ESG Score',
+            'co2_emissions': 'Emissioni CO₂ (t)',
+            'green_activities': 'Attività Green (%)',
+            'greenwashing_flag': st.column_config.CheckboxColumn('Greenwashing'),
+            **progress
+        }
+    )
     
-    # Usiamo la funzione di confronto semplificata che usa componenti nativi Streamlit
-    create_comparison_chart(product1, product2, values1, values2, categories)
+    # Il migliore tra i prodotti senza segnali di greenwashing
+    best = best_choice(frame)
+    if best is not None:
+        st.markdown(f"""
+        <div class="green-alert">
+            🔍 <b>{html.escape(str(best['product']))}</b> ha il miglior punteggio complessivo 
+            ({best['Punteggio complessivo']:.0%}) tra i prodotti senza segnali di greenwashing.
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.markdown("""
+        <div class="red-alert">
+            ⚠️ Tutti i prodotti selezionati presentano segnali di greenwashing.
+        </div>
+        """, unsafe_allow_html=True)
+
+# Funzione per mostrare il dettaglio di un prodotto della dashboard
+def display_product_details(row):
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        # ESG Score con barra colorata
+        display_esg_score(row['esg_score'])
+        
+        # Altre metriche
+        st.metric("Emissioni CO₂ (tonnellate)", row['co2_emissions'])
+        st.metric("Attività Green (%)", row['green_activities'])
+        
+        # Alert per greenwashing
+        if row['greenwashing_flag']:
+            display_greenwashing_alert(row['greenwashing_rules'])
+    
+    with col2:
+        # Mini grafico a torta per % attività green usando componenti Streamlit nativi
+        create_pie_chart(row['green_activities'])
+
+# Funzione per i filtri della dashboard; restituisce posizioni filtrate e chiave dello stato
+def display_product_filters(data):
+    index = index_for(data)
+    min_co2, max_co2 = float(np.floor(index.min_co2)), float(np.ceil(index.max_co2))
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        score_range = st.slider("ESG Score", 0, 100, (0, 100), key="dash_score")
+        search = st.text_input("Cerca prodotto", key="dash_search")
+    
+    with col2:
+        co2_range = st.slider("Emissioni CO₂ (tonnellate)", min_co2, max_co2,
+                              (min_co2, max_co2), key="dash_co2")
+        greenwashing = st.selectbox(
+            "Greenwashing",
+            [GREENWASHING_ALL, GREENWASHING_ONLY, GREENWASHING_NONE],
+            key="dash_greenwashing"
+        )
+    
+    with col3:
+        sort_by = st.selectbox("Ordina per", list(SORT_COLUMNS), format_func=SORT_COLUMNS.get,
+                               key="dash_sort")
+        descending = st.toggle("Ordine decrescente", value=True, key="dash_desc")
+    
+    # Un intervallo completo non filtra nulla (e non esclude valori mancanti)
+    filters = dict(
+        score_range=None if score_range == (0, 100) else score_range,
+        co2_range=None if co2_range == (min_co2, max_co2) else co2_range,
+        greenwashing=greenwashing,
+        search=search
+    )
+    positions = filter_positions(data, sort_by=sort_by, descending=descending, **filters)
+    return positions, filter_key(**filters)
+
+# Funzione per il grafico "Panoramica ESG Score" con dati aggregati lato server
+def display_overview_chart(data, positions, key):
+    labels = {
+        MODE_PRODUCTS: "Per prodotto",
+        MODE_HISTOGRAM: "Distribuzione",
+        MODE_TOP: "Top 10",
+        MODE_BOTTOM: "Bottom 10"
+    }
+    modes = available_modes(data, len(positions))
+    # Le viste disponibili dipendono dal numero di prodotti filtrati: una scelta non più
+    # valida (es. "Per prodotto" dopo aver allargato i filtri) torna alla vista predefinita
+    if "dash_chart_mode" in st.session_state and st.session_state["dash_chart_mode"] not in modes:
+        del st.session_state["dash_chart_mode"]
+    mode, by = st.radio(
+        "Vista",
+        modes,
+        format_func=lambda m: labels.get(m[0]) or f"Per {GROUP_COLUMNS[m[1]]}",
+        horizontal=True,
+        key="dash_chart_mode"
+    )
+    mode, chart_data = overview_chart_data(data, mode, positions=positions, key=key, by=by)
+    st.altair_chart(overview_chart(mode, by, chart_data), use_container_width=True)
+
+# Funzione per costruire il grafico di panoramica dai dati aggregati
+@timed('overview_chart')
+def overview_chart(mode, by, chart_data):
+    if mode == MODE_HISTOGRAM:
+        chart = alt.Chart(chart_data).mark_bar().encode(
+            x=alt.X('bin', sort=None, title='ESG Score'),
+            y=alt.Y('count', title='Numero di prodotti'),
+            color=alt.Color('color:N', scale=None),
+            tooltip=['bin', 'count']
+        )
+    elif mode == MODE_GROUP:
+        chart = alt.Chart(chart_data).mark_bar().encode(
+            x=alt.X('group', sort=None, title=GROUP_COLUMNS[by].capitalize()),
+            y=alt.Y('esg_score', title='ESG Score medio'),
+            color=alt.Color('color:N', scale=None),
+            tooltip=['group', 'esg_score', 'count']
+        )
+    else:
+        chart = alt.Chart(chart_data).mark_bar().encode(
+            x=alt.X('product', sort=None, title='Prodotto Finanziario'),
+            y=alt.Y('esg_score', title='ESG Score'),
+            color=alt.Color('color:N', scale=None),  # Usa direttamente il valore del colore
+            tooltip=['product', 'esg_score']
+        )
+    
+    return chart.properties(width=700, height=400)
+
+# Funzione per la lista prodotti paginata; restituisce le righe della pagina
+def display_product_list(data, positions):
+    page_size = st.selectbox("Prodotti per pagina", PAGE_SIZES, key="dash_page_size")
+    n_pages = max(1, -(-len(positions) // page_size))
+    if st.session_state.get("dash_page", 1) > n_pages:
+        st.session_state["dash_page"] = n_pages
+    page = st.number_input(f"Pagina (di {n_pages})", 1, n_pages, key="dash_page")
+    page_pos, _ = page_positions(positions, page, page_size)
+    st.caption(f"{len(positions)} prodotti trovati")
+    
+    # Le colonne categoriche della pagina diventano object: serializzate così com'è,
+    # la tabella porterebbe al browser l'intero dizionario delle categorie dell'universo
+    page_rows = data.iloc[page_pos]
+    page_rows = page_rows.astype({col: object for col, dtype in page_rows.dtypes.items()
+                                  if isinstance(dtype, pd.CategoricalDtype)})
+    for pos, (_, row) in zip(page_pos, page_rows.iterrows()):
+        # Il contenuto viene costruito solo quando l'expander è aperto
+        expander = st.expander(f"{row['product']} - ESG Score: {row['esg_score']}",
+                               key=f"dash_detail_{pos}", on_change="rerun")
+        if expander.open:
+            with expander:
+                display_product_details(row)
+    
+    return page_rows
+
+# Funzione per la tabella della pagina, con andamento e indicatori storici se disponibili
+def display_product_table(page_rows, history):
+    table = page_rows[['product', 'esg_score', 'co2_emissions', 'green_activities']]
+    if history is None or history.n_days == 0:
+        st.dataframe(table)
+        return
+    
+    # Solo le righe visibili: letture per prodotto contigue nello storico
+    table = table.reset_index(drop=True)
+    pos = history.positions(table['product'])
+    found = np.flatnonzero(pos >= 0)
+    esg_spark = [None] * len(table)
+    co2_spark = [None] * len(table)
+    for i, values in zip(found, history.sparklines('esg_score', pos[found])):
+        esg_spark[i] = values.tolist()
+    for i, values in zip(found, history.sparklines('co2_emissions', pos[found])):
+        co2_spark[i] = values.tolist()
+    indicators = history_indicators(history, positions=pos[found])
+    indicators.index = found
+    table = table.assign(esg_trend=esg_spark, co2_trend=co2_spark).join(indicators.rename(
+        columns={'score_trend': 'esg_year', 'co2_trend': 'co2_year'}))
+    
+    st.dataframe(table, hide_index=True, column_config={
+        'product': "Prodotto",
+        'esg_score': "ESG Score",
+        'co2_emissions': "CO₂ (t)",
+        'green_activities': "Attività Green (%)",
+        'esg_trend': st.column_config.LineChartColumn("Andamento ESG", y_min=0, y_max=100),
+        'co2_trend': st.column_config.LineChartColumn("Andamento CO₂"),
+        'esg_year': st.column_config.NumberColumn("Trend ESG (punti/anno)", format="%+.1f"),
+        'co2_year': st.column_config.NumberColumn("Trend CO₂ (t/anno)", format="%+.1f"),
+        'max_drawdown': st.column_config.NumberColumn("Calo massimo ESG", format="%.1f"),
+        'drawdown': st.column_config.NumberColumn("Calo dal massimo ESG", format="%.1f"),
+        'improved_while_emitting': st.column_config.CheckboxColumn("ESG ↑ ma CO₂ ↑"),
+    })
+    st.caption(f"Andamento dal {history.dates[0]:%d/%m/%Y} ({history.n_days} giorni); "
+               f"trend e segnale ESG ↑ / CO₂ ↑ calcolati sull'ultimo anno.")
+
+# Funzione per mostrare le alternative più simili ma più sostenibili a un prodotto
+# (frammento: cambiare prodotto o numero di alternative riesegue solo questa sezione)
+@st.fragment
+@timed('fragment:alternatives')
+def display_greener_alternatives(data, products):
+    st.markdown('<h2 class="sub-header">Alternative più sostenibili</h2>', unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        product = st.selectbox("Trova alternative simili a", products, key="alt_product")
+    
+    with col2:
+        k = st.number_input("Numero di alternative", 1, 20, 5, key="alt_k")
+    
+    # Solo prodotti senza segnali di greenwashing e con meno emissioni CO₂
+    alternatives = greener_alternatives(data, product, k=k)
+    
+    if len(alternatives) == 0:
+        st.info(f"Nessuna alternativa con emissioni inferiori a {product} e senza segnali di greenwashing.")
+        return
+    
+    st.dataframe(
+        alternatives.drop(columns='distance'),
+        hide_index=True,
+        column_config={
+            'product': 'Prodotto',
+            'esg_score': 'ESG Score',
+            'co2_emissions': 'Emissioni CO₂ (t)',
+            'green_activities': 'Attività Green (%)',
+            'similarity': st.column_config.ProgressColumn('Similarità', min_value=0, max_value=1,
+                                                          format="percent")
+        }
+    )
+
+# Archivi dei report: una cartella temporanea per sessione. Le cartelle non toccate da
+# REPORT_TTL secondi (sessioni chiuse) vengono rimosse alla generazione successiva
+REPORT_DIR_PREFIX = 'greeninvest_reports_'
+REPORT_TTL = 2 * 3600
+
+# Funzione per rimuovere le cartelle dei report scadute (tranne `keep`)
+def sweep_report_dirs(keep=None):
+    limit = time.time() - REPORT_TTL
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            if not entry.name.startswith(REPORT_DIR_PREFIX) or entry.path == keep:
+                continue
+            try:
+                stale = entry.is_dir() and entry.stat().st_mtime < limit
+            except OSError:
+                continue
+            if stale:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+# Funzione per ottenere la cartella dei report della sessione
+def session_report_dir():
+    path = st.session_state.get("report_dir")
+    if path is None or not os.path.isdir(path):
+        path = st.session_state["report_dir"] = tempfile.mkdtemp(prefix=REPORT_DIR_PREFIX)
+    return path
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# Funzione per esportare report in un archivio zip, con avanzamento e download
+# (frammento: la generazione non riesegue la pagina; l'archivio resta su disco e viene
+# letto solo quando l'utente clicca sul download)
+@st.fragment
+@timed('fragment:report_export')
+def report_export(key, make_reports, total, file_name):
+    formats = st.multiselect("Formati", FORMATS, default=list(FORMATS), key=f"{key}_formats")
+    if st.button(f"Genera {total} report", key=f"{key}_generate", disabled=not formats):
+        bar = st.progress(0.0, text="Generazione dei report...")
+        
+        def progress(done, total):
+            bar.progress(min(done / max(total, 1), 1.0), text=f"{done}/{total} report generati")
+        
+        directory = session_report_dir()
+        sweep_report_dirs(keep=directory)
+        # Un archivio per export: quello nuovo sostituisce il precedente solo se completo
+        path = os.path.join(directory, f"{key}.zip")
+        try:
+            export_zip(make_reports(), path + '.tmp', formats, total=total, progress=progress)
+            os.replace(path + '.tmp', path)
+        finally:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        st.session_state[f"{key}_path"] = path
+    
+    path = st.session_state.get(f"{key}_path")
+    if path and os.path.exists(path):
+        st.download_button("📥 Scarica i report (.zip)", partial(read_file, path), file_name=file_name,
+                           mime="application/zip", key=f"{key}_download")
+
+# Funzione per mostrare le metriche ESG aggregate dei portafogli clienti
+def display_portfolios(data, book, max_rows=1000):
+    st.subheader("Portafogli clienti")
+    
+    # Metriche di tutti i portafogli, già calcolate con un unico prodotto matriciale
+    metrics = book.metrics().sort_values('greenwashing_exposure', ascending=False)
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Clienti", len(metrics))
+    col2.metric("Patrimonio totale (€)", f"{metrics['value'].sum():,.0f}")
+    col3.metric("CO₂ finanziata (tonnellate)", f"{metrics['co2_financed'].sum():,.2f}")
+    
+    if book.missing:
+        products = sorted({str(product) for _, product, _ in book.missing})
+        st.warning(f"{len(book.missing)} posizioni escluse: prodotti non più presenti nell'universo "
+                   f"({', '.join(products[:5])}{', ...' if len(products) > 5 else ''}).")
+    
+    if len(metrics) > max_rows:
+        st.caption(f"Mostrati i {max_rows} portafogli con la maggiore esposizione al greenwashing.")
+    
+    st.dataframe(
+        metrics.head(max_rows),
+        hide_index=True,
+        column_config={
+            'client': 'Cliente',
+            'value': st.column_config.NumberColumn('Valore (€)', format="%.0f"),
+            'esg_score': st.column_config.NumberColumn('ESG Score medio', format="%.1f"),
+            'co2_financed': st.column_config.NumberColumn('CO₂ finanziata (t)', format="%.2f"),
+            'green_share': st.column_config.NumberColumn('Attività Green (%)', format="%.1f"),
+            'greenwashing_exposure': st.column_config.ProgressColumn(
+                'Esposizione greenwashing', min_value=0, max_value=1, format="percent")
+        }
+    )
+    
+    # Un report (sintesi e posizioni) per cliente, generati in parallelo
+    with st.expander("📄 Esporta i report dei clienti"):
+        report_export("portfolio_reports", lambda: portfolio_reports(data, book),
+                      len(book.clients), "report_portafogli.zip")
+
+# Funzione per il grafico della distribuzione delle perdite (istogramma già aggregato)
+def loss_distribution_chart(histogram, title):
+    chart = alt.Chart(histogram).mark_bar(color='#C0392B').encode(
+        x=alt.X('loss:Q', title=title, axis=alt.Axis(format='%')),
+        y=alt.Y('share:Q', title='Quota dei percorsi', axis=alt.Axis(format='%')),
+        tooltip=[alt.Tooltip('loss:Q', format='.1%'), alt.Tooltip('share:Q', format='.1%')]
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+# Numero di prodotti più esposti mostrati (e tenuti nella sessione) dopo una simulazione
+SCENARIO_TOP_PRODUCTS = 20
+
+# Rischio di transizione: scenari di prezzo del carbonio e simulazione Monte Carlo
+# (frammento: la simulazione parte solo all'invio del form; nella sessione restano solo i
+# risultati ridotti da mostrare, mai le perdite di ogni prodotto dell'universo)
+@st.fragment
+@timed('fragment:scenarios')
+def display_scenarios(data, book):
+    st.subheader("Rischio di transizione: prezzo del carbonio")
+    
+    with st.form("scenario_form"):
+        col1, col2 = st.columns(2)
+        scenario = col1.selectbox("Scenario di riferimento", list(SCENARIOS),
+                                  index=list(SCENARIOS).index(DEFAULT_SCENARIO))
+        n_paths = col2.select_slider("Percorsi Monte Carlo", [1000, 2000, 5000, 10000], value=2000)
+        volatility = col1.slider("Volatilità annua del prezzo", 0.0, 0.6, VOLATILITY, 0.05)
+        confidence = col2.selectbox("Livello di confidenza", [0.95, 0.99],
+                                    index=[0.95, 0.99].index(CONFIDENCE), format_func="{:.0%}".format)
+        submitted = st.form_submit_button("Esegui simulazione")
+    
+    if submitted:
+        with st.spinner(f"Simulazione di {n_paths} percorsi su {len(data)} prodotti..."):
+            paths = price_paths(n_paths, scenario, HORIZON_YEARS, volatility)
+            products = product_losses(data, paths, confidence)
+            portfolios = portfolio_losses(data, book, paths, confidence) if book is not None else None
+        # Mediana e percentili 5-95 dei percorsi simulati, con gli scenari deterministici
+        prices = pd.DataFrame(scenario_paths(horizon=HORIZON_YEARS).T, columns=list(SCENARIOS))
+        for label, q in (("Monte Carlo 5%", 0.05), ("Monte Carlo mediana", 0.5), ("Monte Carlo 95%", 0.95)):
+            prices[label] = np.quantile(paths, q, axis=0)
+        prices.index = pd.Index(np.arange(1, HORIZON_YEARS + 1), name='Anno')
+        
+        # Prodotti più esposti con le perdite degli scenari deterministici (cercati per nome)
+        top = products.nlargest(SCENARIO_TOP_PRODUCTS, 'expected_shortfall').reset_index(drop=True)
+        rows = data.iloc[index_for(data).positions(top['product'])]
+        results = {
+            'scenario': scenario,
+            'n_paths': n_paths,
+            'confidence': confidence,
+            'prices': prices,
+            'top': pd.concat([top, scenario_losses(rows).drop(columns='product')], axis=1),
+            'product_histogram': loss_histogram(products['expected_loss'].to_numpy()),
+        }
+        if portfolios is not None:
+            clients, book_losses = portfolios
+            results['book'] = (float(clients['value'].sum()),
+                               *(float(value) for value in tail_stats(book_losses, confidence)))
+            results['book_histogram'] = loss_histogram(book_losses)
+            results['clients'] = clients.sort_values('expected_shortfall', ascending=False).head(1000)
+        st.session_state['scenario_results'] = results
+    
+    results = st.session_state.get('scenario_results')
+    if results is None:
+        return
+    confidence = results['confidence']
+    st.caption(f"Scenario {results['scenario']}, {results['n_paths']} percorsi: perdite in valore attuale "
+               f"a {HORIZON_YEARS} anni, in percentuale del capitale investito.")
+    st.line_chart(results['prices'], y_label="Prezzo del carbonio (€/t)")
+    
+    if 'book' in results:
+        total, expected, var, shortfall = results['book']
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Perdita attesa del book", f"{expected:.1%}", f"{expected * total:,.0f} €", delta_color="off")
+        col2.metric(f"VaR {confidence:.0%}", f"{var:.1%}", f"{var * total:,.0f} €", delta_color="off")
+        col3.metric(f"Expected shortfall {confidence:.0%}", f"{shortfall:.1%}",
+                    f"{shortfall * total:,.0f} €", delta_color="off")
+        loss_distribution_chart(results['book_histogram'], "Perdita del book")
+        st.dataframe(
+            results['clients'],
+            hide_index=True,
+            column_config={
+                'client': 'Cliente',
+                'value': st.column_config.NumberColumn('Valore (€)', format="%.0f"),
+                'expected_loss': st.column_config.NumberColumn('Perdita attesa', format="percent"),
+                'var': st.column_config.NumberColumn(f"VaR {confidence:.0%}", format="percent"),
+                'expected_shortfall': st.column_config.NumberColumn('Expected shortfall', format="percent"),
+            }
+        )
+    
+    # Prodotti più esposti, con le perdite degli scenari deterministici
+    st.write("#### Prodotti più esposti")
+    loss_distribution_chart(results['product_histogram'], "Perdita attesa per prodotto")
+    st.dataframe(
+        results['top'],
+        hide_index=True,
+        column_config={
+            'product': 'Prodotto',
+            'expected_loss': st.column_config.NumberColumn('Perdita attesa', format="percent"),
+            'var': st.column_config.NumberColumn(f"VaR {confidence:.0%}", format="percent"),
+            'expected_shortfall': st.column_config.NumberColumn('Expected shortfall', format="percent"),
+            **{name: st.column_config.NumberColumn(name, format="percent") for name in SCENARIOS}
+        }
+    )
+
+# Funzione per costruire un portafoglio ESG ottimizzato con i vincoli dell'utente
+# (frammento: l'invio del form riesegue solo l'ottimizzazione)
+@st.fragment
+@timed('fragment:portfolio_builder')
+def display_portfolio_builder(data):
+    index = index_for(data)
+    
+    with st.form("portfolio_form"):
+        st.markdown("### Crea il tuo portafoglio ESG")
+        
+        co2_budget = st.slider(
+            "Emissioni CO₂ medie massime (tonnellate)",
+            float(np.floor(index.min_co2)), float(np.ceil(index.max_co2)), float(np.ceil(index.max_co2))
+        )
+        min_green = st.slider("Attività green minime (%)", 0, 100, 50)
+        max_weight = st.slider("Peso massimo per prodotto (%)", 5, 100, 40) / 100
+        exclude_greenwashing = st.checkbox("Escludi i prodotti con segnali di greenwashing", value=True)
+        
+        submitted = st.form_submit_button("Crea il tuo portafoglio ESG")
+    
+    if not submitted:
+        return
+    
+    # La soluzione precedente della sessione fa da punto di partenza (warm start):
+    # salvata per nome, perché le posizioni cambiano con gli aggiornamenti dell'universo
+    warm_start = index.find(st.session_state.get("portfolio_warm_start", []))
+    result = optimize(
+        problem_arrays(data),
+        {
+            'co2_budget': co2_budget,
+            'min_green': min_green,
+            'max_weight': max_weight,
+            'exclude_greenwashing': exclude_greenwashing
+        },
+        warm_start=warm_start[warm_start >= 0]
+    )
+    
+    if result['status'] != 'optimal':
+        st.warning("Nessun portafoglio soddisfa tutti i vincoli: prova ad allentare i limiti.")
+        return
+    
+    st.session_state["portfolio_warm_start"] = data['product'].iloc[result['positions']].tolist()
+    st.success("Portafoglio creato con successo!")
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("ESG Score medio", f"{result['esg_score']:.1f}")
+    col2.metric("Emissioni CO₂ medie (tonnellate)", f"{result['co2_emissions']:.1f}")
+    col3.metric("Attività Green (%)", f"{result['green_activities']:.1f}")
+    
+    st.dataframe(
+        pd.DataFrame({
+            'Prodotto': data['product'].iloc[result['positions']].to_numpy(dtype=object),
+            'Peso': result['weights']
+        }),
+        hide_index=True,
+        column_config={
+            'Peso': st.column_config.ProgressColumn('Peso', min_value=0, max_value=1, format="percent")
+        }
+    )
 
 # Funzione per creare un grafico a torta semplificato
 def create_pie_chart(green_percentage):
@@ -216,6 +888,276 @@ def create_pie_chart(green_percentage):
     # Usa st.progress invece di un grafico a torta
     st.progress(green_percentage/100)
 
+# Form di profilazione: all'invio viene rieseguito solo questo frammento
+@st.fragment
+def profiling_form(data):
+    with st.form("profiling_form"):
+        profile_type = st.selectbox(
+            "Scegli il tuo profilo", 
+            ["Investitore Privato", "Consulente Finanziario"]
+        )
+        
+        age = st.slider("Età", 18, 80, 35)
+        
+        experience = st.select_slider(
+            "Esperienza negli investimenti",
+            options=["Principiante", "Intermedio", "Avanzato", "Esperto"]
+        )
+        
+        esg_interest = st.radio(
+            "Interesse per le tematiche ESG",
+            ["Alto", "Medio", "Basso"]
+        )
+        
+        submitted = st.form_submit_button("Conferma profilo")
+        
+        if submitted and save_submission("profiling_form", {
+            'profile_type': profile_type, 'age': age,
+            'experience': experience, 'esg_interest': esg_interest,
+        }):
+            st.success("Profilo salvato con successo!")
+            
+            # Mostra risultato
+            st.markdown("""
+            ### Riepilogo profilo
+            """)
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.info(f"**Tipo profilo**: {profile_type}")
+                st.info(f"**Età**: {age} anni")
+            
+            with col2:
+                st.info(f"**Esperienza**: {experience}")
+                st.info(f"**Interesse ESG**: {esg_interest}")
+            
+            # Prodotti consigliati: classifica precalcolata per la fascia del profilo
+            display_recommendations(data, profile_bucket(profile_type, age, experience, esg_interest))
+            
+            # Suggerimento personalizzato
+            if profile_type == "Investitore Privato":
+                if esg_interest == "Alto":
+                    st.markdown("""
+                    <div class="green-alert">
+                        <b>Suggerimento</b>: Data la tua alta sensibilità alle tematiche ESG, 
+                        ti consigliamo di esplorare i prodotti con punteggio superiore a 80 e 
+                        verificare sempre la percentuale di attività green per evitare il greenwashing.
+                    </div>
+                    """, unsafe_allow_html=True)
+                else:
+                    st.markdown("""
+                    <div class="green-alert">
+                        <b>Suggerimento</b>: Anche con un interesse moderato per l'ESG, 
+                        puoi trovare prodotti finanziari che bilanciano rendimento e sostenibilità.
+                    </div>
+                    """, unsafe_allow_html=True)
+            else:  # Consulente finanziario
+                st.markdown("""
+                <div class="green-alert">
+                    <b>Suggerimento</b>: Utilizza il comparatore per analizzare in dettaglio 
+                    le caratteristiche ESG dei prodotti e offrire consulenze più precise ai tuoi clienti.
+                </div>
+                """, unsafe_allow_html=True)
+
+# Funzione per mostrare i prodotti consigliati per una fascia di profilo
+@timed('recommendations')
+def display_recommendations(data, bucket):
+    products = recommend(data, bucket)
+    if not products:
+        return
+    rows = data.iloc[index_for(data).positions(products)]
+    st.markdown("### Prodotti consigliati per il tuo profilo")
+    st.dataframe(
+        pd.DataFrame({
+            'Prodotto': rows['product'].to_numpy(),
+            'ESG Score': rows['esg_score'].to_numpy(),
+            'Attività green (%)': rows['green_activities'].to_numpy(),
+            'Emissioni CO₂ (t)': rows['co2_emissions'].to_numpy(dtype=np.float64).round(1),
+            'Greenwashing': np.where(rows['greenwashing_flag'].to_numpy(), "⚠️ Sospetto", "✅ No"),
+        }),
+        hide_index=True
+    )
+
+# Sezione prodotti della dashboard (filtri, panoramica, lista paginata, tabella)
+@st.fragment
+@timed('fragment:dashboard')
+def dashboard_products(data):
+    # Filtri lato server, comuni a grafico e lista prodotti
+    positions, key = display_product_filters(data)
+    
+    # Grafico generale dei punteggi ESG (dati aggregati, dimensione limitata)
+    st.subheader("Panoramica ESG Score")
+    display_overview_chart(data, positions, key)
+    
+    # Mostra dettaglio dei prodotti: si disegna solo la pagina visibile
+    st.subheader("Dettaglio prodotti finanziari")
+    page_rows = display_product_list(data, positions)
+    
+    # Visualizzazione tabellare
+    st.subheader("Vista tabellare")
+    display_product_table(page_rows, load_history_data())
+
+# Comparatore: selezione dei prodotti, confronto e alternative più sostenibili
+@st.fragment
+@timed('fragment:comparator')
+def comparator(data):
+    # Selezione prodotti da confrontare: le opzioni sono la selezione corrente più i
+    # candidati della ricerca per prefisso, non l'intero universo
+    if "cmp_selected" not in st.session_state:
+        st.session_state["cmp_selected"] = data['product'].iloc[:2].tolist()
+    index = index_for(data)
+    current = [product for product in st.session_state["cmp_selected"] if product in index]
+    text = st.text_input("Cerca un prodotto da aggiungere", key="cmp_search",
+                         placeholder="Inizio del nome del prodotto")
+    candidates = index.search(text)
+    chosen = set(current)
+    options = current + [product for product in candidates if product not in chosen]
+    st.session_state["cmp_selected"] = current
+    selected = st.multiselect(
+        "Seleziona i prodotti da confrontare",
+        options,
+        key="cmp_selected",
+        max_selections=MAX_COMPARE
+    )
+    if text and not candidates:
+        st.caption("Nessun prodotto trovato con questo nome.")
+    
+    # Confronto
+    if len(selected) == 2:
+        compare_products(data, selected[0], selected[1])
+    elif len(selected) > 2:
+        compare_many_products(data, selected)
+    else:
+        st.warning("Per favore seleziona almeno due prodotti diversi per il confronto.")
+    
+    # Report del confronto e scheda di ogni prodotto selezionato
+    if len(selected) >= 2:
+        with st.expander("📄 Esporta il confronto"):
+            groups = [selected] + [[product] for product in selected]
+            report_export("comparison_reports", lambda: comparison_reports(data, groups),
+                          len(groups), "report_confronto.zip")
+    
+    # Ricerca di alternative simili ma più green (k-NN sulle feature normalizzate)
+    if selected:
+        display_greener_alternatives(data, selected)
+
+# Marketplace: ricerca testuale, filtri e ordinamento sul catalogo indicizzato (solo la pagina visibile)
+MARKETPLACE_SORTS = {
+    "Rilevanza": SORT_RELEVANCE,
+    "Rendimento atteso": SORT_RETURN,
+    "Investimento minimo": SORT_INVESTMENT,
+}
+MARKETPLACE_PAGE_SIZE = 10
+
+@st.fragment
+@timed('fragment:marketplace')
+def marketplace(catalog):
+    text = st.text_input("Cerca nel marketplace", placeholder="es. solare, Coop, ecosistemi marini")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        partners = st.multiselect("Partner", catalog.partners)
+    with col2:
+        budget = st.number_input("Budget disponibile (€)", min_value=0, value=0, step=500,
+                                 help="0 = nessun limite")
+    with col3:
+        min_return = st.slider("Rendimento atteso minimo (%)", 0.0, 10.0, 0.0, 0.5)
+    with col4:
+        sort = st.selectbox("Ordina per", list(MARKETPLACE_SORTS))
+    
+    query = dict(
+        text=text, partners=partners, max_investment=budget or None,
+        return_range=(min_return, None) if min_return else None,
+        sort=MARKETPLACE_SORTS[sort],
+    )
+    listings, total = catalog.search(**query, page_size=MARKETPLACE_PAGE_SIZE)
+    if not total:
+        st.info("Nessuna offerta corrisponde ai criteri di ricerca.")
+        return
+    
+    pages = -(-total // MARKETPLACE_PAGE_SIZE)
+    if pages > 1:
+        page = st.number_input(f"Pagina (di {pages})", min_value=1, max_value=pages, value=1)
+        if page > 1:
+            listings, total = catalog.search(**query, page=page, page_size=MARKETPLACE_PAGE_SIZE)
+    st.caption(f"{total} offerte trovate")
+    
+    for item in listings:
+        st.markdown(marketplace_card_html(item['name'], item['partner'], f"{item['min_investment']:,.0f}",
+                                          f"{item['expected_return']:.1f}%", item['impact']),
+                    unsafe_allow_html=True)
+
+# Form dei contatti: all'invio viene rieseguito solo questo frammento
+@st.fragment
+def contact_form():
+    with st.form("contact_form"):
+        st.markdown("### Richiedi informazioni")
+        
+        name = st.text_input("Nome e Cognome")
+        email = st.text_input("Email")
+        phone = st.text_input("Telefono")
+        
+        interest = st.multiselect(
+            "Sono interessato a",
+            ["Investimenti ESG", "Consulenza finanziaria", "Corsi formativi", "Partnership"]
+        )
+        
+        message = st.text_area("Messaggio")
+        
+        submitted = st.form_submit_button("Invia richiesta")
+        
+        if submitted and save_submission("contact_form", {
+            'name': name, 'email': email, 'phone': phone,
+            'interest': interest, 'message': message,
+        }):
+            st.success("Grazie per il tuo interesse! Ti contatteremo presto.")
+
+# Stato del salvataggio dei moduli: record in attesa, salvati e transazioni non riuscite
+def display_submission_status():
+    try:
+        stats = submission_queue(os.environ.get('GREENINVEST_SUBMISSIONS_DB')).stats()
+    except (OSError, sqlite3.Error) as e:
+        st.warning(f"Database dei moduli non disponibile: {e}")
+        return
+    st.markdown("**Salvataggio moduli**")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("In attesa", stats['backlog'])
+    col2.metric("Salvati", stats['committed'])
+    col3.metric("Tentativi falliti", stats['failures'])
+    if stats['recovered']:
+        st.caption(f"{stats['recovered']} moduli recuperati dal journal all'avvio.")
+    if stats['last_error'] is not None:
+        st.warning(f"Ultimo errore del database: {stats['last_error']}")
+
+# Pannello amministrativo nella sidebar: latenze (sessione e processo) e cache
+def display_admin_panel():
+    with st.sidebar.expander("Prestazioni (admin)"):
+        display_submission_status()
+        if not metrics_enabled():
+            st.caption("Strumentazione disattivata (GREENINVEST_METRICS=1 per attivarla).")
+            return
+        
+        def latency_table(stats):
+            return pd.DataFrame([
+                {'Operazione': name, 'N': s['count'], 'p50 (ms)': s['p50'] * 1000,
+                 'p95 (ms)': s['p95'] * 1000, 'Max (ms)': s['max'] * 1000}
+                for name, s in stats.items() if s['count']
+            ])
+        
+        st.markdown("**Questa sessione**")
+        st.dataframe(latency_table(summary(st.session_state)), hide_index=True)
+        st.markdown("**Tutte le sessioni**")
+        st.dataframe(latency_table(summary()), hide_index=True)
+        st.markdown("**Cache**")
+        st.dataframe(pd.DataFrame([
+            {'Cache': name, 'Hit': hits, 'Miss': misses, 'Voci': size,
+             'Hit ratio': hits / (hits + misses) if hits + misses else None}
+            for name, (hits, misses, size, _) in cache_stats().items()
+        ]), hide_index=True, column_config={
+            'Hit ratio': st.column_config.ProgressColumn("Hit ratio", min_value=0, max_value=1, format="percent"),
+        })
+
 # Funzione principale per l'app
 def main():
     # Applicare stili CSS
@@ -234,8 +1176,10 @@ def main():
     
     selection = st.sidebar.radio("Navigazione", pages)
     
-    # Generare dati (simulati)
-    data = generate_esg_data()
+    # Caricare i dati (da cache, riletti solo se il file sorgente cambia)
+    with timer('load_data', st.session_state):
+        data = load_esg_data()
+    page_start = time.perf_counter()
     
     # Gestione delle pagine
     if selection == "Homepage":
@@ -280,69 +1224,11 @@ def main():
         la tua esperienza su GreenInvest+.
         """)
         
-        # Form di profilazione
-        with st.form("profiling_form"):
-            profile_type = st.selectbox(
-                "Scegli il tuo profilo", 
-                ["Investitore Privato", "Consulente Finanziario"]
-            )
-            
-            age = st.slider("Età", 18, 80, 35)
-            
-            experience = st.select_slider(
-                "Esperienza negli investimenti",
-                options=["Principiante", "Intermedio", "Avanzato", "Esperto"]
-            )
-            
-            esg_interest = st.radio(
-                "Interesse per le tematiche ESG",
-                ["Alto", "Medio", "Basso"]
-            )
-            
-            submitted = st.form_submit_button("Conferma profilo")
-            
-            if submitted:
-                st.success("Profilo salvato con successo!")
-                
-                # Mostra risultato
-                st.markdown("""
-                ### Riepilogo profilo
-                """)
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.info(f"**Tipo profilo**: {profile_type}")
-                    st.info(f"**Età**: {age} anni")
-                
-                with col2:
-                    st.info(f"**Esperienza**: {experience}")
-                    st.info(f"**Interesse ESG**: {esg_interest}")
-                
-                # Suggerimento personalizzato
-                if profile_type == "Investitore Privato":
-                    if esg_interest == "Alto":
-                        st.markdown("""
-                        <div class="green-alert">
-                            <b>Suggerimento</b>: Data la tua alta sensibilità alle tematiche ESG, 
-                            ti consigliamo di esplorare i prodotti con punteggio superiore a 80 e 
-                            verificare sempre la percentuale di attività green per evitare il greenwashing.
-                        </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.markdown("""
-                        <div class="green-alert">
-                            <b>Suggerimento</b>: Anche con un interesse moderato per l'ESG, 
-                            puoi trovare prodotti finanziari che bilanciano rendimento e sostenibilità.
-                        </div>
-                        """, unsafe_allow_html=True)
-                else:  # Consulente finanziario
-                    st.markdown("""
-                    <div class="green-alert">
-                        <b>Suggerimento</b>: Utilizza il comparatore per analizzare in dettaglio 
-                        le caratteristiche ESG dei prodotti e offrire consulenze più precise ai tuoi clienti.
-                    </div>
-                    """, unsafe_allow_html=True)
+        # Classifiche dei prodotti per tutte le fasce di profilo (una volta per versione dell'universo)
+        warm_up(data)
+        
+        # Form di profilazione (rieseguito da solo all'invio)
+        profiling_form(data)
 
     elif selection == "Dashboard Portafoglio ESG":
         st.markdown('<h1 class="main-header">Dashboard Portafoglio ESG</h1>', unsafe_allow_html=True)
@@ -351,94 +1237,27 @@ def main():
         Esplora gli strumenti finanziari selezionati e le loro caratteristiche di sostenibilità.
         """)
         
-        # Grafico generale dei punteggi ESG
-        st.subheader("Panoramica ESG Score")
-        
-        chart_data = pd.DataFrame({
-            'product': data['product'],
-            'esg_score': data['esg_score']
-        })
-        
-        # Utilizziamo un approccio diverso per il colore in base al valore
-        # Creiamo una colonna per il colore
-        chart_data['color'] = chart_data['esg_score'].apply(
-            lambda x: 'green' if x > 80 else ('orange' if x > 60 else 'red')
-        )
+        # Filtri, grafico, lista e tabella: un cambio di filtro riesegue solo questa sezione
+        dashboard_products(data)
         
-        chart = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X('product', sort=None, title='Prodotto Finanziario'),
-            y=alt.Y('esg_score', title='ESG Score'),
-            color=alt.Color('color:N', scale=None),  # Usa direttamente il valore del colore
-            tooltip=['product', 'esg_score']
-        ).properties(
-            width=700,
-            height=400
-        )
+        # Metriche aggregate dei portafogli clienti (per i consulenti)
+        book = load_portfolio_data(data)
+        if book is not None:
+            display_portfolios(data, book)
         
-        st.altair_chart(chart, use_container_width=True)
-        
-        # Mostra dettaglio di ogni prodotto
-        st.subheader("Dettaglio prodotti finanziari")
-        
-        for i, row in data.iterrows():
-            with st.expander(f"{row['product']} - ESG Score: {row['esg_score']}"):
-                col1, col2 = st.columns([2, 1])
-                
-                with col1:
-                    # ESG Score con barra colorata
-                    display_esg_score(row['esg_score'])
-                    
-                    # Altre metriche
-                    st.metric("Emissioni CO₂ (tonnellate)", row['co2_emissions'])
-                    st.metric("Attività Green (%)", row['green_activities'])
-                    
-                    # Alert per greenwashing
-                    if row['greenwashing_flag']:
-                        st.markdown("""
-                        <div class="red-alert">
-                            ⚠️ <b>Greenwashing Alert</b>: Questo prodotto ha un alto ESG score 
-                            ma una bassa percentuale di attività effettivamente green.
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                with col2:
-                    # Mini grafico a torta per % attività green usando componenti Streamlit nativi
-                    create_pie_chart(row['green_activities'])
-        
-        # Visualizzazione tabellare
-        st.subheader("Vista tabellare")
-        st.dataframe(data[['product', 'esg_score', 'co2_emissions', 'green_activities']])
+        # Perdite da prezzo del carbonio di prodotti e portafogli (scenari e Monte Carlo)
+        display_scenarios(data, book)
 
     elif selection == "Comparatore":
         st.markdown('<h1 class="main-header">Comparatore Strumenti Finanziari</h1>', unsafe_allow_html=True)
         
-        st.markdown("""
-        Confronta due strumenti finanziari per analizzare le loro caratteristiche ESG 
+        st.markdown(f"""
+        Confronta fino a {MAX_COMPARE} strumenti finanziari per analizzare le loro caratteristiche ESG 
         e prendere decisioni di investimento più consapevoli.
         """)
         
-        # Selezione prodotti da confrontare
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            product1 = st.selectbox(
-                "Seleziona il primo prodotto",
-                data['product'].tolist(),
-                index=0
-            )
-        
-        with col2:
-            product2 = st.selectbox(
-                "Seleziona il secondo prodotto",
-                data['product'].tolist(),
-                index=1
-            )
-        
-        # Confronto
-        if product1 != product2:
-            compare_products(data, product1, product2)
-        else:
-            st.warning("Per favore seleziona due prodotti diversi per il confronto.")
+        # Selezione e confronto: un cambio di selezione riesegue solo questa sezione
+        comparator(data)
 
     elif selection == "Partner & Marketplace":
         st.markdown('<h1 class="main-header">Partner & Marketplace</h1>', unsafe_allow_html=True)
@@ -449,46 +1268,11 @@ def main():
         """)
         
         # Creiamo 3 colonne per i partner
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            st.markdown("""
-            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; height: 300px;">
-                <h3 style="color: #2E86C1">Intesa Sanpaolo</h3>
-                <p><i>Incumbent Finanziario</i></p>
-                <div style="background-color: #2E86C1; color: white; text-align: center; padding: 10px; border-radius: 5px; width: 150px; margin: 10px 0;">
-                    <strong>Intesa Sanpaolo</strong>
-                </div>
-                <p>Intesa Sanpaolo fornisce accesso ai dati ESG dei propri prodotti finanziari, 
-                   arricchendo GreenInvest+ con una vasta gamma di strumenti d'investimento certificati.</p>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown("""
-            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; height: 300px;">
-                <h3 style="color: #2E86C1">Clarity AI</h3>
-                <p><i>Startup Innovativa</i></p>
-                <div style="background-color: #1E8449; color: white; text-align: center; padding: 10px; border-radius: 5px; width: 150px; margin: 10px 0;">
-                    <strong>Clarity AI</strong>
-                </div>
-                <p>Clarity AI utilizza tecnologie di Intelligenza Artificiale per analizzare l'impatto ESG 
-                   delle aziende, fornendo a GreenInvest+ dati affidabili e trasparenti.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        for col, partner in zip(st.columns(len(PARTNERS)), PARTNERS):
+            with col:
+                st.markdown(partner_card_html(*partner), unsafe_allow_html=True)
         
-        with col3:
-            st.markdown("""
-            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; height: 300px;">
-                <h3 style="color: #2E86C1">Coop</h3>
-                <p><i>Partner di diverso settore</i></p>
-                <div style="background-color: #E74C3C; color: white; text-align: center; padding: 10px; border-radius: 5px; width: 150px; margin: 10px 0;">
-                    <strong>Coop</strong>
-                </div>
-                <p>Coop collabora con GreenInvest+ per promuovere l'educazione finanziaria sostenibile 
-                   tra i suoi soci, offrendo workshop e contenuti formativi.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        display_partner_feeds()
         
         # Marketplace
         st.markdown('<h2 class="sub-header">Marketplace Sostenibile</h2>', unsafe_allow_html=True)
@@ -497,26 +1281,8 @@ def main():
         Esplora le opportunità di investimento sostenibile disponibili attraverso i nostri partner.
         """)
         
-        # Simulazione card prodotti in marketplace
-        marketplace_data = [
-            {"name": "Green Bond Facility", "partner": "Intesa Sanpaolo", "min_investment": 5000, "expected_return": "2.5%", "impact": "Finanziamento progetti energie rinnovabili"},
-            {"name": "Ocean Fund", "partner": "Clarity AI", "min_investment": 10000, "expected_return": "3.8%", "impact": "Protezione ecosistemi marini"},
-            {"name": "Community Impact ETF", "partner": "Coop", "min_investment": 1000, "expected_return": "2.2%", "impact": "Sviluppo comunità locali sostenibili"}
-        ]
-        
-        for i, item in enumerate(marketplace_data):
-            st.markdown(f"""
-            <div style="border: 1px solid #ddd; border-radius: 10px; padding: 1rem; margin-bottom: 1rem;">
-                <h3>{item['name']}</h3>
-                <p><b>Partner:</b> {item['partner']}</p>
-                <p><b>Investimento minimo:</b> €{item['min_investment']}</p>
-                <p><b>Rendimento atteso:</b> {item['expected_return']}</p>
-                <p><b>Impatto:</b> {item['impact']}</p>
-                <button style="background-color: #2E86C1; color: white; border: none; padding: 0.5rem 1rem; border-radius: 5px; cursor: pointer;">
-                    Scopri di più
-                </button>
-            </div>
-            """, unsafe_allow_html=True)
+        # Catalogo delle offerte dei partner con ricerca e filtri
+        marketplace(load_marketplace())
 
     elif selection == "Contatti":
         st.markdown('<h1 class="main-header">Contatti & Call to Action</h1>', unsafe_allow_html=True)
@@ -550,35 +1316,23 @@ def main():
             """, unsafe_allow_html=True)
         
         with col2:
-            with st.form("contact_form"):
-                st.markdown("### Richiedi informazioni")
-                
-                name = st.text_input("Nome e Cognome")
-                email = st.text_input("Email")
-                phone = st.text_input("Telefono")
-                
-                interest = st.multiselect(
-                    "Sono interessato a",
-                    ["Investimenti ESG", "Consulenza finanziaria", "Corsi formativi", "Partnership"]
-                )
-                
-                message = st.text_area("Messaggio")
-                
-                submitted = st.form_submit_button("Invia richiesta")
-                
-                if submitted:
-                    st.success("Grazie per il tuo interesse! Ti contatteremo presto.")
+            contact_form()
         
         # Call to Action principale
         st.markdown("""
         <div style="text-align: center; margin-top: 2rem; padding: 2rem; background-color: #D5F5E3; border-radius: 10px;">
             <h2>Sei pronto a creare il tuo primo portafoglio ESG?</h2>
             <p style="font-size: 1.2rem;">Inizia ora il tuo percorso verso investimenti più sostenibili e consapevoli.</p>
-            <button style="background-color: #1E8449; color: white; border: none; padding: 1rem 2rem; border-radius: 5px; font-size: 1.2rem; cursor: pointer; margin-top: 1rem;">
-                Crea il tuo portafoglio ESG
-            </button>
         </div>
         """, unsafe_allow_html=True)
+        
+        # Costruzione del portafoglio ottimizzato con i vincoli ESG scelti
+        display_portfolio_builder(data)
+    
+    if metrics_enabled():
+        observe(f'page:{selection}', time.perf_counter() - page_start, st.session_state)
+    if os.environ.get('GREENINVEST_ADMIN') == '1':
+        display_admin_panel()
     
     # Footer
     st.markdown("""
@@ -589,4 +1343,8 @@ def main():
     """, unsafe_allow_html=True)
 
 if __name__ == '__main__':
-    main()
+    with timer('rerun', st.session_state):
+        main()
+    metrics_file = os.environ.get('GREENINVEST_METRICS_FILE')
+    if metrics_file and metrics_enabled():
+        write_prometheus(metrics_file, min_interval=10)
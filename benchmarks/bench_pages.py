@@ -0,0 +1,305 @@
+# Benchmark delle pagine dell'app con universi simulati di dimensione crescente
+#
+#   python benchmarks/bench_pages.py                       # confronto con baseline.json
+#   python benchmarks/bench_pages.py --sizes 10 1000       # solo alcune dimensioni
+#   python benchmarks/bench_pages.py --update-baseline     # registra i valori attuali
+#
+# Ogni pagina di main() viene eseguita senza browser (streamlit AppTest) con un
+# universo Parquet di N prodotti simulati (greeninvest.synthetic) indicato
+# tramite GREENINVEST_UNIVERSE. Per ogni pagina si misurano: tempo di
+# riesecuzione (mediana), picco di memoria Python (tracemalloc), elementi
+# emessi e byte dei messaggi inviati al browser.
+# Seguono microbenchmark di compare_products, del calcolo del greenwashing e
+# della costruzione del grafico di panoramica. I risultati sono confrontati con
+# la baseline: ogni peggioramento oltre la tolleranza viene elencato e il
+# comando termina con codice 1.
+# I tempi dipendono dalla macchina: prima delle misure si esegue un carico fisso
+# di calibrazione (numpy, pandas e Python puro) e i tempi vengono riportati alla
+# velocità della macchina della baseline prima del confronto. I byte inviati al
+# browser hanno invece un tetto assoluto per pagina (PAYLOAD_LIMITS), valido a
+# ogni dimensione dell'universo: una pagina non deve crescere con il numero di
+# prodotti.
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP = os.path.join(ROOT, 'ESG1.py')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+PAGES = ["Homepage", "Profilazione", "Dashboard Portafoglio ESG",
+         "Comparatore", "Partner & Marketplace", "Contatti"]
+SIZES = [10, 10 ** 3, 10 ** 5, 10 ** 6]
+
+# Thread di precalcolo avviati dalle pagine (attesi prima delle riesecuzioni cronometrate)
+BACKGROUND_THREADS = ('recommendations',)
+
+# Tolleranze: relative (rispetto alla baseline) e assolute (rumore di misura)
+TOLERANCES = {
+    'time_ms': (0.5, 5.0),
+    'peak_mb': (0.25, 2.0),
+    'elements': (0.0, 0),
+    'payload_bytes': (0.1, 512),
+}
+
+# Byte massimi inviati al browser da una riesecuzione, per pagina (PAYLOAD_LIMIT se assente)
+PAYLOAD_LIMIT = 64 * 1024
+PAYLOAD_LIMITS = {}
+
+# Chiave della baseline con il tempo del carico di calibrazione
+CALIBRATION = 'calibration'
+
+def universe_file(workdir, n):
+    from greeninvest.synthetic import generate_universe
+    path = os.path.join(workdir, f'synthetic_{n}.parquet')
+    if not os.path.exists(path):
+        generate_universe(n, seed=0).to_parquet(path, index=False)
+    return path
+
+
+# Messaggi dell'ultima esecuzione di AppTest (per contare elementi e byte)
+_messages = []
+
+
+def _record_messages():
+    from streamlit.testing.v1 import local_script_runner
+    parse = local_script_runner.parse_tree_from_messages
+
+    def recording_parse(messages):
+        _messages[:] = messages
+        return parse(messages)
+
+    local_script_runner.parse_tree_from_messages = recording_parse
+
+
+def _payload():
+    elements = sum(1 for m in _messages if m.WhichOneof('type') == 'delta'
+                   and m.delta.WhichOneof('type') == 'new_element')
+    return elements, sum(m.ByteSize() for m in _messages)
+
+
+def _check(at, page):
+    if at.exception:
+        raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+
+# Esegue una pagina: prima visualizzazione, riesecuzioni cronometrate e una misurata con tracemalloc
+def bench_page(page, repeats):
+    from streamlit.testing.v1 import AppTest
+    # Le pagine precedenti non devono pesare sui tempi di questa (garbage collection)
+    gc.collect()
+    at = AppTest.from_file(APP, default_timeout=600)
+    at.run()
+    start = time.perf_counter()
+    at.sidebar.radio[0].set_value(page).run()
+    first_ms = (time.perf_counter() - start) * 1000
+    _check(at, page)
+    # I precalcoli avviati in sfondo dalla pagina non devono finire nelle misure successive
+    for thread in threading.enumerate():
+        if thread.name in BACKGROUND_THREADS:
+            thread.join()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        at.run()
+        times.append((time.perf_counter() - start) * 1000)
+    _check(at, page)
+    elements, payload = _payload()
+
+    tracemalloc.start()
+    at.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'first_ms': round(first_ms, 2),
+        'time_ms': round(statistics.median(times), 2),
+        'peak_mb': round(peak / 2 ** 20, 2),
+        'elements': elements,
+        'payload_bytes': payload,
+    }
+
+
+def _best_ms(fn, repeats):
+    fn()
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3)
+
+
+# Microbenchmark delle funzioni principali sull'universo caricato
+def bench_micro(path, repeats):
+    import ESG1
+    from greeninvest.aggregation import MODE_HISTOGRAM, MODE_TOP, overview_chart_data
+    from greeninvest.loader import load_universe
+    from greeninvest.rules import default_engine
+
+    data = load_universe(path)
+    products = data['product'].iloc[[0, len(data) - 1]].tolist()
+    # Filtro che esclude metà dei prodotti: i grafici non usano le statistiche precalcolate
+    positions = np.flatnonzero(data['esg_score'].to_numpy() >= np.median(data['esg_score'].to_numpy()))
+
+    def chart():
+        for mode in (MODE_HISTOGRAM, MODE_TOP):
+            mode, frame = overview_chart_data(data, mode, positions=positions)
+            ESG1.overview_chart(mode, None, frame).to_dict()
+
+    return {
+        'compare_products_ms': _best_ms(lambda: ESG1.compare_products(data, *products), repeats),
+        'greenwashing_ms': _best_ms(lambda: default_engine().apply(data), repeats),
+        'chart_ms': _best_ms(chart, repeats),
+    }
+
+
+# Carico fisso (ordinamenti, raggruppamento pandas, ciclo Python) per stimare la velocità della macchina
+def calibrate(repeats):
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    values = rng.random(1 << 21)
+    frame = pd.DataFrame({'key': rng.integers(0, 1000, 1 << 18), 'value': values[:1 << 18]})
+
+    def work():
+        np.sort(values)
+        frame.groupby('key')['value'].mean()
+        sum(i * i for i in range(1_000_000))
+
+    return {'calibration_ms': _best_ms(work, repeats)}
+
+
+def run(sizes, repeats, workdir):
+    from greeninvest.loader import clear_cache
+
+    _record_messages()
+    for name in list(os.environ):
+        if name.startswith('GREENINVEST_'):
+            del os.environ[name]
+
+    results = {CALIBRATION: calibrate(repeats)}
+    print(f"{'calibrazione':<28} {results[CALIBRATION]['calibration_ms']:>20.1f} ms", flush=True)
+    for n in sizes:
+        path = universe_file(workdir, n)
+        os.environ['GREENINVEST_UNIVERSE'] = path
+        clear_cache()
+        for page in PAGES:
+            result = bench_page(page, repeats)
+            results[f'{page}@{n}'] = result
+            print(f"{page:<28} {n:>9}  {result['time_ms']:>9.1f} ms  {result['peak_mb']:>8.1f} MB  "
+                  f"{result['elements']:>5} el.  {result['payload_bytes']:>10} B", flush=True)
+        micro = bench_micro(path, repeats)
+        results[f'micro@{n}'] = micro
+        print(f"{'microbenchmark':<28} {n:>9}  " +
+              "  ".join(f"{k} {v:.2f}" for k, v in micro.items()), flush=True)
+        clear_cache()
+    return results
+
+
+# Fattore per riportare i tempi misurati alla velocità della macchina della baseline
+def _speed(results, baseline):
+    current = results.get(CALIBRATION, {}).get('calibration_ms')
+    reference = baseline.get(CALIBRATION, {}).get('calibration_ms')
+    if not current or not reference:
+        return 1.0
+    return reference / current
+
+
+# Confronta con la baseline (tempi normalizzati con la calibrazione) e con i tetti dei byte
+# per pagina; restituisce le righe dei peggioramenti
+def regressions(results, baseline, scale=1.0):
+    found = []
+    speed = _speed(results, baseline)
+    for key, values in results.items():
+        if key == CALIBRATION:
+            continue
+        page = key.rpartition('@')[0]
+        if 'payload_bytes' in values and page in PAGES:
+            limit = PAYLOAD_LIMITS.get(page, PAYLOAD_LIMIT)
+            if values['payload_bytes'] > limit:
+                found.append(f"{key} payload_bytes: {values['payload_bytes']} (tetto {limit})")
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, value in values.items():
+            if metric not in reference:
+                continue
+            relative, absolute = TOLERANCES.get(metric, TOLERANCES['time_ms'])
+            if metric.endswith('_ms'):
+                relative, absolute = relative * scale, absolute * scale
+                value = round(value * speed, 2)
+            limit = reference[metric] * (1 + relative) + absolute
+            if value > limit:
+                found.append(f"{key} {metric}: {value} (baseline {reference[metric]}, limite {limit:.2f})")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark delle pagine di GreenInvest+')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numero di prodotti')
+    parser.add_argument('--repeats', type=int, default=5, help='riesecuzioni per misura')
+    parser.add_argument('--baseline', default=BASELINE, help='file JSON della baseline')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='salva i risultati come nuova baseline')
+    parser.add_argument('--time-tolerance', type=float, default=1.0,
+                        help='moltiplicatore delle tolleranze sui tempi (macchine rumorose)')
+    parser.add_argument('--workdir', help='cartella per gli universi simulati (riusati)')
+    parser.add_argument('-o', '--output', help='salva i risultati in JSON')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), 'greeninvest-bench')
+    os.makedirs(workdir, exist_ok=True)
+    results = run(args.sizes, args.repeats, workdir)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        # I tempi delle voci non rimisurate passano alla calibrazione della nuova baseline
+        speed = _speed(results, baseline)
+        for key, values in baseline.items():
+            if key not in results and key != CALIBRATION:
+                baseline[key] = {metric: round(value / speed, 3) if metric.endswith('_ms') else value
+                                 for metric, value in values.items()}
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"Baseline aggiornata: {args.baseline}")
+        return 0
+
+    found = regressions(results, baseline, args.time_tolerance)
+    speed = _speed(results, baseline)
+    if speed != 1.0:
+        print(f"Tempi normalizzati sulla baseline: fattore {speed:.2f} (calibrazione)")
+    missing = [key for key in results if key not in baseline]
+    if missing:
+        print(f"Senza baseline: {', '.join(missing)}")
+    if found:
+        print(f"\nREGRESSIONI ({len(found)}):", file=sys.stderr)
+        for line in found:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print("Nessuna regressione rispetto alla baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
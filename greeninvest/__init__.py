@@ -0,0 +1,32 @@
+# GreenInvest+ - logica di calcolo ESG separata dall'interfaccia Streamlit
+#
+# Nessun modulo del pacchetto importa streamlit o altair, quindi può essere usato
+# in job batch (vedi `python -m greeninvest --help`). I sottomoduli, che
+# dipendono da numpy/pandas/scipy, sono importati solo al primo accesso: un
+# semplice `import greeninvest` resta leggero.
+
+import importlib
+
+_EXPORTS = {
+    'load_universe': 'greeninvest.loader',
+    'to_columnar': 'greeninvest.loader',
+    'iter_chunks': 'greeninvest.loader',
+    'generate_esg_data': 'greeninvest.demo',
+    'RuleEngine': 'greeninvest.rules',
+    'default_engine': 'greeninvest.rules',
+    'load_rules': 'greeninvest.rules',
+    'index_for': 'greeninvest.comparator',
+    'comparison_frame': 'greeninvest.comparator',
+    'comparison_verdict': 'greeninvest.comparator',
+    'normalized_scores': 'greeninvest.comparator',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'greeninvest' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
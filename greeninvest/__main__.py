@@ -0,0 +1,5 @@
+import sys
+
+from greeninvest.cli import main
+
+sys.exit(main())
@@ -0,0 +1,236 @@
+# Aggregazione lato server per il grafico "Panoramica ESG Score"
+#
+# Il grafico non riceve più una barra per ogni prodotto: oltre MAX_BARS prodotti
+# i dati vengono ridotti (istogramma, top/bottom-k, medie per gruppo) prima di
+# essere inviati al browser, quindi la dimensione del payload resta limitata
+# qualunque sia la dimensione dell'universo. I risultati sono in cache per stato
+# dei filtri.
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+
+# Numero massimo di barre inviate al grafico
+MAX_BARS = 50
+
+MODE_PRODUCTS = 'prodotti'
+MODE_HISTOGRAM = 'istogramma'
+MODE_TOP = 'top'
+MODE_BOTTOM = 'bottom'
+MODE_GROUP = 'gruppo'
+
+# Numero di classi predefinito dell'istogramma
+HISTOGRAM_BINS = 20
+
+# Colonne per cui è possibile raggruppare (se presenti nell'universo)
+GROUP_COLUMNS = {'sector': 'settore', 'partner': 'partner'}
+
+_aggregates = UniverseCache(maxsize=128, name='aggregates')
+
+
+# Funzione per assegnare il colore in base al punteggio (vettoriale)
+def score_colors(scores):
+    scores = np.asarray(scores)
+    return np.select([scores > 80, scores > 60], ['green', 'orange'], default='red')
+
+
+def _scores(data, positions):
+    scores = data['esg_score'].to_numpy()
+    return scores if positions is None else scores[positions]
+
+
+def _products(data, positions):
+    rows = data[['product', 'esg_score']]
+    if positions is not None:
+        rows = rows.iloc[positions]
+    chart_data = pd.DataFrame({
+        'product': rows['product'].to_numpy(dtype=object),
+        'esg_score': rows['esg_score'].to_numpy(),
+    })
+    chart_data['color'] = score_colors(chart_data['esg_score'].to_numpy())
+    return chart_data.reset_index(drop=True)
+
+
+# Indice della classe di ogni punteggio (-1 se mancante), come np.histogram su [0, 100]
+def _bin_index(scores, bins):
+    scores = np.asarray(scores, dtype=np.float64)
+    edges = np.linspace(0, 100, bins + 1)
+    index = np.searchsorted(edges, np.clip(scores, 0, 100), side='right') - 1
+    index = np.minimum(index, bins - 1)
+    index[np.isnan(scores)] = -1
+    return index
+
+
+def _bin_counts(scores, bins):
+    index = _bin_index(scores, bins)
+    return np.bincount(index[index >= 0], minlength=bins)
+
+
+def _histogram(data, positions, bins):
+    return _histogram_frame(_bin_counts(_scores(data, positions), bins))
+
+
+def _histogram_frame(counts):
+    edges = np.linspace(0, 100, len(counts) + 1)
+    starts, ends = edges[:-1], edges[1:]
+    return pd.DataFrame({
+        'bin': [f"{a:.0f}-{b:.0f}" for a, b in zip(starts, ends)],
+        'bin_start': starts,
+        'count': counts,
+        'color': score_colors((starts + ends) / 2),
+    })
+
+
+def _top_k(data, positions, k, largest):
+    scores = _scores(data, positions).astype(np.float64)
+    if positions is None:
+        positions = np.arange(len(scores))
+    k = min(k, len(scores))
+    if k == 0:
+        return _products(data, positions[:0])
+    keys = -scores if largest else scores
+    # argpartition: O(n) per trovare i k estremi, poi si ordinano solo quelli
+    part = np.argpartition(np.nan_to_num(keys, nan=np.inf), k - 1)[:k]
+    part = part[np.argsort(keys[part], kind='stable')]
+    return _products(data, positions[part])
+
+
+def _group_categories(data, by):
+    groups = data[by]
+    if not isinstance(groups.dtype, pd.CategoricalDtype):
+        groups = groups.astype('category')
+    return groups
+
+
+# Numero di prodotti e somma dei punteggi per gruppo (codici di categoria)
+def _group_sums(codes, scores, n_groups):
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = (codes >= 0) & ~np.isnan(scores)
+    counts = np.bincount(codes[valid], minlength=n_groups)
+    sums = np.bincount(codes[valid], weights=scores[valid], minlength=n_groups)
+    return counts, sums
+
+
+def _groups(data, positions, by):
+    groups = _group_categories(data, by)
+    codes = groups.cat.codes.to_numpy()
+    if positions is not None:
+        codes = codes[positions]
+    counts, sums = _group_sums(codes, _scores(data, positions), len(groups.cat.categories))
+    return _groups_frame(groups.cat.categories, counts, sums)
+
+
+def _groups_frame(categories, counts, sums):
+    present = np.flatnonzero(counts)
+    # Solo i gruppi più numerosi, per limitare il numero di barre
+    present = present[np.argsort(-counts[present], kind='stable')][:MAX_BARS]
+    means = sums[present] / counts[present]
+    chart_data = pd.DataFrame({
+        'group': np.asarray(categories[present], dtype=object),
+        'esg_score': np.round(means, 1),
+        'count': counts[present],
+    })
+    chart_data['color'] = score_colors(means)
+    return chart_data.sort_values('esg_score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+# Statistiche dell'intero universo (istogramma e somme per gruppo), aggiornabili per
+# differenza: una modifica di poche righe costa O(righe modificate), non O(universo)
+class ScoreStats:
+    # counts: prodotti per intervallo di ESG score; groups: gruppo -> (conteggi, somme) per categoria
+    def __init__(self, bins, counts, groups):
+        self.bins = bins
+        self.counts = counts
+        self.groups = groups
+
+    # Statistiche calcolate sull'intero universo
+    @classmethod
+    def from_data(cls, data, bins=HISTOGRAM_BINS):
+        groups = {}
+        for by in GROUP_COLUMNS:
+            if by in data.columns:
+                categories = _group_categories(data, by)
+                groups[by] = _group_sums(categories.cat.codes.to_numpy(), _scores(data, None),
+                                         len(categories.cat.categories))
+        return cls(bins, _bin_counts(_scores(data, None), bins), groups)
+
+    # Nuove statistiche togliendo le righe `removed` e aggiungendo `added`
+    # (DataFrame con esg_score e le colonne di gruppo, categorie compatibili con la nuova versione)
+    def updated(self, data, removed, added):
+        bin_counts = self.counts.copy()
+        for rows, sign in ((removed, -1), (added, 1)):
+            index = _bin_index(rows['esg_score'].to_numpy(), self.bins)
+            np.add.at(bin_counts, index[index >= 0], sign)
+
+        groups = {}
+        for by, (counts, sums) in self.groups.items():
+            n_groups = len(_group_categories(data, by).cat.categories)
+            counts = np.pad(counts, (0, n_groups - len(counts)))
+            sums = np.pad(sums, (0, n_groups - len(sums)))
+            for rows, sign in ((removed, -1), (added, 1)):
+                codes = rows[by].cat.codes.to_numpy()
+                delta_counts, delta_sums = _group_sums(codes, rows['esg_score'].to_numpy(), n_groups)
+                counts = counts + sign * delta_counts
+                sums = sums + sign * delta_sums
+            groups[by] = (counts, sums)
+        return ScoreStats(self.bins, bin_counts, groups)
+
+
+# Funzione per ottenere (o calcolare una sola volta) le statistiche dell'intero universo
+def score_stats(data):
+    return _aggregates.get(data, 'score_stats', lambda: ScoreStats.from_data(data))
+
+
+# Funzione per registrare le statistiche (già aggiornate) di una nuova versione dell'universo
+def register_score_stats(data, stats):
+    _aggregates.put(data, 'score_stats', stats)
+
+
+# Funzione per elencare le viste (modalità, colonna di gruppo) disponibili per n prodotti filtrati
+def available_modes(data, n):
+    modes = [(MODE_PRODUCTS, None)] if n <= MAX_BARS else []
+    modes += [(MODE_HISTOGRAM, None), (MODE_TOP, None), (MODE_BOTTOM, None)]
+    modes += [(MODE_GROUP, col) for col in GROUP_COLUMNS if col in data.columns]
+    return modes
+
+
+# Funzione per calcolare (o prendere dalla cache) i dati aggregati del grafico
+# positions/key: righe filtrate e chiave dello stato dei filtri (vedi filters.filter_key)
+def overview_chart_data(data, mode=MODE_PRODUCTS, positions=None, key=None, k=10,
+                        bins=HISTOGRAM_BINS, by=None):
+    n = len(data) if positions is None else len(positions)
+    if mode == MODE_PRODUCTS and n > MAX_BARS:
+        mode = MODE_HISTOGRAM
+    k = min(int(k), MAX_BARS)
+
+    # Filtri che non escludono nessun prodotto: istogramma e gruppi dalle statistiche dell'universo
+    if len(positions if positions is not None else data) == len(data) and (
+            (mode == MODE_HISTOGRAM and bins == HISTOGRAM_BINS) or mode == MODE_GROUP):
+        stats = score_stats(data)
+        if mode == MODE_HISTOGRAM:
+            return mode, _histogram_frame(stats.counts)
+        if by in stats.groups:
+            return mode, _groups_frame(_group_categories(data, by).cat.categories, *stats.groups[by])
+
+    if mode == MODE_PRODUCTS:
+        builder = lambda: _products(data, positions)
+    elif mode == MODE_HISTOGRAM:
+        builder = lambda: _histogram(data, positions, min(int(bins), MAX_BARS))
+    elif mode == MODE_TOP:
+        builder = lambda: _top_k(data, positions, k, largest=True)
+    elif mode == MODE_BOTTOM:
+        builder = lambda: _top_k(data, positions, k, largest=False)
+    elif mode == MODE_GROUP:
+        if by not in GROUP_COLUMNS or by not in data.columns:
+            raise ValueError(f"Colonna di raggruppamento non disponibile: {by}")
+        builder = lambda: _groups(data, positions, by)
+    else:
+        raise ValueError(f"Modalità di aggregazione non valida: {mode}")
+
+    if positions is not None and (key is None or mode == MODE_PRODUCTS):
+        # Senza chiave dei filtri non è possibile riconoscere lo stato: niente cache.
+        # Le barre per prodotto (al più MAX_BARS) seguono l'ordine delle posizioni, che la
+        # chiave dei filtri non include: si ricostruiscono ad ogni richiesta
+        return mode, builder()
+    return mode, _aggregates.get(data, ('overview', key, mode, k, bins, by), builder)
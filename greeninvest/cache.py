@@ -0,0 +1,102 @@
+# Cache LRU di processo per valori derivati da un universo ESG
+#
+# Le chiavi sono legate all'identità del DataFrame (l'universo è condiviso e in
+# sola lettura): quando il DataFrame viene liberato le sue voci spariscono.
+# Oltre al numero di voci si può limitare la memoria occupata (maxbytes): conta
+# la dimensione dei valori con attributo nbytes (array NumPy).
+
+import threading
+import weakref
+from collections import OrderedDict
+
+
+# Cache create nel processo (per i contatori di hit/miss, vedi metrics.cache_stats)
+_instances = weakref.WeakSet()
+
+
+class UniverseCache:
+    def __init__(self, maxsize=64, name=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.name = name or f'cache-{id(self):x}'
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._refs = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        _instances.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Restituisce il valore per (universo, chiave), costruendolo se assente
+    def get(self, data, key, builder):
+        full_key = (id(data), key)
+        with self._lock:
+            if full_key in self._entries and self._refs.get(id(data), lambda: None)() is data:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return self._entries[full_key]
+
+        value = builder()
+
+        with self._lock:
+            self.misses += 1
+            self._store(data, key, value)
+        return value
+
+    # Valore in cache per (universo, chiave) o None, senza costruirlo né contarlo
+    def peek(self, data, key):
+        with self._lock:
+            if self._refs.get(id(data), lambda: None)() is not data:
+                return None
+            return self._entries.get((id(data), key))
+
+    # Inserisce un valore già calcolato (es. aggiornato in modo incrementale da una versione precedente)
+    def put(self, data, key, value):
+        with self._lock:
+            self._store(data, key, value)
+
+    def _store(self, data, key, value):
+        full_key = (id(data), key)
+        ident = id(data)
+        ref = self._refs.get(ident)
+        if ref is None or ref() is not data:
+            self._forget(ident)
+            self._refs[ident] = weakref.ref(data, lambda _, ident=ident: self._drop(ident))
+        self._remove(full_key)
+        self._entries[full_key] = value
+        self._sizes[full_key] = size = int(getattr(value, 'nbytes', 0))
+        self.nbytes += size
+        # La voce appena inserita resta anche se da sola supera maxbytes
+        while len(self._entries) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes and len(self._entries) > 1):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, full_key):
+        if full_key in self._entries:
+            del self._entries[full_key]
+            self.nbytes -= self._sizes.pop(full_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._refs.clear()
+            self.nbytes = 0
+
+    def _drop(self, ident):
+        with self._lock:
+            self._forget(ident)
+
+    def _forget(self, ident):
+        for full_key in [k for k in self._entries if k[0] == ident]:
+            self._remove(full_key)
+        self._refs.pop(ident, None)
+
+
+# Funzione per elencare le cache attive del processo
+def all_caches():
+    return sorted(_instances, key=lambda cache: cache.name)
@@ -0,0 +1,390 @@
+# Interfaccia a riga di comando per elaborazioni batch, senza Streamlit
+#
+#   python -m greeninvest score universo.parquet -o punteggi.parquet --workers 4
+#   python -m greeninvest compare universo.csv "EcoGreen ETF" "Blue Ocean Bond"
+#   python -m greeninvest generate 1000000 -o universo.parquet --holdings posizioni.csv
+#   python -m greeninvest snapshot universo.parquet /srv/greeninvest/snapshot
+#   python -m greeninvest report universo.parquet -o report.zip --holdings posizioni.csv --formats pdf
+#   python -m greeninvest scenarios universo.parquet -o perdite.parquet --paths 10000 --holdings posizioni.csv
+#
+# I file vengono letti a blocchi (memoria limitata dalla dimensione del blocco).
+# Con regole basate su quantili serve un primo passaggio che legge solo le
+# colonne usate dalle regole per calcolare le soglie sull'intero universo.
+# numpy/pandas vengono importati solo quando un comando viene eseguito.
+
+import argparse
+import os
+import sys
+
+from greeninvest.parallel import ordered_map
+
+DEFAULT_CHUNKSIZE = 100_000
+
+_worker_engine = None
+_worker_quantiles = None
+
+
+def _make_engine(rules_path):
+    from greeninvest.rules import RuleEngine, default_engine, load_rules
+    return RuleEngine(load_rules(rules_path)) if rules_path else default_engine()
+
+
+def _init_worker(rules_path, quantiles):
+    global _worker_engine, _worker_quantiles
+    _worker_engine = _make_engine(rules_path)
+    _worker_quantiles = quantiles
+
+
+# Calcola i flag di greenwashing di un blocco con le soglie fissate sull'intero universo
+def _score_chunk(chunk):
+    from greeninvest.loader import REQUIRED_COLUMNS
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti nell'universo ESG: {', '.join(missing)}")
+    return _worker_engine.apply(chunk, _worker_quantiles)
+
+
+# Soglie dei quantili sull'intero file (primo passaggio, solo colonne delle regole)
+def _scan_quantiles(path, engine, chunksize):
+    import pandas as pd
+    from greeninvest.loader import iter_chunks
+    if not engine.has_percentiles:
+        return {}
+    columns = pd.concat(list(iter_chunks(path, chunksize, columns=engine.inputs)),
+                        ignore_index=True)
+    return engine.quantiles(columns)
+
+
+# Converte un blocco in tipi stabili tra blocchi (necessario per lo schema Parquet)
+def _stable_types(chunk):
+    import numpy as np
+    import pandas as pd
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        dtype = chunk[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            chunk[col] = chunk[col].astype(object)
+        elif col != 'greenwashing_rules' and pd.api.types.is_integer_dtype(dtype):
+            chunk[col] = chunk[col].astype(np.float64)
+    return chunk
+
+
+# Scrive i blocchi su CSV o Parquet man mano che arrivano
+def _write_chunks(chunks, path):
+    ext = os.path.splitext(path)[1].lower()
+    rows = 0
+    if ext == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(_stable_types(chunk), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    elif ext in ('.csv', '.txt'):
+        first = True
+        for chunk in chunks:
+            chunk.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+            first = False
+            rows += len(chunk)
+    else:
+        raise ValueError(f"Formato di output non supportato: {ext or path}")
+    return rows
+
+
+def cmd_score(args):
+    from concurrent.futures import ProcessPoolExecutor
+
+    from greeninvest.loader import iter_chunks
+
+    engine = _make_engine(args.rules)
+    quantiles = _scan_quantiles(args.input, engine, args.chunksize)
+    chunks = iter_chunks(args.input, args.chunksize)
+    workers = args.workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(args.rules, quantiles)
+        rows = _write_chunks((_score_chunk(c) for c in chunks), args.output)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(args.rules, quantiles)) as pool:
+            rows = _write_chunks(ordered_map(pool, _score_chunk, chunks, 2 * workers),
+                                 args.output)
+
+    print(f"{rows} prodotti elaborati -> {args.output}", file=sys.stderr)
+    return 0
+
+
+def cmd_compare(args):
+    import numpy as np
+    import pandas as pd
+
+    from greeninvest.comparator import (MAX_COMPARE, add_scores, best_choice,
+                                        comparison_verdict, normalized_scores)
+    from greeninvest.loader import REQUIRED_COLUMNS, iter_chunks
+
+    products = list(dict.fromkeys(args.products))
+    if len(products) < 2 or len(products) > MAX_COMPARE:
+        print(f"Indica da 2 a {MAX_COMPARE} prodotti diversi", file=sys.stderr)
+        return 2
+
+    engine = _make_engine(args.rules)
+    columns = list(dict.fromkeys(list(REQUIRED_COLUMNS) + engine.inputs))
+
+    # Un solo passaggio: righe richieste, max_co2 e (se servono) colonne per i quantili
+    max_co2 = 0.0
+    selected, rule_inputs = [], []
+    for chunk in iter_chunks(args.input, args.chunksize, columns=columns):
+        co2 = chunk['co2_emissions'].to_numpy(dtype=np.float64)
+        if len(co2) and not np.isnan(co2).all():
+            max_co2 = max(max_co2, float(np.nanmax(co2)))
+        selected.append(chunk[chunk['product'].astype(object).isin(products)])
+        if engine.has_percentiles:
+            rule_inputs.append(chunk[engine.inputs])
+
+    rows = pd.concat(selected, ignore_index=True)
+    rows['product'] = rows['product'].astype(object)
+    rows = rows.drop_duplicates('product').set_index('product')
+    missing = [p for p in products if p not in rows.index]
+    if missing:
+        print(f"Prodotti non presenti nell'universo: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    rows = rows.loc[products].reset_index()
+
+    quantiles = engine.quantiles(pd.concat(rule_inputs, ignore_index=True)) if rule_inputs else {}
+    rows['greenwashing_flag'] = engine.evaluate(rows, quantiles).flags
+
+    matrix = normalized_scores(rows['esg_score'], rows['co2_emissions'], rows['green_activities'],
+                               max_co2 if max_co2 > 0 else 1.0)
+    frame = add_scores(rows[['product', 'esg_score', 'co2_emissions', 'green_activities',
+                             'greenwashing_flag']].copy(), matrix)
+
+    if args.output:
+        frame.to_csv(args.output, index=False)
+    print(frame.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+
+    if len(products) == 2:
+        a, b = frame.iloc[0], frame.iloc[1]
+        winner, margin = comparison_verdict(a['esg_score'], a['greenwashing_flag'],
+                                            b['esg_score'], b['greenwashing_flag'])
+        if winner is None:
+            print(f"\nLa comparazione tra {a['product']} e {b['product']} richiede "
+                  f"un'analisi più dettagliata.")
+        else:
+            better, worse = (a, b) if winner == 0 else (b, a)
+            print(f"\n{better['product']} è più sostenibile di {worse['product']} "
+                  f"(+{margin:g} punti ESG).")
+    else:
+        best = best_choice(frame)
+        if best is None:
+            print("\nTutti i prodotti presentano segnali di greenwashing.")
+        else:
+            print(f"\nMiglior punteggio complessivo senza segnali di greenwashing: {best['product']}")
+    return 0
+
+
+def cmd_generate(args):
+    from greeninvest.synthetic import iter_holdings, iter_universe, write_history
+
+    rows = _write_chunks(iter_universe(args.products, args.seed, args.greenwashing_rate, args.chunksize),
+                         args.output)
+    print(f"{rows} prodotti simulati -> {args.output}", file=sys.stderr)
+
+    if args.holdings:
+        if os.path.splitext(args.holdings)[1].lower() != '.csv':
+            print("Le posizioni vengono scritte solo in CSV", file=sys.stderr)
+            return 2
+        rows = _write_chunks(iter_holdings(args.products, args.clients, args.positions, args.seed,
+                                           args.chunksize), args.holdings)
+        print(f"{rows} posizioni di {args.clients} clienti -> {args.holdings}", file=sys.stderr)
+
+    if args.history:
+        write_history(args.history, args.products, args.days, args.seed, args.greenwashing_rate)
+        print(f"Storico di {args.days} giorni -> {args.history}", file=sys.stderr)
+    return 0
+
+
+def cmd_snapshot(args):
+    from greeninvest.loader import load_universe
+    from greeninvest.snapshot import KEEP_VERSIONS, publish
+
+    data = load_universe(args.input)
+    version = publish(data, args.root, keep=KEEP_VERSIONS if args.keep is None else args.keep)
+    print(f"{len(data)} prodotti -> {os.path.join(args.root, version)} (versione corrente)", file=sys.stderr)
+    return 0
+
+
+# Gruppi di prodotti da confrontare: uno per riga, prodotti separati da ';'
+def _read_groups(path):
+    with open(path, encoding='utf-8') as f:
+        return [[p.strip() for p in line.split(';') if p.strip()] for line in f if line.strip()]
+
+
+def cmd_report(args):
+    from greeninvest.loader import load_universe
+    from greeninvest.portfolio import PortfolioBook, read_holdings
+    from greeninvest.reports import RENDERERS, comparison_reports, export_zip, portfolio_reports
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in RENDERERS]
+    if not formats or unknown:
+        print(f"Formati supportati: {', '.join(RENDERERS)}", file=sys.stderr)
+        return 2
+    groups = ([args.compare] if args.compare else []) + (_read_groups(args.groups) if args.groups else [])
+    if not args.holdings and not groups:
+        print("Indica --holdings e/o i prodotti da confrontare (--compare, --groups)", file=sys.stderr)
+        return 2
+
+    data = load_universe(args.input)
+    reports, total = [], 0
+    if groups:
+        try:
+            reports.append(list(comparison_reports(data, groups)))
+        except (KeyError, ValueError) as exc:
+            print(exc.args[0], file=sys.stderr)
+            return 1
+        total += len(groups)
+    if args.holdings:
+        book = PortfolioBook.from_records(data, read_holdings(args.holdings))
+        missing = sorted(set(args.clients or ()) - set(book.clients))
+        if missing:
+            print(f"Clienti non presenti nelle posizioni: {', '.join(missing)}", file=sys.stderr)
+            return 1
+        reports.append(portfolio_reports(data, book, args.clients))
+        total += len(args.clients or book.clients)
+
+    def progress(done, total):
+        print(f"\r{done}/{total} report", end='', file=sys.stderr, flush=True)
+
+    output = sys.stdout.buffer if args.output == '-' else args.output
+    done = export_zip((report for batch in reports for report in batch), output, formats,
+                      workers=args.workers, total=total, progress=progress)
+    print(f"\r{done} report ({', '.join(formats)}) -> {args.output}", file=sys.stderr)
+    return 0
+
+
+def cmd_scenarios(args):
+    from greeninvest.loader import load_universe
+    from greeninvest.portfolio import PortfolioBook, read_holdings
+    from greeninvest.scenarios import (SCENARIOS, portfolio_losses, price_paths, product_losses,
+                                       scenario_losses, scenario_paths)
+
+    if args.scenario not in SCENARIOS:
+        print(f"Scenari disponibili: {', '.join(SCENARIOS)}", file=sys.stderr)
+        return 2
+    if args.holdings and not args.portfolio_output:
+        print("Indica il file per le perdite dei portafogli (--portfolio-output)", file=sys.stderr)
+        return 2
+
+    data = load_universe(args.input)
+    if args.paths:
+        # Monte Carlo intorno allo scenario scelto: perdita attesa, VaR ed ES per prodotto
+        paths = price_paths(args.paths, args.scenario, args.horizon, args.volatility, seed=args.seed)
+        frame = product_losses(data, paths, args.confidence, args.workers)
+        description = f"{args.paths} percorsi ({args.scenario})"
+    else:
+        # Solo scenari deterministici: una colonna di perdite per scenario
+        paths = scenario_paths([args.scenario], args.horizon)
+        frame = scenario_losses(data, horizon=args.horizon)
+        description = f"{len(SCENARIOS)} scenari deterministici"
+    rows = _write_chunks([frame], args.output)
+    print(f"{rows} prodotti, {description} -> {args.output}", file=sys.stderr)
+
+    if args.holdings:
+        book = PortfolioBook.from_records(data, read_holdings(args.holdings))
+        clients, book_losses = portfolio_losses(data, book, paths, args.confidence, workers=args.workers)
+        _write_chunks([clients], args.portfolio_output)
+        print(f"{len(clients)} portafogli -> {args.portfolio_output} "
+              f"(perdita attesa del book {book_losses.mean():.2%})", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--rules', help='file JSON con le regole di greenwashing')
+    common.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help='righe lette per blocco')
+
+    parser = argparse.ArgumentParser(prog='python -m greeninvest',
+                                     description='Elaborazioni ESG batch di GreenInvest+')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    score = commands.add_parser('score', parents=[common],
+                                help='calcola i flag di greenwashing di un universo')
+    score.add_argument('input', help='universo ESG (.parquet, .arrow/.feather, .csv)')
+    score.add_argument('-o', '--output', required=True, help='file di output (.parquet o .csv)')
+    score.add_argument('--workers', type=int, default=None,
+                       help='processi in parallelo (default: numero di CPU)')
+    score.set_defaults(func=cmd_score)
+
+    compare = commands.add_parser('compare', parents=[common],
+                                  help='confronta due o più prodotti')
+    compare.add_argument('input', help='universo ESG (.parquet, .arrow/.feather, .csv)')
+    compare.add_argument('products', nargs='+', help='nomi dei prodotti da confrontare')
+    compare.add_argument('-o', '--output', help='salva la tabella di confronto in CSV')
+    compare.set_defaults(func=cmd_compare)
+
+    generate = commands.add_parser('generate', parents=[common],
+                                   help='genera un universo simulato per test di carico')
+    generate.add_argument('products', type=int, help='numero di prodotti')
+    generate.add_argument('-o', '--output', required=True, help='file di output (.parquet o .csv)')
+    generate.add_argument('--seed', type=int, default=0, help='seme del generatore casuale')
+    generate.add_argument('--greenwashing-rate', type=float, default=0.05,
+                          help='quota di prodotti con ESG alto e attività green basse')
+    generate.add_argument('--holdings', help='scrive anche le posizioni dei clienti (.csv)')
+    generate.add_argument('--clients', type=int, default=10_000, help='numero di clienti')
+    generate.add_argument('--positions', type=int, default=8, help='posizioni medie per cliente')
+    generate.add_argument('--history', help='cartella in cui scrivere lo storico giornaliero')
+    generate.add_argument('--days', type=int, default=365, help='giorni di storico')
+    generate.set_defaults(func=cmd_generate)
+
+    snapshot = commands.add_parser('snapshot', help='pubblica una snapshot condivisa (memory-mapped) '
+                                                    'dell\'universo')
+    snapshot.add_argument('input', help='universo ESG (.parquet, .arrow/.feather, .csv)')
+    snapshot.add_argument('root', help='cartella delle snapshot (GREENINVEST_SNAPSHOT)')
+    snapshot.add_argument('--keep', type=int, help='versioni precedenti da tenere su disco (default: 2)')
+    snapshot.set_defaults(func=cmd_snapshot)
+
+    report = commands.add_parser('report', help='esporta in un archivio zip i report di confronti '
+                                                'e portafogli clienti')
+    report.add_argument('input', help='universo ESG (.parquet, .arrow/.feather, .csv)')
+    report.add_argument('-o', '--output', required=True, help='archivio zip di output (- per stdout)')
+    report.add_argument('--holdings', help='posizioni dei clienti (.csv): un report per cliente')
+    report.add_argument('--clients', nargs='+', help='solo i report di questi clienti')
+    report.add_argument('--compare', nargs='+', metavar='PRODOTTO', help='prodotti da confrontare')
+    report.add_argument('--groups', help='file con un gruppo di prodotti da confrontare per riga '
+                                         '(separati da ;)')
+    report.add_argument('--formats', default='csv,xlsx,pdf', help='formati separati da virgola')
+    report.add_argument('--workers', type=int, default=None,
+                        help='processi in parallelo (default: numero di CPU)')
+    report.set_defaults(func=cmd_report)
+
+    scenarios = commands.add_parser('scenarios', help='perdite da prezzo del carbonio (scenari e Monte Carlo) '
+                                                      'per prodotti e portafogli')
+    scenarios.add_argument('input', help='universo ESG (.parquet, .arrow/.feather, .csv)')
+    scenarios.add_argument('-o', '--output', required=True, help='perdite per prodotto (.parquet o .csv)')
+    scenarios.add_argument('--scenario', default='Net Zero 2050', help='scenario di prezzo del carbonio')
+    scenarios.add_argument('--paths', type=int, default=0,
+                           help='percorsi Monte Carlo (0: solo scenari deterministici)')
+    scenarios.add_argument('--volatility', type=float, default=0.25, help='volatilità annua del prezzo')
+    scenarios.add_argument('--horizon', type=int, default=10, help='anni simulati')
+    scenarios.add_argument('--confidence', type=float, default=0.95, help='livello di VaR ed ES')
+    scenarios.add_argument('--seed', type=int, default=0, help='seme del generatore casuale')
+    scenarios.add_argument('--holdings', help='posizioni dei clienti (.csv): perdite per portafoglio')
+    scenarios.add_argument('--portfolio-output', help='perdite per portafoglio (.parquet o .csv)')
+    scenarios.add_argument('--workers', type=int, default=None,
+                           help='processi in parallelo (default: numero di CPU)')
+    scenarios.set_defaults(func=cmd_scenarios)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
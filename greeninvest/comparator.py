@@ -0,0 +1,237 @@
+# Indice dei prodotti e matrice normalizzata per il comparatore
+#
+# L'indice viene costruito una volta per universo: la ricerca di un prodotto
+# per nome costa O(1) (lookup hash sull'indice delle chiavi + array di posizioni)
+# e le statistiche di normalizzazione (es. max_co2) non vengono più ricalcolate
+# ad ogni confronto.
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+
+# Categorie del grafico comparativo (stesso ordine delle colonne di score_matrix)
+CATEGORIES = ['ESG Score', 'Basse Emissioni', 'Attività Green']
+
+# Numero massimo di prodotti confrontabili insieme
+MAX_COMPARE = 50
+
+# Candidati restituiti dalla ricerca per prefisso del selettore del comparatore
+MAX_SEARCH_RESULTS = 30
+
+# Prodotti aggiunti in modo incrementale oltre i quali le chiavi dell'indice vengono compattate
+MAX_EXTRA_KEYS = 1 << 16
+
+
+# Minimo e massimo ignorando i valori mancanti (NaN se non ci sono valori)
+def _nan_range(values):
+    if len(values) == 0 or np.isnan(values).all():
+        return np.nan, np.nan
+    return float(np.nanmin(values)), float(np.nanmax(values))
+
+
+class ProductIndex:
+    # arrays: valori float32 già pronti di (esg_score, co2_emissions, green_activities), es. da una snapshot
+    def __init__(self, data, arrays=None):
+        products = data['product']
+        if isinstance(products.dtype, pd.CategoricalDtype):
+            # Le categorie sono già un indice di chiavi univoche (con la sua tabella hash):
+            # si riusano invece di costruirne un secondo
+            codes, keys = products.cat.codes.to_numpy(), products.cat.categories
+        else:
+            codes, keys = pd.factorize(products)
+        self._keys = keys if isinstance(keys, pd.Index) else pd.Index(keys)
+        # Costruisce subito la tabella hash delle chiavi (pandas la crea al primo lookup)
+        self._keys.get_indexer(self._keys[:1])
+        self._position = np.full(len(keys), -1, dtype=np.int64)
+        valid = codes >= 0
+        self._position[codes[valid]] = np.flatnonzero(valid)
+        # Prodotti aggiunti da aggiornamenti incrementali (vedi updated)
+        self._extra = {}
+        # Chiavi in minuscolo ordinate per la ricerca per prefisso (costruite al primo uso)
+        self._sorted = None
+
+        if arrays is None:
+            arrays = [data[col].to_numpy(dtype=np.float32)
+                      for col in ('esg_score', 'co2_emissions', 'green_activities')]
+        self.esg_score, self.co2_emissions, self.green_activities = arrays
+
+        # Statistiche di normalizzazione precalcolate
+        self._set_co2_range(*_nan_range(self.co2_emissions))
+
+    def _set_co2_range(self, low, high):
+        self._co2_range = (low, high)
+        self.max_co2 = high if high > 0 else 1.0
+        self.min_co2 = min(low, 0.0) if not np.isnan(low) else 0.0
+
+    # Indice di una nuova versione dell'universo: valori cambiati nelle righe `positions`
+    # e prodotti nuovi in coda. Le chiavi esistenti non vengono rifattorizzate (i prodotti
+    # nuovi vanno in un dizionario a parte, compattato oltre MAX_EXTRA_KEYS) e min/max CO₂
+    # si ricalcolano sull'intera colonna solo se cambia la riga che li deteneva.
+    def updated(self, data, positions, appended=()):
+        positions = np.asarray(positions, dtype=np.int64)
+        n_rows = len(self.esg_score)
+        index = object.__new__(ProductIndex)
+        index._keys, index._position, index._sorted = self._keys, self._position, self._sorted
+        index._extra = {**self._extra,
+                        **{product: n_rows + i for i, product in enumerate(appended)}}
+        if len(index._extra) > MAX_EXTRA_KEYS:
+            # I prodotti reinseriti dopo una cancellazione hanno già una chiave (posizione -1)
+            extra = pd.Index(list(index._extra), dtype=object)
+            extra_pos = np.fromiter(index._extra.values(), dtype=np.int64, count=len(extra))
+            codes = self._keys.get_indexer(extra)
+            known = codes >= 0
+            index._position = self._position.copy()
+            index._position[codes[known]] = extra_pos[known]
+            index._position = np.concatenate([index._position, extra_pos[~known]])
+            index._keys = pd.Index(np.concatenate([np.asarray(self._keys, dtype=object),
+                                                   np.asarray(extra[~known], dtype=object)]))
+            index._keys.get_indexer(index._keys[:1])
+            index._sorted = None
+            index._extra = {}
+
+        rows = np.concatenate([positions, np.arange(n_rows, len(data))])
+        for col in ('esg_score', 'co2_emissions', 'green_activities'):
+            values = getattr(self, col)
+            values = np.concatenate([values, np.empty(len(data) - len(values), dtype=np.float32)])
+            values[rows] = data[col].iloc[rows].to_numpy(dtype=np.float32)
+            setattr(index, col, values)
+
+        low, high = self._co2_range
+        old = self.co2_emissions[positions]
+        new = index.co2_emissions[rows]
+        if (old == low).any() or (old == high).any() or np.isnan(low):
+            index._set_co2_range(*_nan_range(index.co2_emissions))
+        else:
+            new_low, new_high = _nan_range(new)
+            index._set_co2_range(np.fmin(low, new_low), np.fmax(high, new_high))
+        return index
+
+    # Le categorie senza righe (posizione -1, es. prodotti cancellati dai feed) non contano;
+    # un prodotto cancellato e poi reinserito sta in _extra
+    def __len__(self):
+        return int((self._position >= 0).sum()) + len(self._extra)
+
+    def __contains__(self, product):
+        return self.find([product])[0] >= 0
+
+    # Posizione (riga) di un prodotto; KeyError se non è nell'universo
+    def position(self, product):
+        pos = int(self.find([product])[0])
+        if pos < 0:
+            raise KeyError(product)
+        return pos
+
+    # Posizioni di più prodotti in un colpo solo (-1 per i prodotti assenti).
+    # Un prodotto reinserito conserva la sua vecchia categoria (posizione -1) ma sta in _extra
+    def find(self, products):
+        products = list(products)
+        codes = self._keys.get_indexer(products)
+        found = np.where(codes >= 0, self._position[codes], -1)
+        if self._extra:
+            # Un prodotto in _extra non ha una riga valida tra le categorie
+            for i in np.flatnonzero(found < 0):
+                found[i] = self._extra.get(products[i], -1)
+        return found
+
+    # Posizioni di più prodotti; errore se qualcuno manca
+    def positions(self, products):
+        products = list(products)
+        pos = self.find(products)
+        if (pos < 0).any():
+            missing = [p for p, i in zip(products, pos) if i < 0]
+            raise KeyError(f"Prodotti non presenti nell'universo: {', '.join(map(str, missing))}")
+        return pos
+
+    # Prodotti il cui nome inizia con `text` (senza distinzione di maiuscole), in ordine
+    # alfabetico e al più `limit`: ricerca binaria sulle chiavi ordinate, quindi il costo
+    # non dipende dalla dimensione dell'universo
+    def search(self, text, limit=MAX_SEARCH_RESULTS):
+        if self._sorted is None:
+            lower = pd.Index(self._keys.astype(str).str.lower())
+            order = lower.argsort()
+            self._sorted = (lower[order].to_numpy(dtype=object), order)
+        lower, order = self._sorted
+        prefix = text.strip().lower()
+        start = lower.searchsorted(prefix)
+        stop = lower.searchsorted(prefix + '\U0010ffff') if prefix else len(lower)
+        results = []
+        # Le categorie senza righe (posizione -1) non sono prodotti dell'universo
+        for code in order[start:stop]:
+            if self._position[code] >= 0:
+                results.append(self._keys[code])
+                if len(results) >= limit:
+                    break
+        extra = sorted(p for p in self._extra if str(p).lower().startswith(prefix))
+        return sorted(results + extra, key=lambda p: str(p).lower())[:limit]
+
+    # Matrice prodotti x categorie con valori normalizzati in [0, 1]
+    def score_matrix(self, products):
+        pos = self.positions(products)
+        return normalized_scores(self.esg_score[pos], self.co2_emissions[pos],
+                                 self.green_activities[pos], self.max_co2)
+
+
+# Funzione per normalizzare i valori in [0, 1] nell'ordine di CATEGORIES
+def normalized_scores(esg_score, co2_emissions, green_activities, max_co2):
+    matrix = np.column_stack([
+        np.asarray(esg_score, dtype=np.float32) / 100,
+        1 - (np.asarray(co2_emissions, dtype=np.float32) / max_co2),  # meno emissioni = valore più alto
+        np.asarray(green_activities, dtype=np.float32) / 100,
+    ])
+    return np.clip(matrix, 0, 1, out=matrix)
+
+
+# Funzione per il verdetto del confronto tra due prodotti
+# Restituisce (0 o 1 per il prodotto più sostenibile, oppure None, e il vantaggio in punti ESG)
+def comparison_verdict(esg1, flag1, esg2, flag2):
+    if esg1 > esg2 and not flag1:
+        return 0, esg1 - esg2
+    if esg2 > esg1 and not flag2:
+        return 1, esg2 - esg1
+    return None, 0
+
+
+# Funzione per scegliere il prodotto migliore di una tabella di confronto (o None)
+# Il migliore è quello con il punteggio complessivo più alto senza segnali di greenwashing
+def best_choice(frame):
+    clean = frame[~frame['greenwashing_flag'].to_numpy(dtype=bool)]
+    if len(clean) == 0:
+        return None
+    return clean.loc[clean['Punteggio complessivo'].idxmax()]
+
+
+_indexes = UniverseCache(maxsize=8, name='product_index')
+
+
+# Funzione per ottenere (o costruire una sola volta) l'indice di un universo
+def index_for(data):
+    return _indexes.get(data, 'product_index', lambda: ProductIndex(data))
+
+
+# Funzione per registrare l'indice (già aggiornato) di una nuova versione dell'universo
+def register_index(data, index):
+    _indexes.put(data, 'product_index', index)
+
+
+# Funzione per costruire la tabella di confronto di N prodotti
+def comparison_frame(data, products):
+    products = list(products)
+    if len(products) > MAX_COMPARE:
+        raise ValueError(f"Si possono confrontare al massimo {MAX_COMPARE} prodotti")
+    index = index_for(data)
+    pos = index.positions(products)
+    matrix = index.score_matrix(products)
+
+    frame = data[['product', 'esg_score', 'co2_emissions', 'green_activities',
+                  'greenwashing_flag']].iloc[pos].reset_index(drop=True)
+    frame['product'] = frame['product'].to_numpy(dtype=object)
+    return add_scores(frame, matrix)
+
+
+# Funzione per aggiungere a una tabella di confronto i valori normalizzati e il punteggio complessivo
+def add_scores(frame, matrix):
+    for i, category in enumerate(CATEGORIES):
+        frame[category] = matrix[:, i]
+    frame['Punteggio complessivo'] = matrix.mean(axis=1)
+    return frame
@@ -0,0 +1,84 @@
+# Dati ESG simulati dell'app (5 strumenti finanziari dimostrativi)
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+from greeninvest.rules import default_engine
+
+# Posizioni dimostrative dei clienti (cliente, prodotto, importo in euro)
+DEMO_HOLDINGS = [
+    ("Cliente Rossi", "EcoGreen ETF", 10000),
+    ("Cliente Rossi", "Blue Ocean Bond", 5000),
+    ("Cliente Bianchi", "Sustainability Fund", 20000),
+    ("Cliente Bianchi", "Carbon Zero Index", 8000),
+    ("Cliente Bianchi", "Future Energy Trust", 2000),
+    ("Cliente Verdi", "Blue Ocean Bond", 15000),
+    ("Cliente Verdi", "Future Energy Trust", 5000)
+]
+
+# Offerte dimostrative del marketplace (rendimento atteso in punti percentuali)
+DEMO_MARKETPLACE = [
+    {'name': "Green Bond Facility", 'partner': "Intesa Sanpaolo", 'min_investment': 5000,
+     'expected_return': 2.5, 'impact': "Finanziamento progetti energie rinnovabili"},
+    {'name': "Ocean Fund", 'partner': "Clarity AI", 'min_investment': 10000,
+     'expected_return': 3.8, 'impact': "Protezione ecosistemi marini"},
+    {'name': "Community Impact ETF", 'partner': "Coop", 'min_investment': 1000,
+     'expected_return': 2.2, 'impact': "Sviluppo comunità locali sostenibili"},
+]
+
+_books = UniverseCache(maxsize=4, name='demo_portfolios')
+
+
+# Funzione per generare dati ESG simulati
+def generate_esg_data():
+    # Creazione di 5 strumenti finanziari simulati
+    products = [
+        "EcoGreen ETF",
+        "Sustainability Fund",
+        "Blue Ocean Bond",
+        "Carbon Zero Index",
+        "Future Energy Trust"
+    ]
+
+    esg_scores = [85, 72, 93, 65, 78]
+    co2_emissions = [120, 200, 50, 180, 150]  # Tonnellate di CO2 (scope 1-2-3)
+    green_activities = [25, 65, 82, 60, 45]   # Percentuale di attività green
+
+    # Creazione del DataFrame
+    data = pd.DataFrame({
+        'product': products,
+        'esg_score': esg_scores,
+        'co2_emissions': co2_emissions,
+        'green_activities': green_activities
+    })
+
+    # Calcola i flag di greenwashing con il motore di regole (vettoriale su tutto l'universo)
+    return default_engine().apply(data)
+
+
+# Funzione per ottenere i portafogli dimostrativi (una volta per versione dell'universo)
+def demo_portfolios(data):
+    from greeninvest.portfolio import PortfolioBook
+    return _books.get(data, 'demo_portfolios',
+                      lambda: PortfolioBook.from_records(data, DEMO_HOLDINGS, skip_missing=True))
+
+
+# Funzione per generare uno storico giornaliero simulato che termina nei valori attuali
+def generate_esg_history(data, days=3 * 365, seed=42):
+    from greeninvest.history import HistoryStore
+    from greeninvest.synthetic import HISTORY_STEPS, history_walks
+    rng = np.random.default_rng(seed)
+    products = data['product'].astype(object).tolist()
+    end = pd.Timestamp.today().normalize()
+    history = HistoryStore.create(None, products, end - pd.Timedelta(days=days - 1),
+                                  capacity=days)
+    values = history_walks(rng, {m: data[m].to_numpy() for m in HISTORY_STEPS}, days)
+    history.append_days(history.start, products, values)
+    return history
+
+
+# Funzione per costruire il catalogo dimostrativo del marketplace
+def demo_catalog():
+    from greeninvest.marketplace import Catalog
+    return Catalog.from_records(DEMO_MARKETPLACE)
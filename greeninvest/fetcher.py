@@ -0,0 +1,411 @@
+# Recupero concorrente dei dati ESG dalle API dei partner
+#
+# Un thread di sfondo esegue un event loop asyncio che interroga periodicamente
+# gli endpoint dei partner: connessioni HTTP/1.1 keep-alive riusate (pool per
+# host), limite di richieste contemporanee per partner, timeout e tentativi con
+# backoff esponenziale. Le risposte sono salvate in una cache su disco con TTL e
+# rivalidazione (If-None-Match / If-Modified-Since -> 304). I record dei feed
+# cambiati vengono passati al destinatario (es. LiveUniverse.ingest) e lo stato
+# è pubblicato come snapshot immutabile: la pagina legge solo l'ultimo
+# snapshot e non attende mai la rete.
+
+import asyncio
+import hashlib
+import json
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+
+from greeninvest.ingest import body_records
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'greeninvest', 'partners')
+
+# Connessioni inattive tenute aperte per host
+MAX_IDLE_CONNECTIONS = 8
+
+# Stati HTTP per cui si ritenta la richiesta
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    pass
+
+
+# Descrizione breve di un errore per lo snapshot ("Tipo: messaggio")
+def _describe(error):
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+class Partner:
+    def __init__(self, name, urls, max_concurrency=4, timeout=10.0, retries=2, backoff=0.5,
+                 ttl=300.0, headers=None):
+        if not urls:
+            raise ValueError(f"Il partner '{name}' non ha endpoint")
+        self.name = name
+        self.urls = list(urls)
+        self.max_concurrency = int(max_concurrency)
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        # Secondi per cui una risposta in cache è usata senza interrogare il partner
+        self.ttl = float(ttl)
+        self.headers = dict(headers or {})
+
+    @classmethod
+    def from_dict(cls, spec):
+        options = {key: spec[key] for key in ('max_concurrency', 'timeout', 'retries', 'backoff',
+                                               'ttl', 'headers') if key in spec}
+        return cls(spec['name'], spec['urls'], **options)
+
+
+# Funzione per leggere la configurazione dei partner da un file JSON (lista di partner)
+def load_partners(path):
+    with open(path, encoding='utf-8') as f:
+        return [Partner.from_dict(spec) for spec in json.load(f)]
+
+
+class ConnectionPool:
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._idle = {}
+        self.opened = 0
+        self.reused = 0
+
+    # Connessione verso (schema, host, porta): una inattiva se disponibile, altrimenti nuova
+    async def acquire(self, key, timeout):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        context = ssl.create_default_context() if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), timeout)
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, key, reader, writer, reusable):
+        idle = self._idle.setdefault(key, [])
+        if reusable and len(idle) < self.max_idle and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+async def _read_chunked(reader):
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+        if size == 0:
+            # Eventuali trailer fino alla riga vuota
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connessione chiusa dal server")
+    version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    status = int(status)
+    if status in (204, 304) or status < 200:
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = await _read_chunked(reader)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+    if version == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+        headers['connection'] = 'close'
+    return status, headers, body
+
+
+# Invia la richiesta e legge la risposta (un solo timeout per entrambe, vedi http_get)
+async def _exchange(reader, writer, request):
+    writer.write(request)
+    await writer.drain()
+    return await _read_response(reader)
+
+
+# Richiesta GET su una connessione del pool; restituisce (stato, intestazioni, corpo)
+async def http_get(pool, url, headers=None, timeout=10.0):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f"URL non supportato: {url}")
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+    target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    lines = [f'GET {target} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: keep-alive',
+             'Accept-Encoding: identity']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    while True:
+        reader, writer, reused = await pool.acquire(key, timeout)
+        reusable = False
+        try:
+            # Anche l'invio ha il timeout: un server che non legge non blocca la richiesta
+            status, response_headers, body = await asyncio.wait_for(_exchange(reader, writer, request),
+                                                                    timeout)
+            reusable = response_headers.get('connection', '').lower() != 'close'
+            return status, response_headers, body
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Una connessione inattiva può essere stata chiusa dal server: si riprova su una nuova
+            if not reused:
+                raise
+        finally:
+            pool.release(key, reader, writer, reusable)
+
+
+class ResponseCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        name = hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + '.body'), os.path.join(self.directory, name + '.json')
+
+    # Metadati della risposta in cache (etag, last_modified, fetched_at, digest) o None
+    def get(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(body_path) else None
+
+    def body(self, url):
+        with open(self._paths(url)[0], 'rb') as f:
+            return f.read()
+
+    def _write(self, path, data):
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # Salva una risposta; restituisce True se il contenuto è diverso da quello in cache
+    def store(self, url, headers, body):
+        previous = self.get(url)
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        meta = {'url': url, 'etag': headers.get('etag'), 'last_modified': headers.get('last-modified'),
+                'content_type': headers.get('content-type', ''), 'fetched_at': time.time(),
+                'digest': digest}
+        body_path, meta_path = self._paths(url)
+        self._write(body_path, body)
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+        return previous is None or previous.get('digest') != digest
+
+    # Risposta rivalidata (304): si aggiorna solo l'istante di recupero
+    def touch(self, url, meta):
+        meta = {**meta, 'fetched_at': time.time()}
+        self._write(self._paths(url)[1], json.dumps(meta).encode('utf-8'))
+        return meta
+
+
+class PartnerFetcher:
+    def __init__(self, partners, cache=None):
+        self.partners = list(partners)
+        self.cache = cache or ResponseCache()
+        self.pool = ConnectionPool()
+        self._limits = {}
+
+    # Recupera un endpoint: dict con url, stato ('cache', 'fetched', 'not_modified', 'stale',
+    # 'error'; 'invalid' se poi il contenuto non si è potuto applicare), changed (contenuto nuovo rispetto alla cache) ed eventuale errore
+    async def fetch(self, partner, url, force=False):
+        meta = self.cache.get(url)
+        result = {'partner': partner.name, 'url': url, 'changed': False, 'error': None}
+        if meta is not None and not force and time.time() - meta['fetched_at'] < partner.ttl:
+            return {**result, 'status': 'cache'}
+
+        headers = dict(partner.headers)
+        if meta is not None and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta is not None and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        limit = self._limits.setdefault(partner.name, asyncio.Semaphore(partner.max_concurrency))
+        error = None
+        for attempt in range(partner.retries + 1):
+            if attempt:
+                await asyncio.sleep(partner.backoff * 2 ** (attempt - 1))
+            try:
+                async with limit:
+                    status, response_headers, body = await http_get(self.pool, url, headers,
+                                                                    partner.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                error = _describe(e)
+                continue
+            except ValueError as e:
+                # URL non supportato o risposta non valida: un nuovo tentativo non cambierebbe l'esito
+                error = _describe(e)
+                break
+            if status == 304 and meta is not None:
+                self.cache.touch(url, meta)
+                return {**result, 'status': 'not_modified'}
+            if status == 200:
+                changed = self.cache.store(url, response_headers, body)
+                return {**result, 'status': 'fetched', 'changed': changed}
+            error = f"HTTP {status}"
+            if status not in RETRY_STATUSES:
+                break
+
+        # Partner non raggiungibile: si continua con l'ultima risposta valida, se c'è
+        status = 'stale' if meta is not None else 'error'
+        return {**result, 'status': status, 'error': error}
+
+    # Recupera tutti gli endpoint di tutti i partner in parallelo; un errore imprevisto
+    # (es. cache su disco non scrivibile) vale solo per il suo endpoint
+    async def refresh(self, force=False):
+        endpoints = [(partner, url) for partner in self.partners for url in partner.urls]
+        results = await asyncio.gather(*(self.fetch(partner, url, force) for partner, url in endpoints),
+                                       return_exceptions=True)
+        for i, ((partner, url), result) in enumerate(zip(endpoints, results)):
+            if isinstance(result, Exception):
+                results[i] = {'partner': partner.name, 'url': url, 'changed': False,
+                              'status': 'stale' if self.cache.get(url) is not None else 'error',
+                              'error': _describe(result)}
+            elif isinstance(result, BaseException):
+                raise result
+        return results
+
+    # Record dell'ultima risposta valida di un endpoint
+    def records(self, url):
+        meta = self.cache.get(url)
+        if meta is None:
+            return iter(())
+        return body_records(self.cache.body(url), meta.get('content_type', ''))
+
+
+class BackgroundRefresher:
+    # on_update(records): chiamata (nel thread di sfondo) per ogni feed con contenuto nuovo
+    def __init__(self, fetcher, interval=60.0, on_update=None):
+        self.fetcher = fetcher
+        self.interval = interval
+        self.on_update = on_update
+        # error: ultimo errore dell'aggiornamento nel suo complesso (None se è riuscito)
+        self.snapshot = {'version': 0, 'refreshed_at': None, 'duration': None, 'endpoints': (),
+                         'error': None}
+        self._thread = None
+        self._loop = None
+        self._wake = None
+        self._stop = False
+        self._redeliver = False
+        self._started = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='partner-refresher', daemon=True)
+            self._thread.start()
+            self._started.wait()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop = True
+        self.refresh_now()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Anticipa il prossimo aggiornamento (senza attenderlo)
+    def refresh_now(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # Cambia il destinatario degli aggiornamenti; il nuovo riceve subito tutti i feed in cache
+    def attach(self, on_update):
+        if on_update != self.on_update:
+            self.on_update = on_update
+            self._redeliver = True
+            self.refresh_now()
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._started.set()
+        try:
+            while not self._stop:
+                try:
+                    await self._refresh()
+                except Exception as e:
+                    # Il thread resta attivo: si riprova al prossimo intervallo
+                    self.snapshot = {**self.snapshot, 'version': self.snapshot['version'] + 1,
+                                     'error': _describe(e)}
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            self.fetcher.pool.close()
+
+    async def _refresh(self):
+        start = time.perf_counter()
+        results = await self.fetcher.refresh()
+        redeliver, self._redeliver = self._redeliver, False
+        on_update = self.on_update
+        if on_update is not None:
+            for i, result in enumerate(results):
+                if result['changed'] or (redeliver and result['status'] != 'error'):
+                    results[i] = await self._deliver(on_update, result)
+        # Lo snapshot viene sostituito in blocco: chi lo legge non vede mai stati parziali
+        self.snapshot = {
+            'version': self.snapshot['version'] + 1,
+            'refreshed_at': time.time(),
+            'duration': time.perf_counter() - start,
+            'endpoints': tuple(results),
+            'error': None,
+        }
+
+    # Consegna i record di un feed al destinatario. Un feed illeggibile (es. JSON troncato)
+    # o rifiutato dal destinatario non ferma gli altri: l'errore resta nel suo endpoint
+    async def _deliver(self, on_update, result):
+        try:
+            # L'applicazione dei record (CPU) non blocca l'event loop
+            await asyncio.to_thread(on_update, self.fetcher.records(result['url']))
+        except Exception as e:
+            return {**result, 'status': 'invalid', 'error': _describe(e)}
+        return result
+
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+# Funzione per ottenere (una volta per file di configurazione) il refresher dei partner
+def partner_refresher(config_path, cache_dir=None, interval=60.0):
+    config_path = os.path.abspath(config_path)
+    with _refreshers_lock:
+        refresher = _refreshers.get(config_path)
+        if refresher is None:
+            fetcher = PartnerFetcher(load_partners(config_path),
+                                     ResponseCache(cache_dir or DEFAULT_CACHE_DIR))
+            refresher = _refreshers[config_path] = BackgroundRefresher(fetcher, interval).start()
+        return refresher
@@ -0,0 +1,123 @@
+# Filtri, ordinamento e paginazione lato server per la dashboard
+#
+# I filtri restituiscono posizioni di riga (array NumPy) invece di copie del
+# DataFrame: la pagina visibile si ottiene con un solo data.iloc sulle righe
+# necessarie. Il risultato è messo in cache per stato dei filtri, così cambiare
+# pagina non ricalcola filtro e ordinamento.
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+
+SORT_COLUMNS = {
+    'esg_score': 'ESG Score',
+    'co2_emissions': 'Emissioni CO₂',
+    'green_activities': 'Attività Green',
+    'product': 'Nome prodotto',
+}
+
+# Valori ammessi per il filtro greenwashing
+GREENWASHING_ALL = 'Tutti'
+GREENWASHING_ONLY = 'Solo segnalati'
+GREENWASHING_NONE = 'Solo non segnalati'
+
+PAGE_SIZES = [10, 25, 50]
+
+# Ogni voce è un array di posizioni (o una chiave di ordinamento) lungo fino all'universo
+# intero: la cache, condivisa da tutte le sessioni, è limitata anche in memoria
+FILTER_CACHE_BYTES = 64 << 20
+
+_filtered = UniverseCache(maxsize=64, name='filters', maxbytes=FILTER_CACHE_BYTES)
+
+
+# Funzione per cercare un testo nei nomi prodotto (sulle categorie, non sulle righe)
+def _search_mask(products, text):
+    if isinstance(products.dtype, pd.CategoricalDtype):
+        names = pd.Series(products.cat.categories)
+        hits = names.str.contains(text, case=False, regex=False).to_numpy()
+        codes = products.cat.codes.to_numpy()
+        # Codice -1 (valore mancante) non corrisponde mai
+        return np.append(hits, False)[codes]
+    return products.astype(str).str.contains(text, case=False, regex=False).to_numpy()
+
+
+# Funzione per ottenere la chiave di ordinamento di una colonna
+def _sort_key(data, column):
+    values = data[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Rango alfabetico delle categorie, poi lookup per codice
+        categories = values.cat.categories
+        rank = np.empty(len(categories) + 1, dtype=np.int64)
+        rank[:-1] = np.argsort(np.argsort(categories.astype(str)))
+        rank[-1] = len(categories)
+        return rank[values.cat.codes.to_numpy()]
+    return values.to_numpy()
+
+
+def _filter(data, score_range, co2_range, greenwashing, search, sort_by, descending):
+    mask = np.ones(len(data), dtype=bool)
+
+    if score_range is not None:
+        scores = data['esg_score'].to_numpy()
+        mask &= (scores >= score_range[0]) & (scores <= score_range[1])
+
+    if co2_range is not None:
+        co2 = data['co2_emissions'].to_numpy()
+        mask &= (co2 >= co2_range[0]) & (co2 <= co2_range[1])
+
+    if greenwashing == GREENWASHING_ONLY:
+        mask &= data['greenwashing_flag'].to_numpy()
+    elif greenwashing == GREENWASHING_NONE:
+        mask &= ~data['greenwashing_flag'].to_numpy()
+
+    if search:
+        mask &= _search_mask(data['product'], search)
+
+    positions = np.flatnonzero(mask)
+
+    if sort_by is not None:
+        sort_key = _filtered.get(data, ('sort_key', sort_by), lambda: _sort_key(data, sort_by))
+        keys = sort_key[positions].astype(np.float64)
+        if descending:
+            # Negando la chiave l'ordinamento resta stabile e i NaN restano in fondo
+            keys = -keys
+        order = np.argsort(keys, kind='stable')
+        positions = positions[order]
+
+    # L'array è condiviso tra sessioni tramite la cache: int32 basta fino a 2^31 righe
+    if len(data) <= np.iinfo(np.int32).max:
+        positions = positions.astype(np.int32)
+    positions.flags.writeable = False
+    return positions
+
+
+# Funzione per ottenere la chiave che identifica uno stato dei filtri (senza ordinamento)
+def filter_key(score_range=None, co2_range=None, greenwashing=GREENWASHING_ALL, search=''):
+    return (
+        tuple(score_range) if score_range is not None else None,
+        tuple(co2_range) if co2_range is not None else None,
+        greenwashing,
+        (search or '').strip().lower(),
+    )
+
+
+# Funzione per filtrare e ordinare l'universo; restituisce le posizioni di riga
+def filter_positions(data, score_range=None, co2_range=None, greenwashing=GREENWASHING_ALL,
+                     search='', sort_by=None, descending=False):
+    if sort_by is not None and sort_by not in SORT_COLUMNS:
+        raise ValueError(f"Colonna di ordinamento non valida: {sort_by}")
+    search = (search or '').strip()
+    key = filter_key(score_range, co2_range, greenwashing, search) + (sort_by, bool(descending))
+    return _filtered.get(data, key, lambda: _filter(data, score_range, co2_range, greenwashing,
+                                                    search, sort_by, descending))
+
+
+# Funzione per ottenere le posizioni di una pagina e il numero totale di pagine
+def page_positions(positions, page, page_size):
+    n_pages = max(1, math.ceil(len(positions) / page_size))
+    page = min(max(1, int(page)), n_pages)
+    start = (page - 1) * page_size
+    return positions[start:start + page_size], n_pages
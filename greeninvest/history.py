@@ -0,0 +1,367 @@
+# Storico giornaliero delle metriche ESG per prodotto
+#
+# Ogni metrica è una matrice float32 prodotti x giorni (NaN = osservazione
+# mancante), contigua per prodotto: la serie di un prodotto è un'unica lettura
+# sequenziale. Su disco ogni metrica è un file grezzo mappato in memoria
+# (np.memmap) con capacità in giorni che raddoppia quando si esaurisce, più
+# meta.json (data di inizio, giorni usati, capacità) e products.json. Le analisi
+# (trend su finestra mobile, drawdown dello score, score in crescita con
+# emissioni in crescita) sono vettoriali su blocchi di prodotti, quindi la
+# memoria usata non dipende dalla dimensione dello storico.
+
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+
+METRICS = ('esg_score', 'co2_emissions', 'green_activities')
+
+# Prodotti elaborati per blocco nelle scansioni dell'intero storico
+BLOCK_PRODUCTS = 4096
+
+# Capacità iniziale in giorni di un nuovo storico
+INITIAL_CAPACITY = 366
+
+_META = 'meta.json'
+_PRODUCTS = 'products.json'
+
+_stores = {}
+_stores_lock = threading.Lock()
+_analyses = UniverseCache(maxsize=32, name='history')
+
+
+def _day(date):
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+# Pendenza della retta di regressione per riga (valori per giorno), ignorando i NaN.
+# x: ascisse delle colonne; min_periods: osservazioni minime, altrimenti NaN.
+def _slopes(values, x, min_periods=2):
+    values = values.astype(np.float64)
+    valid = ~np.isnan(values)
+    y = np.where(valid, values, 0.0)
+    xv = np.where(valid, x, 0.0)
+    n = valid.sum(axis=1)
+    sx, sy = xv.sum(axis=1), y.sum(axis=1)
+    sxx, sxy = (xv * xv).sum(axis=1), (xv * y).sum(axis=1)
+    den = n * sxx - sx * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / den
+    return np.where((n >= min_periods) & (den > 0), slope, np.nan)
+
+
+class HistoryStore:
+    # directory=None: storico solo in memoria (es. dati dimostrativi)
+    def __init__(self, directory=None, writable=False, _arrays=None, _meta=None, _products=None):
+        self.directory = directory
+        self.writable = writable
+        self._lock = threading.RLock()
+        if directory is None:
+            self._meta, self._arrays = _meta, _arrays
+            self.products = pd.Index(_products)
+        else:
+            with open(os.path.join(directory, _META), encoding='utf-8') as f:
+                self._meta = json.load(f)
+            with open(os.path.join(directory, _PRODUCTS), encoding='utf-8') as f:
+                self.products = pd.Index(json.load(f))
+            self._arrays = {metric: self._map(metric) for metric in self._meta['metrics']}
+        self.products.get_indexer(self.products[:1])
+
+    # Crea uno storico vuoto (su disco se directory non è None)
+    @classmethod
+    def create(cls, directory, products, start, metrics=METRICS, capacity=INITIAL_CAPACITY):
+        products = list(products)
+        meta = {'start': str(_day(start)), 'n_days': 0, 'capacity': int(capacity),
+                'metrics': list(metrics)}
+        if directory is None:
+            arrays = {m: np.full((len(products), capacity), np.nan, dtype=np.float32) for m in metrics}
+            return cls(None, True, arrays, meta, products)
+
+        os.makedirs(directory, exist_ok=True)
+        for metric in metrics:
+            path = os.path.join(directory, f'{metric}.f32')
+            array = np.memmap(path, dtype=np.float32, mode='w+', shape=(max(len(products), 1), capacity))
+            array[:] = np.nan
+            array.flush()
+            del array
+        with open(os.path.join(directory, _PRODUCTS), 'w', encoding='utf-8') as f:
+            json.dump(products, f)
+        with open(os.path.join(directory, _META), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return cls(directory, writable=True)
+
+    def _map(self, metric):
+        shape = (len(self.products), self._meta['capacity'])
+        if shape[0] == 0:
+            return np.empty(shape, dtype=np.float32)
+        return np.memmap(os.path.join(self.directory, f'{metric}.f32'), dtype=np.float32,
+                         mode='r+' if self.writable else 'r', shape=shape)
+
+    @property
+    def metrics(self):
+        return tuple(self._meta['metrics'])
+
+    @property
+    def start(self):
+        return np.datetime64(self._meta['start'], 'D')
+
+    @property
+    def n_days(self):
+        return self._meta['n_days']
+
+    @property
+    def dates(self):
+        return pd.date_range(str(self.start), periods=self.n_days, freq='D')
+
+    def __len__(self):
+        return len(self.products)
+
+    # Matrice prodotti x giorni osservati di una metrica (vista, senza copia)
+    def values(self, metric):
+        return self._arrays[metric][:, :self.n_days]
+
+    # Posizioni dei prodotti nello storico (-1 se assenti)
+    def positions(self, products):
+        return self.products.get_indexer(list(products))
+
+    # Serie storica di un prodotto
+    def series(self, product, metric):
+        pos = self.products.get_loc(product)
+        return pd.Series(np.asarray(self.values(metric)[pos]), index=self.dates, name=metric)
+
+    def _save_meta(self):
+        if self.directory is None:
+            return
+        tmp = os.path.join(self.directory, _META + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, os.path.join(self.directory, _META))
+
+    def _resize(self, n_products, capacity):
+        old_products, old_capacity = self._arrays[self.metrics[0]].shape
+        for metric in self.metrics:
+            old = self._arrays[metric]
+            if self.directory is None:
+                new = np.full((n_products, capacity), np.nan, dtype=np.float32)
+                new[:old_products, :old_capacity] = old
+                self._arrays[metric] = new
+                continue
+            path = os.path.join(self.directory, f'{metric}.f32')
+            if capacity == old_capacity:
+                # Layout per prodotto: i nuovi prodotti sono righe in coda al file
+                if isinstance(old, np.memmap):
+                    old.flush()
+                del old
+                self._arrays[metric] = None
+                with open(path, 'r+b') as f:
+                    f.truncate(n_products * capacity * 4)
+                new = np.memmap(path, dtype=np.float32, mode='r+', shape=(n_products, capacity))
+                new[old_products:] = np.nan
+            else:
+                # Più giorni: nuovo file con righe più lunghe, copiato a blocchi di prodotti
+                tmp = path + '.tmp'
+                new = np.memmap(tmp, dtype=np.float32, mode='w+', shape=(n_products, capacity))
+                for start in range(0, n_products, BLOCK_PRODUCTS):
+                    stop = min(start + BLOCK_PRODUCTS, n_products)
+                    new[start:stop] = np.nan
+                    if start < old_products:
+                        new[start:min(stop, old_products), :old_capacity] = old[start:min(stop, old_products)]
+                new.flush()
+                del new, old
+                self._arrays[metric] = None
+                os.replace(tmp, path)
+                new = np.memmap(path, dtype=np.float32, mode='r+', shape=(n_products, capacity))
+            self._arrays[metric] = new
+        self._meta['capacity'] = capacity
+
+    # Aggiunge prodotti nuovi (righe vuote); restituisce le posizioni di tutti i prodotti indicati
+    def add_products(self, products):
+        if not self.writable:
+            raise PermissionError("Storico aperto in sola lettura")
+        products = list(products)
+        with self._lock:
+            pos = self.positions(products)
+            new = list(dict.fromkeys(p for p, i in zip(products, pos) if i < 0))
+            if new:
+                self._resize(len(self.products) + len(new), self._meta['capacity'])
+                self.products = self.products.append(pd.Index(new))
+                self.products.get_indexer(self.products[:1])
+                if self.directory is not None:
+                    with open(os.path.join(self.directory, _PRODUCTS), 'w', encoding='utf-8') as f:
+                        json.dump(list(self.products), f)
+                pos = self.positions(products)
+            return pos
+
+    # Registra le osservazioni di un giorno: values è {metrica: array allineato a products}
+    def append_day(self, date, products, values):
+        self.append_days(date, products,
+                         {m: np.asarray(v, dtype=np.float32)[:, None] for m, v in values.items()})
+
+    # Registra più giorni consecutivi a partire da date (es. caricamento dello storico):
+    # values è {metrica: matrice prodotti x giorni}, scritta per righe contigue
+    def append_days(self, date, products, values):
+        if not self.writable:
+            raise PermissionError("Storico aperto in sola lettura")
+        offset = int((_day(date) - self.start).astype(np.int64))
+        if offset < 0:
+            raise ValueError(f"Data precedente all'inizio dello storico: {date}")
+        days = max(np.shape(v)[1] for v in values.values())
+        with self._lock:
+            pos = self.add_products(products)
+            capacity = self._meta['capacity']
+            if offset + days > capacity:
+                while offset + days > capacity:
+                    capacity *= 2
+                self._resize(len(self.products), capacity)
+            for metric, metric_values in values.items():
+                metric_values = np.asarray(metric_values, dtype=np.float32)
+                self._arrays[metric][pos, offset:offset + metric_values.shape[1]] = metric_values
+            self._meta['n_days'] = max(self.n_days, offset + days)
+            self._save_meta()
+
+    def flush(self):
+        with self._lock:
+            for array in self._arrays.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+            self._save_meta()
+
+    # Blocchi (posizioni, valori) di una metrica su tutti i prodotti o su alcune posizioni
+    def _blocks(self, metric, positions=None, days=None):
+        values = self.values(metric)
+        if days is not None:
+            values = values[:, max(0, self.n_days - days):]
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            for start in range(0, len(positions), BLOCK_PRODUCTS):
+                block = positions[start:start + BLOCK_PRODUCTS]
+                yield block, np.asarray(values[block])
+            return
+        for start in range(0, len(self.products), BLOCK_PRODUCTS):
+            stop = min(start + BLOCK_PRODUCTS, len(self.products))
+            yield np.arange(start, stop), np.asarray(values[start:stop])
+
+    # Pendenza (unità per giorno) della regressione sugli ultimi `window` giorni, per prodotto
+    def trend(self, metric, window=365, positions=None, min_periods=None):
+        min_periods = min_periods or max(2, window // 4)
+        n = len(self.products) if positions is None else len(positions)
+        out = np.full(n, np.nan, dtype=np.float32)
+        offset = 0
+        for _, block in self._blocks(metric, positions, days=window):
+            x = np.arange(block.shape[1], dtype=np.float64)
+            out[offset:offset + len(block)] = _slopes(block, x, min_periods)
+            offset += len(block)
+        return out
+
+    # Trend su finestra mobile per ogni giorno (prodotti x giorni), con somme cumulative: O(giorni)
+    def rolling_trend(self, metric, positions, window=90, min_periods=None):
+        min_periods = min_periods or max(2, window // 4)
+        out = []
+        for _, block in self._blocks(metric, positions):
+            values = block.astype(np.float64)
+            valid = ~np.isnan(values)
+            x = np.arange(values.shape[1], dtype=np.float64)
+            terms = [valid, np.where(valid, x, 0.0), np.where(valid, values, 0.0)]
+            terms += [terms[1] * terms[1], terms[1] * terms[2]]
+            sums = []
+            for term in terms:
+                cum = np.cumsum(term, axis=1, dtype=np.float64)
+                shifted = np.zeros_like(cum)
+                shifted[:, window:] = cum[:, :-window] if window < cum.shape[1] else 0
+                sums.append(cum - shifted)
+            n, sx, sy, sxx, sxy = sums
+            den = n * sxx - sx * sx
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slope = (n * sxy - sx * sy) / den
+            out.append(np.where((n >= min_periods) & (den > 1e-9), slope, np.nan).astype(np.float32))
+        if not out:
+            return np.empty((0, self.n_days), dtype=np.float32)
+        return np.concatenate(out)
+
+    # Massimo calo dello score rispetto al massimo precedente, e calo attuale dal massimo
+    def drawdown(self, metric='esg_score', positions=None):
+        n = len(self.products) if positions is None else len(positions)
+        worst = np.full(n, np.nan, dtype=np.float32)
+        current = np.full(n, np.nan, dtype=np.float32)
+        offset = 0
+        for _, block in self._blocks(metric, positions):
+            # fmax ignora i NaN: il massimo precedente salta le osservazioni mancanti
+            peak = np.fmax.accumulate(block, axis=1)
+            drop = peak - block
+            worst[offset:offset + len(block)] = np.fmax.reduce(drop, axis=1) if drop.shape[1] else np.nan
+            if block.shape[1]:
+                last = _last_valid(block)
+                current[offset:offset + len(block)] = peak[:, -1] - last
+            offset += len(block)
+        return worst, current
+
+    # Prodotti con score ESG in crescita ed emissioni CO₂ in crescita sugli ultimi `window` giorni
+    # (variazioni stimate dalla pendenza della regressione, nelle unità delle metriche)
+    def improved_while_emitting(self, window=365, min_score_change=0.0, min_co2_change=0.0,
+                                positions=None):
+        score_change = self.trend('esg_score', window, positions) * (window - 1)
+        co2_change = self.trend('co2_emissions', window, positions) * (window - 1)
+        return (score_change > min_score_change) & (co2_change > min_co2_change)
+
+    # Serie ridotte a `points` punti (media per intervallo) per i grafici sparkline
+    def sparklines(self, metric, positions, points=52, days=None):
+        out = []
+        for _, block in self._blocks(metric, positions, days=days):
+            length = block.shape[1]
+            if length <= points:
+                out.append(block.astype(np.float32))
+                continue
+            edges = np.linspace(0, length, points + 1).astype(np.int64)[:-1]
+            valid = ~np.isnan(block)
+            sums = np.add.reduceat(np.where(valid, block, 0).astype(np.float64), edges, axis=1)
+            counts = np.add.reduceat(valid, edges, axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out.append((sums / counts).astype(np.float32))
+        if not out:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(out)
+
+
+# Ultimo valore non mancante di ogni riga (NaN se la riga è vuota)
+def _last_valid(block):
+    valid = ~np.isnan(block)
+    last = block.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    values = block[np.arange(len(block)), last]
+    return np.where(valid.any(axis=1), values, np.nan)
+
+
+# Funzione per aprire (una volta per cartella e versione dei metadati) uno storico su disco
+def load_history(directory):
+    directory = os.path.abspath(directory)
+    stat = os.stat(os.path.join(directory, _META))
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _stores_lock:
+        entry = _stores.get(directory)
+        if entry is None or entry[0] != stamp:
+            entry = _stores[directory] = (stamp, HistoryStore(directory))
+        return entry[1]
+
+
+# Funzione per calcolare gli indicatori storici dei prodotti (tutti, in cache per storico,
+# oppure solo alcune posizioni, es. la pagina visibile della dashboard).
+# Restituisce un DataFrame indicizzato per prodotto: trend annuo di score e CO₂,
+# drawdown massimo e attuale dello score, segnale "score su, emissioni su"
+def history_indicators(history, window=365, positions=None):
+    def build():
+        score_trend = history.trend('esg_score', window, positions)
+        co2_trend = history.trend('co2_emissions', window, positions)
+        worst, current = history.drawdown('esg_score', positions)
+        return pd.DataFrame({
+            'score_trend': score_trend * 365,
+            'co2_trend': co2_trend * 365,
+            'max_drawdown': worst,
+            'drawdown': current,
+            'improved_while_emitting': (score_trend > 0) & (co2_trend > 0),
+        }, index=history.products if positions is None else history.products[positions])
+    if positions is not None:
+        return build()
+    return _analyses.get(history, ('indicators', history.n_days, window), build)
@@ -0,0 +1,529 @@
+# Ingestione incrementale dei feed ESG dei partner
+#
+# I partner (Intesa Sanpaolo, Clarity AI, ...) inviano flussi di record di
+# modifica in JSON Lines o CSV: {"op": "upsert", "product": ..., campi} oppure
+# {"op": "delete", "product": ...}. I record vengono letti da una cartella di
+# deposito (da un thread di sfondo, vedi FeedPoller) o dalle API dei partner
+# (fetcher.py) con una catena di generatori, quindi la memoria usata è limitata
+# dalla dimensione del lotto. Ogni lotto produce una
+# nuova versione dell'universo (le precedenti restano valide per chi le usa):
+# flag di greenwashing, min/max CO₂ dell'indice prodotti, statistiche del
+# grafico panoramica e classifiche delle raccomandazioni vengono ricalcolati
+# solo per le righe modificate.
+
+import csv
+import functools
+import io
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.aggregation import GROUP_COLUMNS, register_score_stats, score_stats
+from greeninvest.cache import UniverseCache
+from greeninvest.comparator import index_for, register_index
+from greeninvest.loader import REQUIRED_COLUMNS
+from greeninvest.recommendations import carry_rankings
+from greeninvest.rules import column_versions, default_engine, new_column_version, set_column_versions
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+# Estensioni dei file di feed (i file in scrittura vanno depositati con un altro
+# nome, es. .tmp, e rinominati alla fine)
+FEED_EXTENSIONS = ('.jsonl', '.ndjson', '.csv')
+
+# Sottocartella in cui vengono spostati i file già applicati
+PROCESSED_DIR = 'processed'
+
+# Sottocartella in cui vengono spostati i file illeggibili (codifica o formato non validi)
+REJECTED_DIR = 'rejected'
+
+# File scartati ricordati da FeedPoller (i più recenti)
+MAX_REJECTED_FILES = 20
+
+# Record applicati per lotto (una nuova versione dell'universo per lotto)
+BATCH_SIZE = 10_000
+
+# Frazione dell'universo modificata dopo cui le soglie dei quantili vengono ricalcolate
+QUANTILE_REFRESH = 0.01
+
+# Secondi tra due controlli della cartella di deposito (FeedPoller)
+FEED_POLL_INTERVAL = 5.0
+
+GREENWASHING_COLUMNS = ('greenwashing_flag', 'greenwashing_severity', 'greenwashing_rules')
+
+_live = UniverseCache(maxsize=4, name='live_universe')
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+# Funzione per leggere righe JSON Lines (testo o bytes); le righe non valide diventano None
+def _json_lines(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+
+
+# Funzione per leggere i record di un feed già scaricato (JSON Lines, array JSON o CSV)
+def body_records(body, content_type=''):
+    if 'csv' in content_type:
+        return csv.DictReader(io.StringIO(body.decode('utf-8')))
+    if body.lstrip()[:1] == b'[':
+        return iter(json.loads(body))
+    return _json_lines(body.splitlines())
+
+
+# Funzione per leggere i record grezzi di un file di feed, una riga alla volta
+def read_feed_file(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            yield from _json_lines(f)
+
+
+# Funzione per controllare che un file di feed sia leggibile per intero (codifica UTF-8 e
+# formato CSV), senza conservarne i record; solleva ValueError o csv.Error. Le singole
+# righe JSON non valide non rendono illeggibile il file: vengono scartate all'applicazione
+def check_feed_file(path):
+    for _ in read_feed_file(path):
+        pass
+
+
+# Funzione per elencare i file di feed pronti nella cartella di deposito (in ordine di nome)
+def pending_feed_files(directory):
+    with os.scandir(directory) as entries:
+        names = sorted(e.name for e in entries
+                       if e.is_file() and not e.name.startswith('.')
+                       and e.name.lower().endswith(FEED_EXTENSIONS))
+    return [os.path.join(directory, name) for name in names]
+
+
+# Funzione per validare un record di modifica: restituisce (operazione, prodotto, campi)
+def parse_record(raw):
+    if not isinstance(raw, dict):
+        raise ValueError("Record non valido")
+    op = str(raw.get('op') or UPSERT).strip().lower()
+    if op not in (UPSERT, DELETE):
+        raise ValueError(f"Operazione non valida: {op}")
+    product = raw.get('product')
+    if product is None or not str(product).strip():
+        raise ValueError("Record senza prodotto")
+    fields = {key: value for key, value in raw.items()
+              if key not in ('op', 'product') and key not in GREENWASHING_COLUMNS
+              and value is not None and value != ''}
+    return op, str(product).strip(), fields
+
+
+# Valori accettati nei feed per le colonne booleane (es. 1/0, "true"/"false", "sì"/"no")
+_TRUE = {'1', '1.0', 'true', 'yes', 'y', 'si', 'sì'}
+_FALSE = {'0', '0.0', 'false', 'no', 'n'}
+
+
+def _to_bool(value):
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"Valore booleano non valido: {value!r}")
+
+
+# Colonne aggiornabili dell'universo: nome -> conversione dei valori dei feed
+def _column_kinds(data):
+    kinds = {}
+    for col, dtype in data.dtypes.items():
+        if col in GREENWASHING_COLUMNS:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            kinds[col] = str
+        elif pd.api.types.is_bool_dtype(dtype):
+            kinds[col] = _to_bool
+        elif pd.api.types.is_numeric_dtype(dtype):
+            kinds[col] = float
+        else:
+            kinds[col] = str
+    return kinds
+
+
+# Converte i campi di un record nei tipi delle colonne (campi sconosciuti ignorati)
+def _convert_fields(kinds, fields):
+    return {key: kinds[key](value) for key, value in fields.items() if key in kinds}
+
+
+# Dtype della colonna dopo l'assegnazione: gli interi vengono allargati solo se necessario
+def _column_dtype(dtype, values):
+    if not np.issubdtype(dtype, np.integer) or len(values) == 0:
+        return dtype
+    info = np.iinfo(dtype)
+    if (np.isfinite(values).all() and (np.mod(values, 1) == 0).all()
+            and values.min() >= info.min and values.max() <= info.max):
+        return dtype
+    return np.result_type(dtype, np.float32)
+
+
+# Nuova colonna con valori cambiati in `positions` e valori `appended` in coda (copy-on-write)
+def _update_column(column, positions, values, appended):
+    if not positions and not appended:
+        return column
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # column.dtype.categories è sempre lo stesso oggetto: la sua tabella hash resta in cache
+        dtype = column.dtype
+        categories = dtype.categories
+        new = pd.Index(pd.unique(np.array([v for v in values + appended if v is not None],
+                                          dtype=object)))
+        missing = new[categories.get_indexer(new) < 0]
+        if len(missing):
+            dtype = pd.CategoricalDtype(categories.append(missing))
+
+        # Le nuove categorie sono in coda: codice = len(categories) + posizione tra le mancanti
+        def codes_of(items):
+            items = pd.Index(items, dtype=object)
+            codes = categories.get_indexer(items)
+            extra = missing.get_indexer(items)
+            return np.where((codes < 0) & (extra >= 0), len(categories) + extra, codes)
+
+        codes = np.concatenate([column.cat.codes.to_numpy().astype(np.int64), codes_of(appended)])
+        if positions:
+            codes[positions] = codes_of(values)
+        return pd.Categorical.from_codes(codes, dtype=dtype)
+
+    array = column.to_numpy()
+    if array.dtype == bool:
+        # Una colonna booleana non ha valori mancanti: i prodotti nuovi senza il campo valgono False
+        appended = np.array([False if v is None else v for v in appended], dtype=bool)
+        array = np.concatenate([array, appended])
+        array[positions] = np.asarray(values, dtype=bool)
+        return array
+
+    if pd.api.types.is_numeric_dtype(array.dtype):
+        new_values = np.array([np.nan if v is None else v for v in values + appended],
+                              dtype=np.float64)
+        dtype = _column_dtype(array.dtype, new_values)
+        array = np.concatenate([array.astype(dtype), new_values[len(values):].astype(dtype)])
+        array[positions] = new_values[:len(values)]
+        return array
+
+    array = np.concatenate([array.astype(object), np.array(appended, dtype=object)])
+    array[positions] = values
+    return array
+
+
+class LiveUniverse:
+    def __init__(self, data, engine=None):
+        self.engine = engine or default_engine()
+        self.data = data
+        # Incrementata ad ogni lotto applicato
+        self.version = 0
+        self._quantiles = self.engine.quantiles(data) if self.engine.has_percentiles else {}
+        self._changed_rows = 0
+        self._replayed = set()
+        self._lock = threading.RLock()
+        self.counters = {'upserted': 0, 'inserted': 0, 'deleted': 0, 'rejected': 0, 'batches': 0}
+
+    # Applica un flusso di record grezzi, un lotto alla volta; restituisce l'universo aggiornato
+    def ingest(self, records, batch_size=BATCH_SIZE):
+        records = iter(records)
+        with self._lock:
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                self._apply(batch)
+            return self.data
+
+    # Applica i file in attesa nella cartella di deposito e li sposta in processed/.
+    # Un file viene spostato solo dopo essere stato applicato per intero. Al primo
+    # controllo vengono riapplicati i file già in processed/ (es. dopo un riavvio o
+    # un nuovo universo di partenza): gli upsert e le cancellazioni sono idempotenti.
+    # Ogni file viene prima letto per intero (vedi check_feed_file): un file illeggibile
+    # non viene applicato nemmeno in parte, finisce in rejected/ e non ferma gli altri.
+    # Restituisce i file scartati come lista di (nome, errore).
+    def poll(self, directory):
+        rejected = []
+        with self._lock:
+            done = os.path.join(directory, PROCESSED_DIR)
+            if directory not in self._replayed:
+                if os.path.isdir(done):
+                    for path in pending_feed_files(done):
+                        self.ingest(read_feed_file(path))
+                self._replayed.add(directory)
+            for path in pending_feed_files(directory):
+                name = os.path.basename(path)
+                try:
+                    check_feed_file(path)
+                except (ValueError, csv.Error) as e:
+                    os.makedirs(os.path.join(directory, REJECTED_DIR), exist_ok=True)
+                    os.replace(path, os.path.join(directory, REJECTED_DIR, name))
+                    rejected.append((name, f"{type(e).__name__}: {e}"))
+                    continue
+                self.ingest(read_feed_file(path))
+                os.makedirs(done, exist_ok=True)
+                os.replace(path, os.path.join(done, name))
+        return rejected
+
+    def _parse_batch(self, batch):
+        # L'ultimo record per prodotto vince; più upsert dello stesso prodotto si uniscono
+        changes = {}
+        kinds = _column_kinds(self.data)
+        for raw in batch:
+            try:
+                op, product, fields = parse_record(raw)
+                fields = _convert_fields(kinds, fields)
+            except (ValueError, TypeError):
+                self.counters['rejected'] += 1
+                continue
+            previous = changes.get(product)
+            if op == UPSERT and previous is not None and previous[0] == UPSERT:
+                fields = {**previous[1], **fields}
+            changes[product] = (op, fields)
+        return changes
+
+    def _apply(self, batch):
+        data = self.data
+        changes = self._parse_batch(batch)
+        if not changes:
+            return
+        index = index_for(data)
+        found = index.find(list(changes))
+
+        updated, inserted, deleted = [], [], []
+        for (product, (op, fields)), pos in zip(changes.items(), found):
+            if op == DELETE:
+                if pos >= 0:
+                    deleted.append(int(pos))
+            elif pos >= 0:
+                updated.append((int(pos), fields))
+            elif all(col in fields for col in REQUIRED_COLUMNS if col != 'product'):
+                inserted.append({'product': product, **fields})
+            else:
+                self.counters['rejected'] += 1
+        if not (updated or inserted or deleted):
+            return
+
+        n = len(data)
+        update_positions = np.array([pos for pos, _ in updated], dtype=np.int64)
+        changed = np.concatenate([update_positions,
+                                  np.arange(n, n + len(inserted), dtype=np.int64)])
+
+        columns = {}
+        written = set(GREENWASHING_COLUMNS)
+        for col in data.columns:
+            if col in GREENWASHING_COLUMNS:
+                continue
+            touched = [(pos, fields[col]) for pos, fields in updated if col in fields]
+            if touched:
+                written.add(col)
+            columns[col] = _update_column(data[col], [pos for pos, _ in touched],
+                                          [value for _, value in touched],
+                                          [row.get(col) for row in inserted])
+        frame = pd.DataFrame(columns)
+
+        # Flag di greenwashing: si rivalutano solo le righe modificate, con soglie fisse
+        result = self.engine.evaluate(frame.iloc[changed], self._quantiles)
+        for col, values in zip(GREENWASHING_COLUMNS, (result.flags, result.severity, result.codes)):
+            old = data[col].to_numpy()
+            column = np.concatenate([old, np.zeros(len(inserted), dtype=old.dtype)])
+            column[changed] = values
+            frame[col] = column
+
+        # Statistiche del grafico aggiornate per differenza (le righe modificate non sono cancellate)
+        stat_columns = ['esg_score'] + [col for col in GROUP_COLUMNS if col in frame.columns]
+        removed = data[stat_columns].iloc[np.concatenate([update_positions, deleted]).astype(np.int64)]
+        stats = score_stats(data).updated(frame, removed, frame[stat_columns].iloc[changed])
+
+        # Righe nuove o modificate (per le classifiche delle raccomandazioni) prima delle cancellazioni
+        changed_rows = frame.iloc[changed]
+        removed_products = data['product'].iloc[np.concatenate([update_positions, deleted]).astype(np.int64)]
+
+        if deleted:
+            keep = np.ones(len(frame), dtype=bool)
+            keep[deleted] = False
+            frame = frame[keep].reset_index(drop=True)
+
+        # Versioni delle colonne per la cache delle maschere delle regole: nuove per le colonne
+        # scritte (per tutte se cambiano le righe), le altre restano quelle della versione precedente
+        versions = column_versions(data)
+        if inserted or deleted:
+            written = set(frame.columns)
+        set_column_versions(frame, {col: new_column_version() if col in written or col not in versions
+                                    else versions[col] for col in frame.columns})
+
+        self._changed_rows += len(changed) + len(deleted)
+        if self.engine.has_percentiles and self._changed_rows > QUANTILE_REFRESH * len(frame):
+            # Le soglie si sono spostate abbastanza da rivalutare l'intero universo
+            self._quantiles = self.engine.quantiles(frame)
+            self.engine.apply(frame, self._quantiles)
+            self._changed_rows = 0
+        else:
+            # I flag delle altre righe non cambiano: le classifiche vanno aggiornate solo dove serve
+            carry_rankings(data, frame, changed_rows, removed_products)
+
+        register_score_stats(frame, stats)
+        # Le cancellazioni spostano le posizioni di riga: l'indice verrà ricostruito al primo uso
+        if not deleted:
+            register_index(frame, index.updated(frame, update_positions,
+                                                [row['product'] for row in inserted]))
+
+        self.data = frame
+        self.version += 1
+        self.counters['upserted'] += len(updated)
+        self.counters['inserted'] += len(inserted)
+        self.counters['deleted'] += len(deleted)
+        self.counters['batches'] += 1
+
+
+# Funzione per ottenere (una volta per universo di partenza) l'universo aggiornato dai feed
+def live_universe(data):
+    return _live.get(data, 'live_universe', lambda: LiveUniverse(data))
+
+
+class FeedPoller:
+    # Applica in un thread di sfondo i file della cartella di deposito all'universo collegato
+    # (vedi attach): le riesecuzioni dell'app leggono solo live.data, senza attendere i feed
+    def __init__(self, directory, interval=FEED_POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.live = None
+        # Ultimo errore del controllo della cartella o del suo ultimo file scartato
+        # (None se l'ultimo controllo è riuscito senza scartare file)
+        self.error = None
+        # File spostati in rejected/ come (nome, errore), i più recenti in coda
+        self.rejected = []
+        self.polled_at = None
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='feed-poller', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Anticipa il prossimo controllo (senza attenderlo)
+    def poll_now(self):
+        self._wake.set()
+
+    # Cambia l'universo a cui applicare i feed (es. nuovo universo di partenza)
+    def attach(self, live):
+        if live is not self.live:
+            self.live = live
+            self.poll_now()
+        return self
+
+    def _run(self):
+        while not self._stop:
+            self._wake.clear()
+            live = self.live
+            if live is not None:
+                try:
+                    rejected = live.poll(self.directory)
+                except OSError as e:
+                    self.error = e
+                else:
+                    if rejected:
+                        self.rejected = (self.rejected + rejected)[-MAX_REJECTED_FILES:]
+                        name, error = rejected[-1]
+                        self.error = f"file {name} scartato ({error})"
+                    else:
+                        self.error = None
+                self.polled_at = time.time()
+            self._wake.wait(self.interval)
+
+
+# Funzione per ottenere (una volta per cartella) il thread che applica i feed depositati
+def feed_poller(directory, interval=FEED_POLL_INTERVAL):
+    directory = os.path.abspath(directory)
+    with _pollers_lock:
+        poller = _pollers.get(directory)
+        if poller is None:
+            poller = _pollers[directory] = FeedPoller(directory, interval).start()
+        return poller
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    # GET / restituisce l'elenco JSON dei feed, GET /<nome> il contenuto del file.
+    # HTTP/1.1 con keep-alive ed ETag (If-None-Match -> 304); latenza ed errori 503
+    # iniettabili per provare timeout e tentativi del client.
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, *args, directory, latency=0.0, error_rate=0.0, **kwargs):
+        self.directory = directory
+        self.latency = latency
+        self.error_rate = error_rate
+        super().__init__(*args, **kwargs)
+
+    def _send(self, status, body=b'', content_type='application/json', etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return self._send(503, b'{"error": "non disponibile"}')
+
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if path == '/':
+            names = [os.path.basename(p) for p in pending_feed_files(self.directory)]
+            return self._send(200, json.dumps(names).encode('utf-8'))
+
+        name = os.path.basename(path)
+        file_path = os.path.join(self.directory, name)
+        if name != path.lstrip('/') or not name.lower().endswith(FEED_EXTENSIONS) \
+                or not os.path.isfile(file_path):
+            return self._send(404, b'{"error": "feed non trovato"}')
+        stat = os.stat(file_path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, etag=etag)
+        with open(file_path, 'rb') as f:
+            body = f.read()
+        content_type = 'text/csv' if name.lower().endswith('.csv') else 'application/x-ndjson'
+        self._send(200, body, content_type, etag)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Funzione per avviare un server HTTP locale che espone i file di una cartella come feed
+# (sviluppo e prove, con latenza in secondi e frazione di errori 503 iniettabili);
+# restituisce il server, fermarlo con server.shutdown()
+def serve_feed_directory(directory, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0):
+    handler = functools.partial(_FeedHandler, directory=os.path.abspath(directory),
+                                latency=latency, error_rate=error_rate)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
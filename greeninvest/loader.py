@@ -0,0 +1,197 @@
+# Caricamento dell'universo ESG da file locali (Parquet, Arrow/Feather, CSV)
+#
+# L'universo viene letto una sola volta in un DataFrame colonnare compatto e
+# tenuto in una cache di processo, condivisa tra rerun e sessioni Streamlit.
+# Il file viene riletto solo se cambiano mtime/dimensione (ed eventualmente
+# l'hash del contenuto). Il DataFrame restituito è condiviso: non modificarlo.
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.metrics import timed
+from greeninvest.rules import default_engine, new_column_version, set_column_versions
+
+REQUIRED_COLUMNS = ('product', 'esg_score', 'co2_emissions', 'green_activities')
+
+# Colonne testuali da memorizzare come categorie
+CATEGORICAL_COLUMNS = ('product', 'sector', 'partner')
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+_cache = {}
+# _cache_lock protegge solo il dizionario della cache; la lettura di un file avviene
+# sotto il lock del suo percorso, così file diversi si caricano in parallelo
+_cache_lock = threading.Lock()
+_path_locks = {}
+_cache_counts = {'hits': 0, 'misses': 0}
+
+
+# Metriche ESG: la precisione float32 basta anche quando cambia qualche decimale
+FLOAT32_COLUMNS = ('esg_score', 'co2_emissions', 'green_activities')
+
+
+# Funzione per scegliere il dtype numerico più piccolo e sicuro per una colonna.
+# Fuori da FLOAT32_COLUMNS si passa a float32 solo se tutti i valori restano identici
+# (importi, identificativi oltre 2^24, ...); gli interi oltre int32 restano interi
+def _compact_numeric(series, lossy=False):
+    values = pd.to_numeric(series)
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype(bool)
+    as_float = values.to_numpy(dtype=np.float64)
+    if not values.isna().any() and np.all(np.mod(as_float, 1) == 0):
+        # Mai sotto int16: le differenze tra punteggi non devono andare in overflow
+        if len(as_float) == 0 or (as_float.min() >= np.iinfo(np.int16).min and
+                                  as_float.max() <= np.iinfo(np.int16).max):
+            return values.astype(np.int16)
+        if (as_float.min() >= np.iinfo(np.int32).min and
+                as_float.max() <= np.iinfo(np.int32).max):
+            return values.astype(np.int32)
+        if pd.api.types.is_integer_dtype(values):
+            return values
+    if lossy or np.array_equal(as_float.astype(np.float32), as_float, equal_nan=True):
+        return values.astype(np.float32)
+    return values.astype(np.float64)
+
+
+# Funzione per convertire un DataFrame nello schema colonnare compatto dell'app
+# engine/quantiles: motore di regole (default: default_engine()) e soglie percentuali fisse
+def to_columnar(df, engine=None, quantiles=None):
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti nell'universo ESG: {', '.join(missing)}")
+
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if col in CATEGORICAL_COLUMNS:
+            columns[col] = series.astype('category')
+        elif col in ('greenwashing_flag', 'greenwashing_severity', 'greenwashing_rules'):
+            # Ricalcolati sotto dal motore di regole
+            continue
+        elif pd.api.types.is_numeric_dtype(series) or col in REQUIRED_COLUMNS:
+            columns[col] = _compact_numeric(series, lossy=col in FLOAT32_COLUMNS)
+        else:
+            columns[col] = series
+
+    data = pd.DataFrame(columns).reset_index(drop=True)
+    set_column_versions(data, {col: new_column_version() for col in data.columns})
+
+    # Flag di greenwashing valutati dal motore di regole su tutto l'universo
+    return (engine or default_engine()).apply(data, quantiles)
+
+
+# Funzione per leggere un file in base all'estensione
+# memory_map evita solo il buffer di lettura del file: to_pandas() copia comunque i dati
+# nel DataFrame (per un universo condiviso senza copie tra processi vedi snapshot.py)
+def read_table(path, memory_map=True):
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=memory_map)
+        return table.to_pandas()
+
+    if ext in ('.arrow', '.feather', '.ipc'):
+        import pyarrow.feather as feather
+        table = feather.read_table(path, memory_map=memory_map)
+        return table.to_pandas()
+
+    if ext in ('.csv', '.txt'):
+        # Le categorie vengono create direttamente in lettura, senza colonne object intermedie
+        return pd.read_csv(path, dtype={col: 'category' for col in CATEGORICAL_COLUMNS})
+
+    raise ValueError(f"Formato non supportato per l'universo ESG: {ext or path}")
+
+
+# Funzione per leggere un file a blocchi di righe, senza caricarlo tutto in memoria
+def iter_chunks(path, chunksize=100_000, columns=None):
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    elif ext in ('.arrow', '.feather', '.ipc'):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        with pa.memory_map(path) as source:
+            reader = ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for start in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(start, chunksize).to_pandas()
+
+    elif ext in ('.csv', '.txt'):
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns,
+                               dtype={col: 'category' for col in CATEGORICAL_COLUMNS})
+
+    else:
+        raise ValueError(f"Formato non supportato per l'universo ESG: {ext or path}")
+
+
+# Funzione per calcolare l'hash del contenuto di un file a blocchi
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Funzione per caricare l'universo ESG con cache di processo
+@timed('load_universe')
+def load_universe(path, memory_map=True, verify_hash=False):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry['stamp'] == stamp:
+            _cache_counts['hits'] += 1
+            return entry['data']
+        path_lock = _path_locks.setdefault(path, threading.Lock())
+
+    with path_lock:
+        # Un altro thread può aver caricato lo stesso file mentre si attendeva il lock
+        with _cache_lock:
+            entry = _cache.get(path)
+            if entry is not None and entry['stamp'] == stamp:
+                _cache_counts['hits'] += 1
+                return entry['data']
+            _cache_counts['misses'] += 1
+
+        digest = file_digest(path) if verify_hash else None
+        if entry is not None and digest is not None and entry['digest'] == digest:
+            # File "toccato" ma contenuto invariato: basta aggiornare il timbro
+            with _cache_lock:
+                entry['stamp'] = stamp
+            return entry['data']
+
+        data = to_columnar(read_table(path, memory_map=memory_map))
+        with _cache_lock:
+            _cache[path] = {'stamp': stamp, 'digest': digest, 'data': data}
+        return data
+
+
+# Funzione per svuotare la cache (tutta o per un singolo file)
+def clear_cache(path=None):
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(path), None)
+
+
+# Funzione per leggere i contatori della cache degli universi: (hit, miss, file in cache)
+def cache_info():
+    with _cache_lock:
+        return _cache_counts['hits'], _cache_counts['misses'], len(_cache)
@@ -0,0 +1,244 @@
+# Look-through dei fondi e ETF sugli emittenti sottostanti
+#
+# I pesi dei costituenti sono due matrici sparse: fondi x emittenti (W_I) e
+# fondi x fondi (W_F, per i fondi di fondi). Le metriche di un fondo sono la
+# media pesata dei costituenti: S = W_I @ X + W_F @ S, risolta propagando
+# lungo la gerarchia (la matrice W_F deve essere aciclica). I dati mancanti di
+# un emittente non contano: ogni metrica è divisa per la copertura (somma dei
+# pesi con dato disponibile). Quando cambiano i dati di alcuni emittenti si
+# aggiornano solo i fondi che li contengono, direttamente o tramite altri fondi,
+# e nell'universo solo le righe di quei fondi (vedi lookthrough_universe).
+
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from greeninvest.cache import UniverseCache
+from greeninvest.comparator import index_for
+from greeninvest.ingest import LiveUniverse
+from greeninvest.loader import read_table, to_columnar
+
+ISSUER_METRICS = ('co2_scope1', 'co2_scope2', 'co2_scope3', 'green_activities', 'esg_score')
+
+CO2_SCOPES = ('co2_scope1', 'co2_scope2', 'co2_scope3')
+
+# Colonne dell'universo sostituite dal look-through
+UNIVERSE_METRICS = ('co2_emissions', 'green_activities', 'esg_score')
+
+# Aggiornamenti degli emittenti ricordati per aggiornare l'universo in modo incrementale
+MAX_UPDATE_HISTORY = 64
+
+_engines = {}
+_engines_lock = threading.Lock()
+_universes = UniverseCache(maxsize=4, name='lookthrough')
+_universes_lock = threading.Lock()
+
+
+class LookThroughEngine:
+    # issuers: colonne issuer + ISSUER_METRICS
+    # constituents: colonne fund, holding, weight (holding è un emittente o un altro fondo)
+    def __init__(self, issuers, constituents):
+        self.issuers = pd.Index(issuers['issuer'])
+        if not self.issuers.is_unique:
+            raise ValueError("Gli emittenti devono essere univoci")
+        self._values = issuers.reindex(columns=list(ISSUER_METRICS)).to_numpy(dtype=np.float64)
+
+        fund_codes, funds = pd.factorize(constituents['fund'])
+        self.funds = pd.Index(funds)
+        holdings = constituents['holding'].to_numpy()
+        weights = constituents['weight'].to_numpy(dtype=np.float64)
+
+        fund_holding = self.funds.get_indexer(holdings)
+        issuer_holding = self.issuers.get_indexer(holdings)
+        is_fund = fund_holding >= 0
+        unknown = ~is_fund & (issuer_holding < 0)
+        if unknown.any():
+            raise ValueError(f"Costituenti sconosciuti: {', '.join(map(str, holdings[unknown][:10]))}")
+
+        n_funds, n_issuers = len(self.funds), len(self.issuers)
+        self.issuer_weights = sparse.csr_matrix(
+            (weights[~is_fund], (fund_codes[~is_fund], issuer_holding[~is_fund])),
+            shape=(n_funds, n_issuers)
+        )
+        self.fund_weights = sparse.csr_matrix(
+            (weights[is_fund], (fund_codes[is_fund], fund_holding[is_fund])),
+            shape=(n_funds, n_funds)
+        )
+        _check_acyclic(self.fund_weights)
+
+        # Copie per colonna: chi contiene l'emittente j / il fondo g
+        self._issuer_weights_csc = self.issuer_weights.tocsc()
+        self._fund_weights_csc = self.fund_weights.tocsc()
+
+        self._lock = threading.Lock()
+        self.last_updated = np.empty(0, dtype=np.int64)
+        # Incrementata ad ogni ricalcolo o aggiornamento degli emittenti
+        self.version = 0
+        # (versione, righe dei fondi aggiornati) degli ultimi aggiornamenti degli emittenti
+        self._updates = deque(maxlen=MAX_UPDATE_HISTORY)
+        self.recompute()
+
+    # Numeratori (valori x copertura) e copertura per emittente
+    def _issuer_terms(self, values):
+        has = ~np.isnan(values)
+        return np.where(has, values, 0.0), has.astype(np.float64)
+
+    # Ricalcolo completo di tutti i fondi
+    def recompute(self):
+        with self._lock:
+            self._recompute()
+
+    def _recompute(self):
+        weighted, has = self._issuer_terms(self._values)
+        direct = np.hstack([self.issuer_weights @ weighted, self.issuer_weights @ has])
+        total = direct.copy()
+        frontier = direct
+        # Ogni iterazione risale di un livello nella gerarchia dei fondi di fondi
+        while self.fund_weights.nnz:
+            frontier = self.fund_weights @ frontier
+            if not frontier.any():
+                break
+            total += frontier
+        self._totals = total
+        self.version += 1
+        self._updates.clear()
+
+    # Propaga una variazione su alcuni fondi ai fondi che li contengono
+    def _propagate(self, rows, delta):
+        touched = [rows]
+        while len(rows):
+            parents_matrix = self._fund_weights_csc[:, rows]
+            parents = np.unique(parents_matrix.indices)
+            if len(parents) == 0:
+                break
+            delta = parents_matrix[parents] @ delta
+            self._totals[parents] += delta
+            touched.append(parents)
+            rows = parents
+        return np.unique(np.concatenate(touched))
+
+    # Aggiorna i dati di alcuni emittenti (colonne issuer + metriche da cambiare)
+    def update_issuers(self, updates):
+        with self._lock:
+            pos = self.issuers.get_indexer(updates['issuer'])
+            if (pos < 0).any():
+                raise KeyError("Emittenti non presenti nel look-through")
+            old = self._values[pos]
+            new = old.copy()
+            for j, metric in enumerate(ISSUER_METRICS):
+                if metric in updates.columns:
+                    new[:, j] = updates[metric].to_numpy(dtype=np.float64)
+            self._values[pos] = new
+
+            old_weighted, old_has = self._issuer_terms(old)
+            new_weighted, new_has = self._issuer_terms(new)
+            delta = np.hstack([new_weighted - old_weighted, new_has - old_has])
+
+            # Solo i fondi che contengono direttamente gli emittenti modificati
+            holders_matrix = self._issuer_weights_csc[:, pos]
+            holders = np.unique(holders_matrix.indices)
+            if len(holders) == 0:
+                self.last_updated = holders
+                return holders
+            direct = holders_matrix[holders] @ delta
+            self._totals[holders] += direct
+            self.last_updated = self._propagate(holders, direct)
+            self.version += 1
+            self._updates.append((self.version, self.last_updated))
+            return self.last_updated
+
+    # Righe dei fondi aggiornate dopo `version`, o None se non si possono più ricostruire
+    # (ricalcolo completo o più di MAX_UPDATE_HISTORY aggiornamenti nel frattempo)
+    def changed_since(self, version):
+        with self._lock:
+            if version == self.version:
+                return np.empty(0, dtype=np.int64)
+            if not self._updates or self._updates[0][0] > version + 1:
+                return None
+            return np.unique(np.concatenate([rows for v, rows in self._updates if v > version]))
+
+    # Metriche look-through dei fondi (tutti o un sottoinsieme)
+    def fund_metrics(self, funds=None):
+        with self._lock:
+            rows = slice(None) if funds is None else self.funds.get_indexer(list(funds))
+            totals = self._totals[rows].copy()
+        m = len(ISSUER_METRICS)
+        sums, coverage = totals[:, :m], totals[:, m:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(coverage > 0, sums / coverage, np.nan)
+        metrics = pd.DataFrame(values, columns=list(ISSUER_METRICS))
+        metrics.insert(0, 'fund', np.asarray(self.funds[rows], dtype=object))
+        metrics['co2_emissions'] = metrics[list(CO2_SCOPES)].sum(axis=1, min_count=1)
+        metrics['coverage'] = coverage.max(axis=1)
+        return metrics
+
+    # Sostituisce nell'universo i valori dei fondi con quelli derivati dal look-through
+    def apply_to_universe(self, data):
+        metrics = self.fund_metrics()
+        positions = index_for(data).find(metrics['fund'])
+        found = positions >= 0
+        data = data.copy()
+        for col in UNIVERSE_METRICS:
+            values = metrics[col].to_numpy()[found]
+            valid = ~np.isnan(values)
+            column = data[col].to_numpy(dtype=np.float64)
+            column[positions[found][valid]] = values[valid]
+            data[col] = column
+        return to_columnar(data)
+
+
+# Funzione per verificare che i fondi di fondi non formino cicli
+def _check_acyclic(fund_weights):
+    if fund_weights.diagonal().any():
+        raise ValueError("Un fondo non può contenere se stesso")
+    n_components, _ = connected_components(fund_weights, directed=True, connection='strong')
+    if n_components < fund_weights.shape[0]:
+        raise ValueError("La gerarchia dei fondi di fondi contiene un ciclo")
+
+
+# Funzione per caricare (una volta per coppia di file) il motore di look-through
+def load_lookthrough(issuers_path, constituents_path):
+    paths = (os.path.abspath(issuers_path), os.path.abspath(constituents_path))
+    stamps = tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths)
+    with _engines_lock:
+        entry = _engines.get(paths)
+        if entry is None or entry[0] != stamps:
+            engine = LookThroughEngine(read_table(paths[0]), read_table(paths[1]))
+            entry = _engines[paths] = (stamps, engine)
+        return entry[1]
+
+
+# Record di upsert con i valori look-through dei fondi `rows` presenti nell'universo
+# (i valori mancanti non sostituiscono quelli dell'universo, come in apply_to_universe)
+def _fund_records(engine, rows, data):
+    metrics = engine.fund_metrics(engine.funds[rows])
+    metrics = metrics[index_for(data).find(metrics['fund']) >= 0]
+    for fund, *values in metrics[['fund', *UNIVERSE_METRICS]].itertuples(index=False):
+        yield {'product': fund, **{col: value for col, value in zip(UNIVERSE_METRICS, values)
+                                   if not np.isnan(value)}}
+
+
+# Funzione per ottenere l'universo con i valori dei fondi derivati dal look-through.
+# Dopo update_issuers la versione precedente viene aggiornata solo nelle righe dei fondi
+# cambiati: flag, indice prodotti e statistiche si aggiornano per differenza (LiveUniverse)
+def lookthrough_universe(data, engine):
+    key = ('lookthrough', id(engine))
+    with _universes_lock:
+        # La versione va letta prima dei valori: un aggiornamento concorrente verrà applicato dopo
+        version = engine.version
+        entry = _universes.peek(data, key)
+        if entry is not None and entry[0] == version:
+            return entry[1].data
+        rows = engine.changed_since(entry[0]) if entry is not None else None
+        if rows is None:
+            live = LiveUniverse(engine.apply_to_universe(data))
+        else:
+            live = entry[1]
+            live.ingest(_fund_records(engine, rows, live.data))
+        _universes.put(data, key, (version, live))
+        return live.data
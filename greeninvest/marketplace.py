@@ -0,0 +1,321 @@
+# Catalogo del marketplace: ricerca testuale, filtri numerici, risultati ordinati e paginati
+#
+# Indice invertito token -> {posizione: peso} su nome, partner e descrizione
+# dell'impatto (pesi diversi per campo). Le query combinano i token in AND;
+# l'ultimo token vale anche come prefisso (ricerca durante la digitazione),
+# tramite il vocabolario ordinato. Il punteggio di rilevanza è la somma di
+# idf x peso dei token trovati, accumulata con NumPy sulle liste di posizioni.
+# min_investment ed expected_return sono array numerici (expected_return in
+# punti percentuali, es. 2.5 per "2.5%") con un ordinamento per campo
+# aggiornato a ogni modifica: gli intervalli si risolvono con searchsorted e
+# l'ordinamento dei risultati per campo non richiede un sort.
+# Aggiunte e rimozioni sono incrementali: le posizioni liberate restano vuote
+# e vengono compattate quando superano metà del catalogo.
+
+import bisect
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+SORT_RELEVANCE = 'relevance'
+SORT_RETURN = 'expected_return'
+SORT_INVESTMENT = 'min_investment'
+
+# Peso dei campi testuali nella rilevanza
+FIELD_WEIGHTS = {'name': 3.0, 'partner': 2.0, 'impact': 1.0}
+
+NUMERIC_FIELDS = ('min_investment', 'expected_return')
+
+# Ricerca per prefisso: lunghezza minima e numero massimo di token espansi
+MIN_PREFIX = 2
+MAX_PREFIX_TOKENS = 256
+
+_TOKEN = re.compile(r'\w+')
+
+
+# Funzione per scomporre un testo in token normalizzati (minuscole, senza accenti)
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN.findall(text)
+
+
+# Funzione per convertire un rendimento ("2.5%", "2,5 %", 2.5) in punti percentuali
+def parse_return(value):
+    if isinstance(value, str):
+        value = value.strip().rstrip('%').strip().replace(',', '.')
+    return float(value)
+
+
+class Catalog:
+    def __init__(self, capacity=1024):
+        self.version = 0
+        self._lock = threading.RLock()
+        self._listings = []
+        self._slots = {}
+        self._postings = {}
+        self._arrays_cache = {}
+        self._vocabulary = []
+        self._arrays = {field: np.zeros(capacity) for field in NUMERIC_FIELDS}
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._partners = {}
+        self._partner_codes = np.full(capacity, -1, dtype=np.int32)
+        self._sorted = {}
+        self._dead = 0
+
+    @classmethod
+    def from_records(cls, records):
+        records = list(records)
+        catalog = cls(capacity=max(1024, len(records)))
+        for record in records:
+            catalog.add(record)
+        return catalog
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, listing_id):
+        return listing_id in self._slots
+
+    def get(self, listing_id):
+        return self._listings[self._slots[listing_id]]
+
+    @property
+    def partners(self):
+        return sorted(self._partners)
+
+    def _grow(self, size):
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for field, values in self._arrays.items():
+            self._arrays[field] = np.resize(values, capacity)
+        self._alive = np.resize(self._alive, capacity)
+        self._alive[len(self._listings):] = False
+        codes = np.full(capacity, -1, dtype=np.int32)
+        codes[:len(self._partner_codes)] = self._partner_codes
+        self._partner_codes = codes
+
+    def _tokens(self, listing):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(listing.get(field, '')):
+                weights[token] = weights.get(token, 0.0) + weight
+        return weights
+
+    # Aggiunge (o sostituisce, a parità di id) un'offerta; restituisce l'id
+    def add(self, listing):
+        listing = dict(listing)
+        listing['min_investment'] = float(listing['min_investment'])
+        listing['expected_return'] = parse_return(listing['expected_return'])
+        listing_id = listing.setdefault('id', f"{listing['partner']}/{listing['name']}")
+        with self._lock:
+            if listing_id in self._slots:
+                self._remove(listing_id)
+            slot = len(self._listings)
+            self._grow(slot + 1)
+            self._listings.append(listing)
+            self._slots[listing_id] = slot
+            for field in NUMERIC_FIELDS:
+                self._arrays[field][slot] = listing[field]
+            self._alive[slot] = True
+            code = self._partners.setdefault(listing['partner'], len(self._partners))
+            self._partner_codes[slot] = code
+            for token, weight in self._tokens(listing).items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    bisect.insort(self._vocabulary, token)
+                postings[slot] = weight
+                self._arrays_cache.pop(token, None)
+            self._sorted_insert(slot)
+            self._changed()
+        return listing_id
+
+    # Rimuove un'offerta (False se l'id non esiste)
+    def remove(self, listing_id):
+        with self._lock:
+            if listing_id not in self._slots:
+                return False
+            self._remove(listing_id)
+            self._changed()
+            if self._dead > max(1024, len(self._slots)):
+                self._compact()
+            return True
+
+    def _remove(self, listing_id):
+        slot = self._slots.pop(listing_id)
+        self._sorted_delete(slot)
+        for token in self._tokens(self._listings[slot]):
+            postings = self._postings[token]
+            postings.pop(slot, None)
+            self._arrays_cache.pop(token, None)
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+        self._listings[slot] = None
+        self._alive[slot] = False
+        self._dead += 1
+
+    # Ricostruisce il catalogo senza le posizioni vuote
+    def _compact(self):
+        listings = [listing for listing in self._listings if listing is not None]
+        fresh = Catalog.from_records(listings)
+        version = self.version
+        self.__dict__.update({k: v for k, v in fresh.__dict__.items() if k != '_lock'})
+        self.version = version
+
+    def _changed(self):
+        self.version += 1
+
+    # Aggiornamento incrementale degli ordinamenti già calcolati (inserimento/rimozione O(n) in memoria)
+    def _sorted_insert(self, slot):
+        for field, (values, slots) in self._sorted.items():
+            value = self._arrays[field][slot]
+            i = np.searchsorted(values, value, side='right')
+            self._sorted[field] = (np.insert(values, i, value), np.insert(slots, i, slot))
+
+    def _sorted_delete(self, slot):
+        for field, (values, slots) in self._sorted.items():
+            value = self._arrays[field][slot]
+            start = np.searchsorted(values, value, side='left')
+            stop = np.searchsorted(values, value, side='right')
+            i = start + np.flatnonzero(slots[start:stop] == slot)[0]
+            self._sorted[field] = (np.delete(values, i), np.delete(slots, i))
+
+    # Posizioni ordinate per valore di un campo numerico (calcolate alla prima ricerca)
+    def _order(self, field):
+        order = self._sorted.get(field)
+        if order is None:
+            slots = np.flatnonzero(self._alive[:len(self._listings)])
+            values = self._arrays[field][slots]
+            rank = np.argsort(values, kind='stable')
+            order = self._sorted[field] = (values[rank], slots[rank])
+        return order
+
+    # Posizioni con valore del campo in [low, high] (estremi None = illimitato), via searchsorted
+    def _in_range(self, field, low, high):
+        values, slots = self._order(field)
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        stop = len(values) if high is None else np.searchsorted(values, high, side='right')
+        in_range = np.zeros(len(self._listings), dtype=bool)
+        in_range[slots[start:stop]] = True
+        return in_range
+
+    # Token della query -> liste di posizioni/pesi (l'ultimo token anche come prefisso)
+    def _query_postings(self, tokens, prefix):
+        groups = []
+        for i, token in enumerate(tokens):
+            matches = [token] if token in self._postings else []
+            if prefix and i == len(tokens) - 1 and len(token) >= MIN_PREFIX:
+                start = bisect.bisect_left(self._vocabulary, token)
+                stop = bisect.bisect_left(self._vocabulary, token + '\uffff')
+                if stop - start <= MAX_PREFIX_TOKENS:
+                    matches = self._vocabulary[start:stop]
+            groups.append(matches)
+        return groups
+
+    # Lista di posizioni e pesi di un token come array (in cache fino alla modifica del token)
+    def _posting_arrays(self, token):
+        arrays = self._arrays_cache.get(token)
+        if arrays is None:
+            postings = self._postings[token]
+            arrays = self._arrays_cache[token] = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+            )
+        return arrays
+
+    def _text_scores(self, text, prefix):
+        tokens = list(dict.fromkeys(tokenize(text)))
+        size = len(self._listings)
+        scores = np.zeros(size)
+        matched = np.zeros(size, dtype=np.int16)
+        n = max(len(self._slots), 1)
+        for matches in self._query_postings(tokens, prefix):
+            hit = np.zeros(size, dtype=bool)
+            for token in matches:
+                slots, weights = self._posting_arrays(token)
+                scores[slots] += math.log(1 + n / len(slots)) * weights
+                hit[slots] = True
+            matched += hit
+        return scores, matched == len(tokens)
+
+    # Ricerca con filtri combinati; restituisce (offerte della pagina, totale risultati)
+    # max_investment: budget (min_investment <= budget); return_range: (min, max) in punti %
+    def search(self, text='', partners=None, max_investment=None, return_range=None,
+               sort=SORT_RELEVANCE, descending=None, page=1, page_size=10, prefix=True):
+        with self._lock:
+            size = len(self._listings)
+            mask = self._alive[:size].copy()
+
+            if max_investment is not None:
+                mask &= self._in_range('min_investment', None, max_investment)
+            if return_range is not None:
+                mask &= self._in_range('expected_return', *return_range)
+            if partners:
+                codes = [self._partners[p] for p in partners if p in self._partners]
+                mask &= np.isin(self._partner_codes[:size], codes)
+
+            scores = None
+            if text and text.strip():
+                scores, found = self._text_scores(text, prefix)
+                mask &= found
+
+            total = int(mask.sum())
+            stop = max(1, int(page)) * page_size
+            start = stop - page_size
+            if sort == SORT_RELEVANCE and scores is None:
+                sort = SORT_RETURN
+            if descending is None:
+                descending = sort != SORT_INVESTMENT
+
+            if sort == SORT_RELEVANCE:
+                candidates = np.flatnonzero(mask)
+                key = -scores[candidates]
+                if stop < len(candidates):
+                    top = np.argpartition(key, stop - 1)[:stop]
+                    candidates, key = candidates[top], key[top]
+                ranked = candidates[np.lexsort((candidates, key))]
+            else:
+                # Ordine già pronto per campo: basta scorrerlo filtrando
+                slots = self._order(sort)[1]
+                if descending:
+                    slots = slots[::-1]
+                ranked = slots[mask[slots]]
+            return [self._listings[slot] for slot in ranked[start:stop]], total
+
+
+# Funzione per leggere le offerte da CSV o JSON (lista o una per riga)
+def read_listings(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return pd.read_csv(path).to_dict('records')
+    with open(path, encoding='utf-8') as f:
+        if ext == '.json':
+            return json.load(f)
+        return [json.loads(line) for line in f if line.strip()]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+# Funzione per caricare il catalogo (una volta per versione del file)
+def load_catalog(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _catalogs_lock:
+        entry = _catalogs.get(path)
+        if entry is None or entry[0] != stamp:
+            entry = _catalogs[path] = (stamp, Catalog.from_records(read_listings(path)))
+        return entry[1]
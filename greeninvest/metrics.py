@@ -0,0 +1,216 @@
+# Strumentazione dei punti critici: tempi, istogrammi di latenza, contatori delle cache
+#
+# Attiva con GREENINVEST_METRICS=1 (letto all'import) oppure enable(). Quando è
+# disattivata @timed restituisce la funzione originale e timer() un contesto
+# vuoto condiviso: nessun costo misurabile sui percorsi caldi.
+# Gli istogrammi hanno intervalli fissi (come gli istogrammi Prometheus):
+# memoria costante e osservazione O(log intervalli). Oltre a quelli globali
+# del processo, timer() può aggiornare quelli di una sessione (un dict, es.
+# st.session_state); @timed usa da sé la sessione Streamlit dell'esecuzione in
+# corso, se c'è (anche nelle riesecuzioni dei frammenti). write_prometheus() scrive tutto in formato testo
+# Prometheus (es. per il textfile collector di node_exporter).
+
+import bisect
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+
+from greeninvest.cache import all_caches
+
+# Limiti superiori degli intervalli di latenza, in secondi
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get('GREENINVEST_METRICS') == '1'
+_histograms = {}
+_lock = threading.Lock()
+_last_write = [0.0]
+_NULL = contextlib.nullcontext()
+
+SESSION_KEY = '_greeninvest_metrics'
+
+
+def enabled():
+    return _enabled
+
+
+# Attiva/disattiva la raccolta (le funzioni già decorate con @timed restano come sono)
+def enable(flag=True):
+    global _enabled
+    _enabled = bool(flag)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Quantile stimato per interpolazione lineare nell'intervallo (come histogram_quantile)
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+def _observe(histograms, name, value):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.observe(value)
+
+
+# Registra una durata (in secondi) nell'istogramma globale e, se indicata, in quello della sessione
+def observe(name, seconds, session=None):
+    with _lock:
+        _observe(_histograms, name, seconds)
+        if session is not None:
+            _observe(session.setdefault(SESSION_KEY, {}), name, seconds)
+
+
+@contextlib.contextmanager
+def _timer(name, session):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, session)
+
+
+# Misura il blocco `with timer(name): ...`
+def timer(name, session=None):
+    if not _enabled:
+        return _NULL
+    return _timer(name, session)
+
+
+# Stato della sessione Streamlit che esegue il thread corrente (None fuori da un'esecuzione
+# dello script, es. thread di sfondo o riga di comando: Streamlit non viene mai importato qui)
+def _script_session():
+    if 'streamlit' not in sys.modules:
+        return None
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    import streamlit as st
+    return st.session_state
+
+
+# Decoratore: misura ogni chiamata della funzione (nessun wrapper se disattivata);
+# la durata va anche negli istogrammi della sessione Streamlit corrente
+def timed(name=None):
+    def decorate(fn):
+        if not _enabled:
+            return fn
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(label, time.perf_counter() - start, _script_session())
+        return wrapper
+    return decorate
+
+
+# Riepilogo degli istogrammi (globali o di una sessione): nome -> conteggio, media, p50, p95, max
+def summary(session=None):
+    with _lock:
+        histograms = _histograms if session is None else session.get(SESSION_KEY, {})
+        return {
+            name: {
+                'count': h.count, 'mean': h.sum / h.count if h.count else None,
+                'p50': h.quantile(0.5), 'p95': h.quantile(0.95), 'max': h.max,
+            }
+            for name, h in sorted(histograms.items())
+        }
+
+
+# Contatori delle cache: nome -> (hit, miss, voci, dimensione massima)
+def cache_stats():
+    from greeninvest.loader import cache_info
+    hits, misses, size = cache_info()
+    stats = {'universe_files': (hits, misses, size, None)}
+    for cache in all_caches():
+        stats[cache.name] = (cache.hits, cache.misses, len(cache), cache.maxsize)
+    return stats
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return 'Inf' if value == float('inf') else repr(float(value))
+
+
+# Testo in formato di esposizione Prometheus
+def prometheus_text():
+    lines = [
+        '# HELP greeninvest_latency_seconds Durata delle operazioni strumentate',
+        '# TYPE greeninvest_latency_seconds histogram',
+    ]
+    with _lock:
+        for name, h in sorted(_histograms.items()):
+            label = _label(name)
+            cumulative = 0
+            for bound, n in zip(h.buckets + (float('inf'),), h.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f'greeninvest_latency_seconds_bucket{{name="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'greeninvest_latency_seconds_sum{{name="{label}"}} {_number(h.sum)}')
+            lines.append(f'greeninvest_latency_seconds_count{{name="{label}"}} {h.count}')
+
+    stats = cache_stats()
+    for metric, position, help_text in (('hits', 0, 'Richieste servite dalla cache'),
+                                        ('misses', 1, 'Valori ricalcolati')):
+        lines.append(f'# HELP greeninvest_cache_{metric}_total {help_text}')
+        lines.append(f'# TYPE greeninvest_cache_{metric}_total counter')
+        for name, values in stats.items():
+            lines.append(f'greeninvest_cache_{metric}_total{{cache="{_label(name)}"}} {values[position]}')
+    lines.append('# HELP greeninvest_cache_entries Voci presenti in cache')
+    lines.append('# TYPE greeninvest_cache_entries gauge')
+    for name, values in stats.items():
+        lines.append(f'greeninvest_cache_entries{{cache="{_label(name)}"}} {values[2]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Scrive il file Prometheus (in modo atomico); con min_interval al più una volta ogni min_interval secondi
+def write_prometheus(path, min_interval=0.0):
+    now = time.monotonic()
+    with _lock:
+        if min_interval and now - _last_write[0] < min_interval:
+            return False
+        _last_write[0] = now
+    text = prometheus_text()
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
@@ -0,0 +1,250 @@
+# Ottimizzatore di portafoglio con vincoli ESG
+#
+# Massimizza lo score ESG medio ponderato del portafoglio con:
+#   - somma dei pesi = 1, 0 <= peso <= max_weight
+#   - emissioni CO₂ medie ponderate <= co2_budget
+#   - % attività green media ponderata >= min_green
+#   - peso nullo per i prodotti segnalati per greenwashing (se richiesto)
+# È un problema lineare, risolto con HiGHS (scipy.optimize.linprog) per
+# generazione di colonne: si parte da un insieme ridotto di prodotti (il
+# supporto della soluzione precedente, per i warm start, più i migliori per
+# ciascun criterio) e si aggiungono solo i prodotti con costo ridotto
+# favorevole, finché la soluzione è ottima sull'intero universo.
+# L'infattibilità si riconosce senza allargare l'insieme all'intero universo:
+# prima con i limiti raggiungibili di CO₂ e % green (riempimento greedy con il
+# peso massimo), poi, se l'insieme ridotto è infattibile, con una fase 1 che
+# minimizza la violazione dei vincoli, anch'essa per generazione di colonne.
+# I batch di vincoli (uno per cliente) sono distribuiti su un pool di processi.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import linprog
+
+from greeninvest.cache import UniverseCache
+from greeninvest.comparator import index_for
+
+# Prodotti migliori per criterio inclusi nell'insieme di partenza
+START_CANDIDATES = 64
+
+# Massimo numero di prodotti aggiunti per iterazione
+MAX_ADDED = 256
+
+_TOLERANCE = 1e-9
+
+DEFAULT_CONSTRAINTS = {
+    'co2_budget': None,
+    'min_green': None,
+    'max_weight': 0.2,
+    'exclude_greenwashing': True,
+}
+
+_arrays = UniverseCache(maxsize=4, name='optimizer')
+
+
+# Funzione per estrarre dall'universo le colonne usate dall'ottimizzatore
+def problem_arrays(data):
+    return _arrays.get(data, 'optimizer_arrays', lambda: _problem_arrays(data))
+
+
+def _problem_arrays(data):
+    index = index_for(data)
+    return {
+        'esg_score': index.esg_score.astype(np.float64),
+        'co2_emissions': index.co2_emissions.astype(np.float64),
+        'green_activities': index.green_activities.astype(np.float64),
+        'greenwashing_flag': data['greenwashing_flag'].to_numpy(dtype=bool),
+    }
+
+
+def _top(values, k, eligible):
+    candidates = np.flatnonzero(eligible)
+    if len(candidates) <= k:
+        return candidates
+    part = np.argpartition(-values[candidates], k - 1)[:k]
+    return candidates[part]
+
+
+# Valore minimo raggiungibile della media ponderata di `values` con pesi <= max_weight e
+# somma 1: si riempiono con il peso massimo i prodotti dal valore più basso
+def _min_average(values, eligible, max_weight):
+    values = values[eligible]
+    m = min(len(values), int(np.ceil(1 / max_weight - _TOLERANCE)))
+    lowest = np.sort(np.partition(values, m - 1)[:m]) if m < len(values) else np.sort(values)
+    weights = np.full(m, max_weight)
+    weights[-1] = 1 - max_weight * (m - 1)
+    return float(weights @ lowest)
+
+
+# Vincoli che nessun portafoglio può rispettare, anche considerati uno alla volta
+def _bounds_infeasible(arrays, eligible, constraints):
+    max_weight = constraints['max_weight']
+    if constraints['co2_budget'] is not None and \
+            _min_average(arrays['co2_emissions'], eligible, max_weight) > constraints['co2_budget'] + 1e-7:
+        return True
+    if constraints['min_green'] is not None and \
+            -_min_average(-arrays['green_activities'], eligible, max_weight) < constraints['min_green'] - 1e-7:
+        return True
+    return False
+
+
+# Risolve il problema ristretto ai prodotti in `working`.
+# phase_one: minimizza invece la violazione dei vincoli (una variabile di scarto per vincolo)
+def _solve_restricted(arrays, working, constraints, phase_one=False):
+    a_ub, b_ub = [], []
+    if constraints['co2_budget'] is not None:
+        a_ub.append(arrays['co2_emissions'][working])
+        b_ub.append(constraints['co2_budget'])
+    if constraints['min_green'] is not None:
+        a_ub.append(-arrays['green_activities'][working])
+        b_ub.append(-constraints['min_green'])
+    cost = -arrays['esg_score'][working]
+    a_eq = np.ones((1, len(working)))
+    bounds = (0, constraints['max_weight'])
+    if phase_one:
+        slack = len(a_ub)
+        cost = np.concatenate([np.zeros(len(working)), np.ones(slack)])
+        a_ub = [np.concatenate([row, -np.eye(slack)[i]]) for i, row in enumerate(a_ub)]
+        a_eq = np.concatenate([a_eq, np.zeros((1, slack))], axis=1)
+        bounds = [bounds] * len(working) + [(0, None)] * slack
+    return linprog(
+        cost,
+        A_ub=np.array(a_ub) if a_ub else None,
+        b_ub=np.array(b_ub) if b_ub else None,
+        A_eq=a_eq,
+        b_eq=np.array([1.0]),
+        bounds=bounds,
+        method='highs'
+    )
+
+
+# Costi ridotti di tutti i prodotti a partire dai moltiplicatori del problema ristretto
+# (in fase 1 i prodotti non hanno costo: conta solo la riduzione della violazione)
+def _reduced_costs(arrays, result, constraints, phase_one=False):
+    # Convenzione HiGHS: costo ridotto = c - A^T y, con y i moltiplicatori dei vincoli
+    reduced = (0 if phase_one else -arrays['esg_score']) - result.eqlin.marginals[0]
+    marginals = iter(result.ineqlin.marginals)
+    if constraints['co2_budget'] is not None:
+        reduced = reduced - next(marginals) * arrays['co2_emissions']
+    if constraints['min_green'] is not None:
+        reduced = reduced + next(marginals) * arrays['green_activities']
+    return reduced
+
+
+# Funzione per ottimizzare un singolo insieme di vincoli
+# warm_start: posizioni dei prodotti della soluzione precedente (opzionale)
+def optimize(arrays, constraints, warm_start=None):
+    constraints = {**DEFAULT_CONSTRAINTS, **constraints}
+    n = len(arrays['esg_score'])
+    eligible = np.isfinite(arrays['esg_score']) & np.isfinite(arrays['co2_emissions']) & \
+        np.isfinite(arrays['green_activities'])
+    if constraints['exclude_greenwashing']:
+        eligible &= ~arrays['greenwashing_flag']
+
+    result = {'client': constraints.get('client'), 'status': 'infeasible',
+              'positions': np.empty(0, dtype=np.int64), 'weights': np.empty(0),
+              'esg_score': np.nan, 'co2_emissions': np.nan, 'green_activities': np.nan,
+              'iterations': 0}
+    if eligible.sum() * constraints['max_weight'] < 1 - _TOLERANCE or \
+            _bounds_infeasible(arrays, eligible, constraints):
+        return result
+
+    # Insieme di partenza: soluzione precedente + migliori prodotti per ogni criterio
+    working = [
+        _top(arrays['esg_score'], START_CANDIDATES, eligible),
+        _top(-arrays['co2_emissions'], START_CANDIDATES, eligible),
+        _top(arrays['green_activities'], START_CANDIDATES, eligible),
+    ]
+    if warm_start is not None and len(warm_start):
+        # Le posizioni possono venire da una versione precedente dell'universo
+        warm_start = np.asarray(warm_start, dtype=np.int64)
+        warm_start = warm_start[(warm_start >= 0) & (warm_start < n)]
+        working.append(warm_start[eligible[warm_start]])
+    working = np.unique(np.concatenate(working))
+    # Abbastanza prodotti da arrivare a somma 1 con il peso massimo
+    needed = int(np.ceil(1 / constraints['max_weight'] - _TOLERANCE)) - len(working)
+    if needed > 0:
+        others = eligible.copy()
+        others[working] = False
+        working = np.concatenate([working, np.flatnonzero(others)[:needed]])
+    in_working = np.zeros(n, dtype=bool)
+    in_working[working] = True
+
+    # Fase 1 finché l'insieme ridotto è infattibile; feasible_size: dimensione dell'insieme
+    # che la fase 1 ha dichiarato fattibile (se la fase 2 lo smentisce, ci si ferma)
+    phase_one, feasible_size = False, None
+    while True:
+        result['iterations'] += 1
+        solution = _solve_restricted(arrays, working, constraints, phase_one)
+
+        if solution.status == 2 and not phase_one:
+            if feasible_size == len(working):
+                return result
+            phase_one = True
+            continue
+        if solution.status != 0:
+            result['status'] = 'error'
+            return result
+        if phase_one and solution.fun <= 1e-7:
+            phase_one, feasible_size = False, len(working)
+            continue
+
+        reduced = _reduced_costs(arrays, solution, constraints, phase_one)
+        improving = eligible & ~in_working & (reduced < -_TOLERANCE)
+        if not improving.any():
+            if phase_one:
+                # Nessun prodotto riduce la violazione: vincoli infattibili sull'intero universo
+                return result
+            break
+        extra = np.flatnonzero(improving)
+        if len(extra) > MAX_ADDED:
+            extra = extra[np.argpartition(reduced[extra], MAX_ADDED - 1)[:MAX_ADDED]]
+
+        working = np.concatenate([working, extra])
+        in_working[extra] = True
+
+    weights = solution.x
+    keep = weights > _TOLERANCE
+    positions, weights = working[keep], weights[keep]
+    order = np.argsort(-weights, kind='stable')
+    positions, weights = positions[order], weights[order]
+    result.update(
+        status='optimal',
+        positions=positions,
+        weights=weights,
+        esg_score=float(weights @ arrays['esg_score'][positions]),
+        co2_emissions=float(weights @ arrays['co2_emissions'][positions]),
+        green_activities=float(weights @ arrays['green_activities'][positions]),
+    )
+    return result
+
+
+_worker_arrays = None
+
+
+def _init_worker(arrays):
+    global _worker_arrays
+    _worker_arrays = arrays
+
+
+def _optimize_task(task):
+    constraints, warm_start = task
+    return optimize(_worker_arrays, constraints, warm_start)
+
+
+# Funzione per ottimizzare un batch di vincoli (uno per cliente) su più processi
+# warm_starts: dizionario cliente -> posizioni della soluzione precedente
+def optimize_batch(data, constraint_sets, warm_starts=None, max_workers=None):
+    arrays = problem_arrays(data)
+    warm_starts = warm_starts or {}
+    tasks = [(c, warm_starts.get(c.get('client'))) for c in constraint_sets]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        return [optimize(arrays, c, w) for c, w in tasks]
+
+    chunksize = max(1, len(tasks) // (max_workers * 4))
+    # Le colonne dell'universo vengono inviate una sola volta per processo
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(arrays,)) as pool:
+        return list(pool.map(_optimize_task, tasks, chunksize=chunksize))
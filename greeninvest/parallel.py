@@ -0,0 +1,17 @@
+# Esecuzione ordinata di lavori su un pool di processi (cli.score, reports, scenarios)
+#
+# Solo librerie standard: il modulo viene importato anche dalla riga di comando
+# prima di numpy/pandas.
+
+from collections import deque
+
+
+# Esegue fn sui blocchi nell'ordine originale, con al più `window` blocchi in volo
+def ordered_map(pool, fn, chunks, window):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(fn, chunk))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,166 @@
+# Portafogli dei clienti e metriche ESG aggregate
+#
+# Le posizioni sono una matrice sparsa clienti x prodotti (importi in euro).
+# Le metriche di tutti i portafogli si ottengono con un solo prodotto
+# matrice-matrice contro la tabella prodotti: W @ [esg, co2, green, flag].
+# Le somme per cliente sono tenute in memoria, quindi la modifica di una
+# singola posizione aggiorna solo la riga del cliente interessato.
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from greeninvest.cache import UniverseCache
+from greeninvest.comparator import index_for
+
+# co2_emissions è interpretato come tonnellate per milione di euro investito
+CO2_INVESTMENT_UNIT = 1_000_000
+
+# Colonne della matrice prodotti usata nel prodotto W @ P
+_ESG, _CO2, _GREEN, _FLAG = range(4)
+
+_books = UniverseCache(maxsize=8, name='portfolios')
+
+
+# Funzione per costruire la matrice prodotti x metriche
+def product_matrix(data):
+    index = index_for(data)
+    return np.column_stack([
+        index.esg_score,
+        index.co2_emissions,
+        index.green_activities,
+        data['greenwashing_flag'].to_numpy(dtype=np.float32),
+    ]).astype(np.float64)
+
+
+class PortfolioBook:
+    def __init__(self, data, clients, holdings):
+        # Si tiene solo l'indice prodotti, non il DataFrame (condiviso e in cache)
+        self._index = index_for(data)
+        self.clients = list(clients)
+        self._client_pos = {client: i for i, client in enumerate(self.clients)}
+        self._products = product_matrix(data)
+        self.holdings = sparse.csr_matrix(holdings, dtype=np.float64)
+        if self.holdings.shape != (len(self.clients), len(data)):
+            raise ValueError("La matrice delle posizioni deve essere clienti x prodotti")
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Record (cliente, prodotto, importo) esclusi perché il prodotto non è nell'universo
+        self.missing = []
+        self.recompute()
+
+    # Costruisce il book da record (cliente, prodotto, importo).
+    # skip_missing: le posizioni su prodotti assenti (es. cancellati da un feed) vengono
+    # escluse e riportate in book.missing invece di sollevare KeyError
+    @classmethod
+    def from_records(cls, data, records, skip_missing=False):
+        records = pd.DataFrame(records, columns=['client', 'product', 'amount'])
+        client_codes, clients = pd.factorize(records['client'])
+        index = index_for(data)
+        if skip_missing:
+            product_pos = index.find(records['product'])
+        else:
+            product_pos = index.positions(records['product'])
+        found = product_pos >= 0
+        amounts = records['amount'].to_numpy(dtype=np.float64)[found]
+        holdings = sparse.coo_matrix(
+            (amounts, (client_codes[found], product_pos[found])),
+            shape=(len(clients), len(data))
+        ).tocsr()  # le posizioni duplicate vengono sommate
+        book = cls(data, clients, holdings)
+        book.missing = list(records[~found].itertuples(index=False, name=None))
+        return book
+
+    # Ricalcola le somme di tutti i portafogli con un solo prodotto matriciale
+    def recompute(self):
+        with self._lock:
+            self._recompute()
+
+    def _recompute(self):
+        self._flush()
+        self._value = np.asarray(self.holdings.sum(axis=1)).ravel()
+        self._sums = self.holdings @ self._products
+
+    # Applica alla matrice sparsa le modifiche puntuali accumulate
+    def _flush(self):
+        if not self._pending:
+            return
+        rows, cols = (np.array(x) for x in zip(*self._pending))
+        amounts = np.fromiter(self._pending.values(), dtype=np.float64, count=len(self._pending))
+        current = np.asarray(self.holdings[rows, cols]).ravel()
+        # Somma di una matrice di differenze: O(nnz), senza conversioni a LIL/DOK
+        delta = sparse.csr_matrix((amounts - current, (rows, cols)), shape=self.holdings.shape)
+        self.holdings = (self.holdings + delta).tocsr()
+        self.holdings.eliminate_zeros()
+        self._pending = {}
+
+    @property
+    def matrix(self):
+        with self._lock:
+            self._flush()
+            return self.holdings
+
+    def _add_client(self, client):
+        self._client_pos[client] = len(self.clients)
+        self.clients.append(client)
+        self.holdings = sparse.vstack([self.holdings,
+                                       sparse.csr_matrix((1, self.holdings.shape[1]))]).tocsr()
+        self._value = np.append(self._value, 0.0)
+        self._sums = np.vstack([self._sums, np.zeros((1, self._sums.shape[1]))])
+
+    # Imposta l'importo di una posizione e aggiorna solo le metriche del cliente
+    def set_holding(self, client, product, amount):
+        with self._lock:
+            self._set_holding(client, product, amount)
+
+    def _set_holding(self, client, product, amount):
+        if client not in self._client_pos:
+            self._add_client(client)
+        row = self._client_pos[client]
+        col = self._index.position(product)
+
+        old = self._pending.get((row, col))
+        if old is None:
+            old = self.holdings[row, col]
+        delta = float(amount) - old
+        self._value[row] += delta
+        self._sums[row] += delta * self._products[col]
+        self._pending[(row, col)] = float(amount)
+
+    # Metriche ESG per cliente (tutti o un sottoinsieme)
+    def metrics(self, clients=None):
+        with self._lock:
+            return self._metrics(clients)
+
+    def _metrics(self, clients):
+        rows = slice(None) if clients is None else [self._client_pos[c] for c in clients]
+        value = self._value[rows].copy()
+        sums = self._sums[rows].copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weighted = np.where(value[:, None] > 0, sums / value[:, None], np.nan)
+        return pd.DataFrame({
+            'client': self.clients if clients is None else list(clients),
+            'value': value,
+            'esg_score': weighted[:, _ESG],
+            'co2_financed': sums[:, _CO2] / CO2_INVESTMENT_UNIT,
+            'green_share': weighted[:, _GREEN],
+            'greenwashing_exposure': weighted[:, _FLAG],
+        })
+
+
+# Funzione per leggere le posizioni da CSV (colonne client, product, amount)
+def read_holdings(path):
+    return pd.read_csv(path, usecols=['client', 'product', 'amount'],
+                       dtype={'client': 'category', 'product': 'category', 'amount': np.float64})
+
+
+# Funzione per caricare (una volta per file e universo) il book dei portafogli
+def load_portfolios(data, path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = ('portfolios', path, stat.st_mtime_ns, stat.st_size)
+    return _books.get(data, key, lambda: PortfolioBook.from_records(data, read_holdings(path),
+                                                                skip_missing=True))
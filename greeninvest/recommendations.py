@@ -0,0 +1,220 @@
+# Raccomandazioni di prodotti per fascia di profilo dell'investitore
+#
+# Una fascia è (tipo di profilo, esperienza, interesse ESG, fascia d'età): 96
+# combinazioni, ognuna con un vettore di pesi su quattro feature di prodotto
+# (ESG score, % attività green, emissioni CO₂ basse, flag di greenwashing).
+# Il punteggio di un prodotto dipende solo dalla sua riga (le emissioni sono
+# normalizzate su una scala logaritmica fissa, non sul massimo dell'universo),
+# quindi una modifica dell'universo tocca solo le classifiche in cui le righe
+# modificate entrano o da cui escono.
+# Le classifiche di tutte le fasce si calcolano in un solo passaggio a blocchi:
+# per ogni blocco un prodotto matrice (righe x feature) @ (feature x fasce) e
+# un argpartition per colonna. Ogni classifica tiene RANKING_SIZE prodotti (più
+# dei TOP_N mostrati) e la soglia `floor`: tutti i prodotti fuori classifica
+# hanno punteggio non superiore. A ogni lotto dei feed (vedi ingest) le
+# classifiche vengono riportate sulla nuova versione: quelle senza righe
+# modificate né candidati sopra la soglia restano invariate, le altre vengono
+# aggiornate con i soli candidati, oppure scartate e ricalcolate alla prima
+# richiesta se restano con meno di TOP_N prodotti certi.
+
+import itertools
+import threading
+
+import numpy as np
+
+from greeninvest.cache import UniverseCache
+
+PROFILE_TYPES = ("Investitore Privato", "Consulente Finanziario")
+EXPERIENCE_LEVELS = ("Principiante", "Intermedio", "Avanzato", "Esperto")
+ESG_INTEREST_LEVELS = ("Alto", "Medio", "Basso")
+# Fasce d'età: (età minima, etichetta)
+AGE_BANDS = ((18, "18-29"), (30, "30-44"), (45, "45-59"), (60, "60+"))
+
+# Pesi di (ESG score, attività green, emissioni basse) per interesse ESG
+ESG_INTEREST_WEIGHTS = {
+    "Alto": (0.35, 0.40, 0.25),
+    "Medio": (0.45, 0.30, 0.25),
+    "Basso": (0.60, 0.20, 0.20),
+}
+# Penalità dei prodotti segnalati per greenwashing (1 = in fondo alla classifica)
+EXPERIENCE_PENALTY = {"Principiante": 1.0, "Intermedio": 0.6, "Avanzato": 0.4, "Esperto": 0.3}
+# Peso spostato dalle emissioni basse alle attività green (transizione) per fascia d'età
+AGE_TILT = {"18-29": 0.10, "30-44": 0.05, "45-59": 0.0, "60+": -0.05}
+# I consulenti vedono anche i prodotti segnalati (con l'avviso del comparatore)
+ADVISOR_PENALTY_FACTOR = 0.5
+
+# Emissioni oltre cui la feature "emissioni basse" vale 0 (scala logaritmica)
+CO2_SCALE = 10_000.0
+
+TOP_N = 10
+RANKING_SIZE = 50
+BLOCK_SIZE = 1 << 14
+
+BUCKETS = tuple(itertools.product(PROFILE_TYPES, EXPERIENCE_LEVELS, ESG_INTEREST_LEVELS,
+                                  [label for _, label in AGE_BANDS]))
+
+_BATCH_KEY = ('recommendations', 'batch')
+
+_rankings = UniverseCache(maxsize=4 * (len(BUCKETS) + 1), name='recommendations')
+_batch_lock = threading.Lock()
+
+
+# Funzione per ricavare la fascia d'età
+def age_band(age):
+    label = AGE_BANDS[0][1]
+    for start, band in AGE_BANDS:
+        if age >= start:
+            label = band
+    return label
+
+
+# Funzione per ricavare la fascia di un profilo (valori del form di profilazione)
+def profile_bucket(profile_type, age, experience, esg_interest):
+    return (profile_type, experience, esg_interest, age_band(age))
+
+
+# Vettore dei pesi di una fascia: (ESG, green, emissioni basse, greenwashing)
+def bucket_weights(bucket):
+    profile_type, experience, esg_interest, band = bucket
+    esg, green, low_co2 = ESG_INTEREST_WEIGHTS[esg_interest]
+    tilt = AGE_TILT[band]
+    penalty = EXPERIENCE_PENALTY[experience]
+    if profile_type == "Consulente Finanziario":
+        penalty *= ADVISOR_PENALTY_FACTOR
+    return np.array([esg, green + tilt, low_co2 - tilt, -penalty], dtype=np.float32)
+
+
+_WEIGHTS = np.column_stack([bucket_weights(bucket) for bucket in BUCKETS])
+_BUCKET_COLUMN = {bucket: i for i, bucket in enumerate(BUCKETS)}
+
+
+# Funzione per costruire le feature (righe x 4) di una porzione dell'universo
+def features(frame):
+    co2 = np.clip(frame['co2_emissions'].to_numpy(dtype=np.float32), 0, CO2_SCALE)
+    return np.column_stack([
+        frame['esg_score'].to_numpy(dtype=np.float32) / 100,
+        frame['green_activities'].to_numpy(dtype=np.float32) / 100,
+        1 - np.log1p(co2) / np.log1p(CO2_SCALE),
+        frame['greenwashing_flag'].to_numpy(dtype=np.float32),
+    ])
+
+
+class Ranking:
+    def __init__(self, products, scores, floor):
+        # Prodotti in ordine di punteggio decrescente (a parità, in ordine di nome)
+        self.products = products
+        self.scores = scores
+        # Ogni prodotto fuori classifica ha punteggio <= floor
+        self.floor = floor
+
+    def __len__(self):
+        return len(self.products)
+
+    def top(self, n=TOP_N):
+        return list(self.products[:n])
+
+
+def _ranked(products, scores, size):
+    order = np.lexsort((products, -scores))[:size]
+    return products[order], scores[order]
+
+
+# Classifiche di più fasce (colonne di `weights`) in un solo passaggio a blocchi
+def _compute(data, weights, size=RANKING_SIZE):
+    n, columns = len(data), weights.shape[1]
+    best_scores = np.empty((0, columns), dtype=np.float32)
+    best_rows = np.empty((0, columns), dtype=np.int64)
+    for start in range(0, n, BLOCK_SIZE):
+        scores = features(data.iloc[start:start + BLOCK_SIZE]) @ weights
+        rows = np.broadcast_to(np.arange(start, start + len(scores))[:, None], scores.shape)
+        scores = np.concatenate([best_scores, scores])
+        rows = np.concatenate([best_rows, rows])
+        if len(scores) > size:
+            keep = np.argpartition(-scores, size - 1, axis=0)[:size]
+            scores = np.take_along_axis(scores, keep, axis=0)
+            rows = np.take_along_axis(rows, keep, axis=0)
+        best_scores, best_rows = scores, rows
+
+    products = data['product'].to_numpy(dtype=object)
+    rankings = []
+    for column in range(columns):
+        ranked = _ranked(products[best_rows[:, column]], best_scores[:, column], size)
+        # Con meno righe che posti la classifica contiene tutto l'universo
+        floor = ranked[1][-1] if n > size else -np.inf
+        rankings.append(Ranking(*ranked, floor))
+    return rankings
+
+
+# Calcola in batch le classifiche di tutte le fasce e le mette in cache
+def precompute(data):
+    rankings = _compute(data, _WEIGHTS)
+    for bucket, ranking in zip(BUCKETS, rankings):
+        _rankings.put(data, ('recommendations', bucket), ranking)
+    _rankings.put(data, _BATCH_KEY, True)
+    return dict(zip(BUCKETS, rankings))
+
+
+# Calcola in batch le classifiche dell'universo se non lo sono già (una sola volta anche
+# con più richieste concorrenti)
+def _ensure_batch(data):
+    with _batch_lock:
+        if _rankings.peek(data, _BATCH_KEY) is None:
+            precompute(data)
+
+
+# Precalcola in sfondo le classifiche dell'universo (es. all'apertura della profilazione);
+# le richieste arrivate nel frattempo attendono il calcolo in corso
+def warm_up(data):
+    if _rankings.peek(data, _BATCH_KEY) is None:
+        threading.Thread(target=_ensure_batch, args=(data,), name='recommendations', daemon=True).start()
+
+
+def _build(data, bucket):
+    _ensure_batch(data)
+    # Dopo un'espulsione dalla cache si ricalcola solo la fascia mancante
+    ranking = _rankings.peek(data, ('recommendations', bucket))
+    if ranking is None:
+        ranking = _compute(data, _WEIGHTS[:, [_BUCKET_COLUMN[bucket]]])[0]
+    return ranking
+
+
+# Funzione per ottenere i primi n prodotti consigliati per una fascia
+def recommend(data, bucket, n=TOP_N):
+    ranking = _rankings.get(data, ('recommendations', bucket), lambda: _build(data, bucket))
+    return ranking.top(n)
+
+
+# Riporta le classifiche in cache sulla nuova versione dell'universo (vedi LiveUniverse):
+# `rows` sono le righe aggiornate o aggiunte (valori nuovi, flag di greenwashing compresi),
+# `removed` i nomi dei prodotti aggiornati o cancellati. Restituisce le fasce riportate.
+def carry_rankings(old, new, rows, removed):
+    cached = [(bucket, _rankings.peek(old, ('recommendations', bucket))) for bucket in BUCKETS]
+    cached = [(bucket, ranking) for bucket, ranking in cached if ranking is not None]
+    if not cached:
+        return 0
+
+    candidates = rows['product'].to_numpy(dtype=object)
+    scores = features(rows) @ _WEIGHTS[:, [_BUCKET_COLUMN[bucket] for bucket, _ in cached]]
+    removed = np.asarray(list(removed), dtype=object)
+
+    carried = 0
+    for column, (bucket, ranking) in enumerate(cached):
+        stale = np.isin(ranking.products, removed)
+        entering = scores[:, column] >= ranking.floor
+        if not stale.any() and not entering.any():
+            ranking_new = ranking
+        else:
+            products = np.concatenate([ranking.products[~stale], candidates[entering]])
+            values = np.concatenate([ranking.scores[~stale], scores[entering, column]])
+            products, values = _ranked(products, values, RANKING_SIZE)
+            floor = ranking.floor
+            if len(products) == RANKING_SIZE:
+                floor = max(floor, values[-1])
+            if len(products) < TOP_N and len(new) > len(products):
+                # Troppi prodotti usciti: la fascia viene ricalcolata alla prossima richiesta
+                continue
+            ranking_new = Ranking(products, values, floor)
+        _rankings.put(new, ('recommendations', bucket), ranking_new)
+        carried += 1
+    _rankings.put(new, _BATCH_KEY, True)
+    return carried
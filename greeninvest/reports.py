@@ -0,0 +1,456 @@
+# Report esportabili (CSV, XLSX, PDF) di confronti tra prodotti e portafogli clienti
+#
+# Un report è un dizionario semplice: nome del file, titolo, note e tabelle
+# (intestazione, colonne, righe di valori Python). I report vengono preparati
+# nel processo principale a partire da universo e book dei portafogli (lookup
+# vettoriali, nessun rendering) e resi nei formati richiesti da un pool di
+# processi, a lotti di BATCH_SIZE report con al più 2 lotti in volo per
+# processo. I file prodotti vengono scritti subito nell'archivio zip (anche su
+# uno stream non posizionabile) e poi scartati: la memoria usata dipende dai
+# lotti in volo, non dal numero di report.
+# XLSX e PDF sono scritti direttamente (SpreadsheetML minimale con stringhe
+# inline; PDF con il font standard Helvetica e contenuti compressi), senza
+# dipendenze aggiuntive: circa un millisecondo per documento.
+
+import csv
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from greeninvest.comparator import CATEGORIES, best_choice, comparison_frame, comparison_verdict, index_for
+from greeninvest.parallel import ordered_map
+from greeninvest.rules import default_engine
+
+FORMATS = ('csv', 'xlsx', 'pdf')
+
+# Report per lotto inviato a un processo del pool
+BATCH_SIZE = 50
+
+_UNSAFE_NAME = re.compile(r'[^\w.-]+')
+
+# Caratteri di controllo non ammessi in XML 1.0 (renderebbero il file illeggibile)
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+# Funzione per ricavare un nome di file sicuro
+def file_name(text):
+    return _UNSAFE_NAME.sub('_', str(text)).strip('_')[:80] or 'report'
+
+
+def _greenwashing_notes(engine, codes):
+    messages = []
+    for code in codes:
+        for message in engine.messages(code):
+            if message not in messages:
+                messages.append(message)
+    return messages
+
+
+# Report di confronto per ogni gruppo di prodotti (un gruppo di un solo prodotto è una scheda prodotto)
+def comparison_reports(data, groups):
+    engine = default_engine()
+    rules = data['greenwashing_rules'].to_numpy()
+    for number, products in enumerate(groups, start=1):
+        products = list(products)
+        frame = comparison_frame(data, products)
+        codes = rules[index_for(data).positions(products)]
+        notes = []
+        if len(products) == 2:
+            first, second = frame.iloc[0], frame.iloc[1]
+            winner, margin = comparison_verdict(first['esg_score'], first['greenwashing_flag'],
+                                                second['esg_score'], second['greenwashing_flag'])
+            if winner is not None:
+                better, worse = (products[0], products[1]) if winner == 0 else (products[1], products[0])
+                notes.append(f"{better} è più sostenibile di {worse} (+{margin:g} punti ESG).")
+            else:
+                notes.append(f"La comparazione tra {products[0]} e {products[1]} richiede "
+                             f"un'analisi più dettagliata.")
+        elif len(products) > 2:
+            best = best_choice(frame)
+            if best is not None:
+                notes.append(f"Miglior punteggio complessivo senza segnali di greenwashing: {best['product']} "
+                             f"({best['Punteggio complessivo']:.0%}).")
+            else:
+                notes.append("Tutti i prodotti presentano segnali di greenwashing.")
+        notes += [f"Greenwashing: {message}" for message in _greenwashing_notes(engine, codes[codes != 0])]
+
+        values = [
+            (row.product, _rounded(row.esg_score, 1), _rounded(row.co2_emissions, 4),
+             _rounded(row.green_activities, 2), "Sì" if row.greenwashing_flag else "No")
+            for row in frame.itertuples(index=False)
+        ]
+        normalized = [
+            (product, *(round(float(v), 4) for v in scores))
+            for product, scores in zip(frame['product'],
+                                       frame[CATEGORIES + ['Punteggio complessivo']].to_numpy())
+        ]
+        title = products[0] if len(products) == 1 else f"Confronto tra {len(products)} prodotti"
+        label = ' vs '.join(products) if len(products) <= 3 else title
+        yield {
+            'name': f"confronti/{number:05d}_{file_name(label)}",
+            'title': title,
+            'notes': notes,
+            'tables': [
+                ("Valori ESG", ["Prodotto", "ESG Score", "Emissioni CO₂ (t)", "Attività green (%)",
+                                "Greenwashing"], values),
+                ("Valori normalizzati (0-1)", ["Prodotto", *CATEGORIES, "Punteggio complessivo"], normalized),
+            ],
+        }
+
+
+# Report di ogni cliente del book (o di quelli indicati): sintesi e posizioni
+def portfolio_reports(data, book, clients=None):
+    engine = default_engine()
+    metrics = book.metrics(clients)
+    holdings = book.matrix
+    rows_of = {client: i for i, client in enumerate(book.clients)}
+    products = data['product']
+    esg = data['esg_score'].to_numpy()
+    co2 = data['co2_emissions'].to_numpy()
+    green = data['green_activities'].to_numpy()
+    flags = data['greenwashing_flag'].to_numpy()
+    rules = data['greenwashing_rules'].to_numpy()
+
+    for number, m in enumerate(metrics.itertuples(index=False), start=1):
+        row = rows_of[m.client]
+        start, stop = holdings.indptr[row], holdings.indptr[row + 1]
+        cols, amounts = holdings.indices[start:stop], holdings.data[start:stop]
+        order = np.argsort(-amounts, kind='stable')
+        cols, amounts = cols[order], amounts[order]
+        names = np.asarray(products.iloc[cols], dtype=object)
+        weights = amounts / m.value if m.value > 0 else np.zeros(len(amounts))
+
+        positions = [
+            (name, float(amount), round(float(weight) * 100, 2), _rounded(esg[col], 1), _rounded(co2[col], 4),
+             _rounded(green[col], 2), "Sì" if flags[col] else "No")
+            for name, amount, weight, col in zip(names, amounts, weights, cols)
+        ]
+        summary = [
+            ("Valore del portafoglio (€)", round(float(m.value), 2)),
+            ("ESG Score medio ponderato", _rounded(m.esg_score, 1)),
+            ("CO₂ finanziata (t)", _rounded(m.co2_financed, 4)),
+            ("Attività green medie (%)", _rounded(m.green_share, 1)),
+            ("Esposizione al greenwashing (%)", _rounded(m.greenwashing_exposure * 100, 1)),
+        ]
+        notes = []
+        flagged = cols[flags[cols]]
+        if len(flagged):
+            positions_text = "posizione" if len(flagged) == 1 else "posizioni"
+            notes.append(f"{len(flagged)} {positions_text} in prodotti con segnali di greenwashing.")
+            notes += [f"Greenwashing: {message}" for message in _greenwashing_notes(engine, rules[flagged])]
+        yield {
+            'name': f"portafogli/{number:05d}_{file_name(m.client)}",
+            'title': f"Report ESG del portafoglio - {m.client}",
+            'notes': notes,
+            'tables': [
+                ("Sintesi", ["Indicatore", "Valore"], summary),
+                ("Posizioni", ["Prodotto", "Importo (€)", "Peso (%)", "ESG Score", "Emissioni CO₂ (t)",
+                               "Attività green (%)", "Greenwashing"], positions),
+            ],
+        }
+
+
+def _rounded(value, digits):
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+
+def render_csv(report):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([report['title']])
+    for note in report['notes']:
+        writer.writerow([note])
+    for heading, columns, rows in report['tables']:
+        writer.writerow([])
+        writer.writerow([heading])
+        writer.writerow(columns)
+        writer.writerows(rows)
+    # BOM: Excel riconosce così la codifica UTF-8
+    return ('\ufeff' + out.getvalue()).encode('utf-8')
+
+
+def _column_letter(i):
+    letters = ''
+    i += 1
+    while i:
+        i, rest = divmod(i - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _xlsx_cell(ref, value):
+    if value is None:
+        return ''
+    if isinstance(value, (bool, np.bool_)):
+        value = "Sì" if value else "No"
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        # float(): repr di uno scalare numpy sarebbe "np.float64(1.5)"
+        return f'<c r="{ref}"><v>{float(value)!r}</v></c>' if np.isfinite(value) else ''
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    # xml:space: Excel altrimenti toglie gli spazi iniziali e finali
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_sheet(rows):
+    lines = []
+    for r, row in enumerate(rows, start=1):
+        cells = ''.join(_xlsx_cell(f'{_column_letter(c)}{r}', value) for c, value in enumerate(row))
+        lines.append(f'<row r="{r}">{cells}</row>')
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            f'<sheetData>{"".join(lines)}</sheetData></worksheet>')
+
+
+# Nome di foglio valido e univoco: Excel confronta i nomi senza distinguere le maiuscole
+# e non ammette un apostrofo iniziale o finale
+def _sheet_name(text, used):
+    name = _XML_ILLEGAL.sub('', re.sub(r'[\[\]:*?/\\]', ' ', str(text)))[:31].strip("'") or 'Foglio'
+    base, n = name, 2
+    while name.casefold() in used:
+        suffix = f' ({n})'
+        name, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(name.casefold())
+    return name
+
+
+def render_xlsx(report):
+    sheets = [("Riepilogo", [[report['title']], *([note] for note in report['notes'])])]
+    sheets += [(heading, [columns, *rows]) for heading, columns, rows in report['tables']]
+    used = set()
+    names = [_sheet_name(name, used) for name, _ in sheets]
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for i in range(1, len(sheets) + 1))
+            + '</Types>'))
+        archive.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="xl/workbook.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'))
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + ''.join(f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+                      for i, name in enumerate(names, start=1))
+            + '</sheets></workbook>'))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" '
+                      'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                      for i in range(1, len(sheets) + 1))
+            + '</Relationships>'))
+        for i, (_, rows) in enumerate(sheets, start=1):
+            archive.writestr(f'xl/worksheets/sheet{i}.xml', _xlsx_sheet(rows))
+    return out.getvalue()
+
+
+# Pagina A4 in punti, margini e corpo del testo
+PDF_PAGE = (595, 842)
+PDF_MARGIN = 48
+PDF_FONT_SIZE = 8
+PDF_LEADING = 11
+
+# Caratteri non presenti nella codifica WinAnsi dei font standard
+_PDF_TEXT = str.maketrans({'₂': '2', '–': '-', '—': '-'})
+
+
+def _pdf_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:,.2f}'
+    return str(value)
+
+
+def _pdf_string(text):
+    raw = text.translate(_PDF_TEXT).encode('cp1252', errors='replace')
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _wrap(text, width):
+    lines, line = [], ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    return lines + [line] if line else lines
+
+
+# Larghezza media di un carattere Helvetica: circa metà del corpo
+def _chars(width, size):
+    return max(1, int(width / (size * 0.5)))
+
+
+class _PdfPages:
+    def __init__(self):
+        self.width, self.height = PDF_PAGE
+        self.pages = []
+        self.ops = []
+        self.y = self.height - PDF_MARGIN
+
+    # Avanza di una riga (nuova pagina se non c'è spazio)
+    def advance(self, step):
+        if self.y - step < PDF_MARGIN:
+            self.close()
+        self.y -= step
+
+    def text(self, x, size, font, content):
+        self.ops.append(b'BT /%s %d Tf %.1f %.1f Td %s Tj ET' % (font, size, x, self.y, _pdf_string(content)))
+
+    def rule(self):
+        y = self.y - 3
+        self.ops.append(b'%.1f %.1f m %.1f %.1f l S' % (PDF_MARGIN, y, self.width - PDF_MARGIN, y))
+
+    def close(self):
+        if self.ops:
+            self.pages.append(b'\n'.join(self.ops))
+        self.ops, self.y = [], self.height - PDF_MARGIN
+
+
+def render_pdf(report):
+    doc = _PdfPages()
+    usable = doc.width - 2 * PDF_MARGIN
+
+    def paragraph(content, size, font, step):
+        for line in _wrap(content, _chars(usable, size)):
+            doc.advance(step)
+            doc.text(PDF_MARGIN, size, font, line)
+
+    def row(cells, widths, font):
+        doc.advance(PDF_LEADING)
+        x = PDF_MARGIN
+        for cell, cell_width in zip(cells, widths):
+            limit = _chars(cell_width, PDF_FONT_SIZE) - 1
+            if len(cell) > limit:
+                cell = cell[:max(1, limit - 1)] + '.'
+            doc.text(x, PDF_FONT_SIZE, font, cell)
+            x += cell_width
+
+    paragraph(report['title'], 14, b'F2', 20)
+    for note in report['notes']:
+        paragraph(note, PDF_FONT_SIZE, b'F1', PDF_LEADING)
+    for heading, columns, rows in report['tables']:
+        doc.advance(6)
+        paragraph(heading, 10, b'F2', 14)
+        header = [str(c) for c in columns]
+        cells = [[_pdf_text(v) for v in r] for r in rows]
+        # Colonne proporzionali al testo più lungo (intestazione compresa), ridotte alla pagina
+        longest = [max([len(header[i])] + [len(r[i]) for r in cells]) + 2 for i in range(len(header))]
+        scale = min(1.0, _chars(usable, PDF_FONT_SIZE) / sum(longest))
+        widths = [n * scale * PDF_FONT_SIZE * 0.5 for n in longest]
+        row(header, widths, b'F2')
+        doc.rule()
+        for r in cells:
+            row(r, widths, b'F1')
+    doc.close()
+    width, height, pages = doc.width, doc.height, doc.pages
+
+    # Oggetti: 1 catalogo, 2 albero delle pagine, 3-4 font, poi (pagina, contenuto) per pagina
+    objects = [None, None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>']
+    kids = []
+    for content in pages:
+        stream = zlib.compress(content)
+        page_id, content_id = len(objects) + 1, len(objects) + 2
+        kids.append(page_id)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                       % (width, height, content_id))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (i, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+RENDERERS = {'csv': render_csv, 'xlsx': render_xlsx, 'pdf': render_pdf}
+
+
+# Rende un lotto di report nei formati richiesti: lista di (nome del file, contenuto)
+def render_batch(reports, formats):
+    return [(f"{report['name']}.{fmt}", RENDERERS[fmt](report)) for report in reports for fmt in formats]
+
+
+def _batches(reports, size):
+    batch = []
+    for report in reports:
+        batch.append(report)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Genera i report e li scrive in un archivio zip (percorso o stream binario, anche non posizionabile).
+# progress(fatti, totale) viene chiamata dopo ogni lotto; restituisce il numero di report
+def export_zip(reports, out, formats=FORMATS, workers=None, total=None, progress=None,
+               batch_size=BATCH_SIZE):
+    unknown = [fmt for fmt in formats if fmt not in RENDERERS]
+    if unknown:
+        raise ValueError(f"Formati non supportati: {', '.join(unknown)}")
+    workers = workers or os.cpu_count() or 1
+    batches = _batches(reports, batch_size)
+    done = 0
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        def write(files):
+            nonlocal done
+            for name, content in files:
+                archive.writestr(name, content)
+            done += len(files) // max(1, len(formats))
+            if progress is not None:
+                progress(done, total)
+
+        if workers == 1:
+            for batch in batches:
+                write(render_batch(batch, formats))
+        else:
+            # spawn: i processi non ereditano i thread del chiamante (es. il server Streamlit)
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                jobs = ((batch, formats) for batch in batches)
+                for files in ordered_map(pool, _render_job, jobs, 2 * workers):
+                    write(files)
+    return done
+
+
+def _render_job(job):
+    return render_batch(*job)
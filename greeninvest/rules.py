@@ -0,0 +1,304 @@
+# Motore di regole per il rilevamento del greenwashing
+#
+# Ogni regola è una lista di condizioni in AND, valutate come maschere booleane
+# NumPy sull'intero universo in un solo passaggio. Una condizione è una terna
+# (espressione, operatore, valore):
+#   - espressione: nome di colonna oppure rapporto "colonna_a/colonna_b"
+#   - operatore: >, >=, <, <=, ==, != su soglia assoluta, oppure con prefisso
+#     "pct" (es. "pct>=") dove il valore è un quantile in [0, 1] della colonna
+# Esempio: "ESG score nel decile più alto ma CO₂ nel quartile peggiore"
+#   [("esg_score", "pct>=", 0.9), ("co2_emissions", "pct>=", 0.75)]
+#
+# Le regole di default riproducono il flag storico; altre regole (es. sui
+# quantili) si attivano con un file JSON indicato da GREENINVEST_RULES.
+#
+# Le maschere si riusano tra una valutazione e l'altra solo per i DataFrame con
+# versioni delle colonne (vedi set_column_versions): chi scrive una colonna le
+# assegna una nuova versione, quindi non serve rileggerne il contenuto.
+
+import itertools
+import json
+import os
+import threading
+import weakref
+
+import numpy as np
+
+from greeninvest.metrics import timed
+
+# Soglie storiche del flag di greenwashing (ESG score > 80 ma % attività green < 30%)
+GREENWASHING_MIN_SCORE = 80
+GREENWASHING_MAX_GREEN = 30
+
+# Le regole colpite da ogni prodotto sono salvate in una bitmap uint64
+MAX_RULES = 64
+
+_OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+DEFAULT_RULES = [
+    {
+        'name': 'score_alto_green_basso',
+        'conditions': [
+            ('esg_score', '>', GREENWASHING_MIN_SCORE),
+            ('green_activities', '<', GREENWASHING_MAX_GREEN),
+        ],
+        'severity': 1.0,
+        'message': (f"Alto ESG score (oltre {GREENWASHING_MIN_SCORE}) ma bassa percentuale "
+                    f"di attività green (sotto il {GREENWASHING_MAX_GREEN}%)."),
+    },
+]
+
+
+# Chiave di DataFrame.attrs con le versioni delle colonne
+_VERSIONS_ATTR = 'greeninvest_column_versions'
+
+_versions = itertools.count(1)
+_versions_lock = threading.Lock()
+
+
+# Funzione per ottenere una versione di colonna mai usata prima nel processo
+def new_column_version():
+    with _versions_lock:
+        return next(_versions)
+
+
+# Versioni delle colonne legate a un solo DataFrame (riferimento debole): pandas copia gli
+# attrs nelle copie, che però non le ereditano; una copia serializzata le perde del tutto
+class _ColumnVersions:
+    def __init__(self, data, versions):
+        self._owner = weakref.ref(data) if data is not None else None
+        self.versions = versions
+
+    def owned_by(self, data):
+        return self._owner is not None and self._owner() is data
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _ColumnVersions, (None, {})
+
+
+# Funzione per registrare le versioni delle colonne di un DataFrame (nome -> versione).
+# Una colonna cambia versione quando cambia il suo contenuto o l'insieme delle righe.
+# Le versioni valgono solo per questo oggetto: le copie e le loro modifiche non le ereditano
+def set_column_versions(data, versions):
+    data.attrs[_VERSIONS_ATTR] = _ColumnVersions(data, dict(versions))
+    return data
+
+
+# Funzione per leggere le versioni delle colonne di un DataFrame ({} se non registrate)
+def column_versions(data):
+    entry = getattr(data, 'attrs', {}).get(_VERSIONS_ATTR)
+    if entry is None or not entry.owned_by(data):
+        return {}
+    return entry.versions
+
+
+class Rule:
+    def __init__(self, name, conditions, severity=1.0, message=None):
+        if not conditions:
+            raise ValueError(f"La regola '{name}' non ha condizioni")
+        self.name = name
+        self.severity = float(severity)
+        self.conditions = []
+        for expr, op, value in conditions:
+            percentile = op.startswith('pct')
+            base_op = op[3:] if percentile else op
+            if base_op not in _OPERATORS:
+                raise ValueError(f"Operatore non valido nella regola '{name}': {op}")
+            if percentile and not 0 <= value <= 1:
+                raise ValueError(f"Quantile non valido nella regola '{name}': {value}")
+            self.conditions.append((tuple(expr.split('/')), base_op, percentile, value))
+        self.message = message or self.describe()
+
+    # Colonne lette dalla regola
+    @property
+    def inputs(self):
+        return sorted({col for expr, _, _, _ in self.conditions for col in expr})
+
+    # Condizioni relative ai quantili dell'universo
+    @property
+    def has_percentiles(self):
+        return any(percentile for _, _, percentile, _ in self.conditions)
+
+    # Descrizione testuale generata dalle condizioni
+    def describe(self):
+        parts = []
+        for expr, op, percentile, value in self.conditions:
+            label = '/'.join(expr)
+            if percentile:
+                parts.append(f"{label} {op} quantile {value:g}")
+            else:
+                parts.append(f"{label} {op} {value:g}")
+        return ' e '.join(parts)
+
+    # Valuta la regola come maschera booleana
+    def evaluate(self, columns, quantiles):
+        mask = None
+        for expr, op, percentile, value in self.conditions:
+            values = _expression(columns, expr)
+            if percentile:
+                key = (expr, value)
+                if key not in quantiles:
+                    quantiles[key] = np.nanquantile(values, value) if len(values) else np.nan
+                value = quantiles[key]
+            cond = _OPERATORS[op](values, value)
+            if mask is None:
+                mask = cond
+            else:
+                np.logical_and(mask, cond, out=mask)
+        return mask
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec['name'], spec['conditions'],
+                   severity=spec.get('severity', 1.0), message=spec.get('message'))
+
+
+# Funzione per calcolare il valore di un'espressione (colonna o rapporto)
+def _expression(columns, expr):
+    if len(expr) == 1:
+        return columns[expr[0]]
+    numerator, denominator = expr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return columns[numerator].astype(np.float64) / columns[denominator]
+
+
+# Risultato di una valutazione
+class RuleResult:
+    def __init__(self, names, masks, severities):
+        self.names = names
+        self.masks = masks          # matrice booleana regole x prodotti
+        self.severity = (severities @ masks).astype(np.float32) if len(names) else \
+            np.zeros(masks.shape[1], dtype=np.float32)
+        self.flags = masks.any(axis=0)
+        self.codes = np.zeros(masks.shape[1], dtype=np.uint64)
+        for i in range(len(names)):
+            self.codes |= masks[i].astype(np.uint64) << np.uint64(i)
+
+    def hits(self, name):
+        return self.masks[self.names.index(name)]
+
+    # Bitmap compatta (np.packbits) per ogni regola
+    def bitmaps(self):
+        return {name: np.packbits(self.masks[i]) for i, name in enumerate(self.names)}
+
+
+class RuleEngine:
+    def __init__(self, rules=None):
+        specs = DEFAULT_RULES if rules is None else rules
+        self.rules = [r if isinstance(r, Rule) else Rule.from_dict(r) for r in specs]
+        if len(self.rules) > MAX_RULES:
+            raise ValueError(f"Al massimo {MAX_RULES} regole per motore")
+        names = [r.name for r in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("I nomi delle regole devono essere univoci")
+        self._masks = {}
+        self._lock = threading.Lock()
+        # Regole effettivamente ricalcolate nell'ultima valutazione
+        self.last_evaluated = []
+
+    @property
+    def inputs(self):
+        return sorted({col for rule in self.rules for col in rule.inputs})
+
+    # Regole con condizioni relative ai quantili dell'universo
+    @property
+    def has_percentiles(self):
+        return any(rule.has_percentiles for rule in self.rules)
+
+    # Soglie dei quantili calcolate su un universo (per valutare poi dati a blocchi)
+    def quantiles(self, data):
+        columns = {col: data[col].to_numpy() for col in self.inputs}
+        quantiles = {}
+        for rule in self.rules:
+            for expr, _, percentile, value in rule.conditions:
+                if percentile and (expr, value) not in quantiles:
+                    values = _expression(columns, expr)
+                    quantiles[(expr, value)] = np.nanquantile(values, value) if len(values) else np.nan
+        return quantiles
+
+    # Valuta tutte le regole. Con le versioni delle colonne (vedi set_column_versions) una
+    # regola con colonne di input (e soglie fisse, se date) invariate riusa la maschera precedente.
+    # Con quantiles (vedi quantiles()) le soglie percentuali sono fisse.
+    def evaluate(self, data, quantiles=None):
+        with self._lock:
+            return self._evaluate(data, quantiles)
+
+    def _cache_key(self, rule, versions, fixed_quantiles):
+        if not all(col in versions for col in rule.inputs):
+            return None
+        thresholds = None
+        if fixed_quantiles is not None and rule.has_percentiles:
+            thresholds = tuple(fixed_quantiles.get((expr, value))
+                               for expr, _, percentile, value in rule.conditions if percentile)
+        return tuple(versions[col] for col in rule.inputs), thresholds
+
+    def _evaluate(self, data, fixed_quantiles):
+        n = len(data)
+        columns = {col: data[col].to_numpy() for col in self.inputs}
+        versions = column_versions(data)
+        quantiles = dict(fixed_quantiles or {})
+
+        masks = np.empty((len(self.rules), n), dtype=bool)
+        self.last_evaluated = []
+        for i, rule in enumerate(self.rules):
+            key = self._cache_key(rule, versions, fixed_quantiles)
+            if key is not None:
+                cached = self._masks.get(rule.name)
+                if cached is not None and cached[0] == key:
+                    masks[i] = cached[1]
+                    continue
+            masks[i] = rule.evaluate(columns, quantiles)
+            if key is not None:
+                self._masks[rule.name] = (key, masks[i].copy())
+            self.last_evaluated.append(rule.name)
+
+        severities = np.array([r.severity for r in self.rules], dtype=np.float32)
+        return RuleResult([r.name for r in self.rules], masks, severities)
+
+    # Aggiunge al DataFrame le colonne di greenwashing (flag, severità, bitmap regole)
+    @timed('greenwashing')
+    def apply(self, data, quantiles=None):
+        result = self.evaluate(data, quantiles)
+        data['greenwashing_flag'] = result.flags
+        data['greenwashing_severity'] = result.severity
+        data['greenwashing_rules'] = result.codes
+        versions = column_versions(data)
+        if versions:
+            set_column_versions(data, {**versions, **{col: new_column_version() for col in (
+                'greenwashing_flag', 'greenwashing_severity', 'greenwashing_rules')}})
+        return data
+
+    # Messaggi delle regole colpite, a partire dalla bitmap di un prodotto
+    def messages(self, code):
+        code = int(code)
+        return [rule.message for i, rule in enumerate(self.rules) if code & (1 << i)]
+
+
+# Funzione per leggere le regole da un file JSON (lista di regole)
+def load_rules(path):
+    with open(path, encoding='utf-8') as f:
+        return [Rule.from_dict(spec) for spec in json.load(f)]
+
+
+_default_engine = None
+_default_lock = threading.Lock()
+
+
+# Motore di default condiviso (regole da GREENINVEST_RULES o DEFAULT_RULES)
+def default_engine():
+    global _default_engine
+    with _default_lock:
+        if _default_engine is None:
+            path = os.environ.get('GREENINVEST_RULES')
+            _default_engine = RuleEngine(load_rules(path) if path else None)
+        return _default_engine
@@ -0,0 +1,230 @@
+# Scenari di prezzo del carbonio e rischio di transizione per prodotti e portafogli
+#
+# Un percorso è il prezzo del carbonio (€/t) alla fine di ciascuno dei prossimi
+# `horizon` anni. Gli scenari deterministici (SCENARIOS) sono interpolazioni
+# lineari di pochi punti; il Monte Carlo aggiunge a uno scenario una
+# volatilità lognormale e shock di policy (salti del prezzo con probabilità
+# annua `shock_probability`, permanenti).
+# La perdita di un prodotto su un percorso è il valore attuale dei costi del
+# carbonio non trasferiti ai clienti, in frazione del capitale investito (al
+# massimo 1): co2_emissions è in tonnellate per milione di euro (vedi
+# portfolio.CO2_INVESTMENT_UNIT) e le emissioni calano ogni anno di una quota
+# che cresce con la % di attività green. Il modello è lineare nel prezzo,
+# quindi le perdite di tutti i percorsi sono un solo prodotto matriciale
+# (percorsi x anni) @ (anni x prodotti), calcolato a blocchi di prodotti con
+# al più BLOCK_ELEMENTS valori e ridotto subito a perdita attesa, VaR ed
+# expected shortfall per prodotto (e a perdite per cliente, se serve): la
+# matrice percorsi x prodotti non viene mai tenuta in memoria per intero.
+# I blocchi vengono distribuiti su un pool di processi (parallel.ordered_map).
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from greeninvest.parallel import ordered_map
+from greeninvest.portfolio import CO2_INVESTMENT_UNIT
+
+HORIZON_YEARS = 10
+DISCOUNT_RATE = 0.05
+
+# Scenari deterministici: (anno, prezzo €/t) interpolati linearmente (anno 0 = oggi)
+SCENARIOS = {
+    "Politiche attuali": ((0, 85), (5, 100), (10, 120)),
+    "Net Zero 2050": ((0, 85), (5, 180), (10, 300)),
+    "Transizione ritardata": ((0, 85), (5, 90), (6, 250), (10, 350)),
+    "Shock improvviso": ((0, 85), (1, 300), (10, 300)),
+}
+DEFAULT_SCENARIO = "Net Zero 2050"
+
+# Monte Carlo: volatilità annua del log-prezzo e shock di policy (salto relativo del prezzo)
+VOLATILITY = 0.25
+SHOCK_PROBABILITY = 0.05
+SHOCK_SIZE = 0.5
+
+# Riduzione annua delle emissioni: base + quota proporzionale alle attività green
+BASE_ABATEMENT = 0.02
+GREEN_ABATEMENT = 0.08
+
+# Quota dei costi del carbonio trasferita ai clienti per settore
+SECTOR_PASS_THROUGH = {
+    'Energia': 0.5, 'Utilities': 0.6, 'Industria': 0.3, 'Materiali': 0.3, 'Finanza': 0.1,
+    'Tecnologia': 0.2, 'Sanità': 0.3, 'Consumi': 0.4, 'Immobiliare': 0.2,
+}
+DEFAULT_PASS_THROUGH = 0.3
+
+CONFIDENCE = 0.95
+
+# Intervalli degli istogrammi delle perdite
+LOSS_BINS = 40
+
+# Valori percorsi x prodotti per blocco (64 MB in float32)
+BLOCK_ELEMENTS = 1 << 24
+
+_worker_paths = None
+_worker_confidence = None
+
+
+# Funzione per ottenere il percorso di prezzo (anni 1..horizon) di uno scenario deterministico
+def scenario_path(scenario, horizon=HORIZON_YEARS):
+    years, prices = zip(*SCENARIOS[scenario])
+    return np.interp(np.arange(1, horizon + 1), years, prices)
+
+
+# Percorsi deterministici di più scenari (scenari x anni)
+def scenario_paths(scenarios=None, horizon=HORIZON_YEARS):
+    return np.vstack([scenario_path(name, horizon) for name in (scenarios or SCENARIOS)])
+
+
+# Percorsi Monte Carlo (percorsi x anni) intorno a uno scenario, riproducibili dato il seed
+def price_paths(n_paths, scenario=DEFAULT_SCENARIO, horizon=HORIZON_YEARS, volatility=VOLATILITY,
+                shock_probability=SHOCK_PROBABILITY, shock_size=SHOCK_SIZE, seed=0):
+    rng = np.random.default_rng(seed)
+    base = scenario_path(scenario, horizon)
+    # Passeggiata lognormale con media uguale allo scenario, più gli shock (solo al rialzo)
+    steps = rng.normal(-volatility ** 2 / 2, volatility, (n_paths, horizon))
+    shocks = np.cumsum(rng.random((n_paths, horizon)) < shock_probability, axis=1)
+    return base * np.exp(np.cumsum(steps, axis=1)) * (1 + shock_size) ** shocks
+
+
+# Matrice delle esposizioni (prodotti x anni): perdita per €/t di prezzo in ciascun anno
+def exposures(frame, horizon=HORIZON_YEARS, discount_rate=DISCOUNT_RATE):
+    co2 = np.nan_to_num(frame['co2_emissions'].to_numpy(dtype=np.float64)) / CO2_INVESTMENT_UNIT
+    green = np.nan_to_num(frame['green_activities'].to_numpy(dtype=np.float64)) / 100
+    pass_through = np.full(len(frame), DEFAULT_PASS_THROUGH)
+    if 'sector' in frame.columns:
+        sectors = pd.Series(frame['sector'].to_numpy(dtype=object)).map(SECTOR_PASS_THROUGH)
+        pass_through = sectors.fillna(DEFAULT_PASS_THROUGH).to_numpy(dtype=np.float64)
+    abatement = np.clip(BASE_ABATEMENT + GREEN_ABATEMENT * green, 0, 1)
+    years = np.arange(1, horizon + 1)
+    discount = (1 + discount_rate) ** -years
+    matrix = (co2 * (1 - pass_through))[:, None] * (1 - abatement[:, None]) ** years * discount
+    return matrix.astype(np.float32)
+
+
+# Perdite (percorsi x prodotti) di un blocco, in frazione del capitale investito
+def block_losses(paths, exposure):
+    losses = paths @ exposure.T
+    return np.clip(losses, 0, 1, out=losses)
+
+
+# Perdita attesa, VaR ed expected shortfall lungo l'asse dei percorsi (asse 0)
+def tail_stats(losses, confidence=CONFIDENCE):
+    n = len(losses)
+    k = min(int(confidence * n), n - 1)
+    ordered = np.partition(losses, k, axis=0)
+    # copy: la riga del VaR non deve tenere in vita l'intero blocco
+    return losses.mean(axis=0), ordered[k].copy(), ordered[k:].mean(axis=0)
+
+
+def _init_worker(paths, confidence):
+    global _worker_paths, _worker_confidence
+    _worker_paths = paths
+    _worker_confidence = confidence
+
+
+# Un blocco di prodotti: statistiche per prodotto e (se ci sono pesi) perdite per portafoglio
+def _simulate_block(job):
+    exposure, weights = job
+    losses = block_losses(_worker_paths, exposure)
+    stats = tail_stats(losses, _worker_confidence)
+    partial = None if weights is None else np.asarray(weights @ losses.T, dtype=np.float64)
+    return stats, partial
+
+
+def _block_size(n_paths):
+    return max(1, BLOCK_ELEMENTS // max(n_paths, 1))
+
+
+# Esegue la simulazione a blocchi, in parallelo se workers > 1; restituisce i risultati nell'ordine
+def _run(paths, jobs, confidence, workers):
+    paths = np.ascontiguousarray(paths, dtype=np.float32)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(paths, confidence)
+        yield from map(_simulate_block, jobs)
+        return
+    # spawn: i processi non ereditano i thread del chiamante (es. il server Streamlit)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(paths, confidence)) as pool:
+        yield from ordered_map(pool, _simulate_block, jobs, 2 * workers)
+
+
+# Perdita attesa, VaR ed ES di ogni prodotto dell'universo sui percorsi dati (frazioni)
+def product_losses(data, paths, confidence=CONFIDENCE, workers=None):
+    horizon = paths.shape[1]
+    size = _block_size(len(paths))
+    jobs = ((exposures(data.iloc[start:start + size], horizon), None)
+            for start in range(0, len(data), size))
+    stats = [block for block, _ in _run(paths, jobs, confidence, workers)]
+    expected, var, shortfall = (np.concatenate([block[i] for block in stats]) if stats
+                                else np.zeros(0, dtype=np.float32) for i in range(3))
+    return pd.DataFrame({
+        'product': data['product'].to_numpy(dtype=object),
+        'expected_loss': expected,
+        'var': var,
+        'expected_shortfall': shortfall,
+    })
+
+
+# Perdite deterministiche di ogni prodotto per scenario (colonne = scenari)
+def scenario_losses(data, scenarios=None, horizon=HORIZON_YEARS):
+    names = list(scenarios or SCENARIOS)
+    paths = scenario_paths(names, horizon).astype(np.float32)
+    size = _block_size(len(paths))
+    parts = [block_losses(paths, exposures(data.iloc[start:start + size], horizon)).T
+             for start in range(0, len(data), size)]
+    losses = np.vstack(parts) if parts else np.zeros((0, len(names)), dtype=np.float32)
+    frame = pd.DataFrame(losses, columns=names)
+    frame.insert(0, 'product', data['product'].to_numpy(dtype=object))
+    return frame
+
+
+# Distribuzione delle perdite dei portafogli del book (solo i prodotti detenuti vengono simulati).
+# Restituisce la tabella per cliente (valore, perdita attesa, VaR, ES in frazione del valore)
+# e le perdite dell'intero book per percorso (frazione del patrimonio totale)
+def portfolio_losses(data, book, paths, confidence=CONFIDENCE, clients=None, workers=None):
+    horizon = paths.shape[1]
+    holdings = book.matrix
+    if clients is not None:
+        rows = {client: i for i, client in enumerate(book.clients)}
+        holdings = holdings[[rows[client] for client in clients]]
+    clients = list(book.clients if clients is None else clients)
+
+    held = np.unique(holdings.indices)
+    holdings = holdings[:, held]
+    # Importi clienti x prodotti detenuti; l'ultima riga è l'intero book
+    weights = sparse.vstack([holdings, sparse.csr_matrix(holdings.sum(axis=0))]).tocsc()
+    frame = data.iloc[held]
+
+    size = _block_size(len(paths))
+    jobs = ((exposures(frame.iloc[start:start + size], horizon),
+             weights[:, start:start + size].astype(np.float32)) for start in range(0, len(held), size))
+    totals = np.zeros((weights.shape[0], len(paths)))
+    for _, partial in _run(paths, jobs, confidence, workers):
+        totals += partial
+
+    value = np.asarray(weights.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = np.where(value[:, None] > 0, totals / value[:, None], 0.0)
+    expected, var, shortfall = tail_stats(fractions.T, confidence)
+    result = pd.DataFrame({
+        'client': clients,
+        'value': value[:-1],
+        'expected_loss': expected[:-1],
+        'var': var[:-1],
+        'expected_shortfall': shortfall[:-1],
+    })
+    return result, fractions[-1]
+
+
+# Istogramma di una distribuzione di perdite per i grafici (una riga per intervallo)
+def loss_histogram(losses, bins=LOSS_BINS):
+    counts, edges = np.histogram(losses, bins=bins)
+    return pd.DataFrame({
+        'loss': (edges[:-1] + edges[1:]) / 2,
+        'share': counts / max(len(losses), 1),
+    })
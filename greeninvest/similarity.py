@@ -0,0 +1,182 @@
+# Ricerca delle alternative sostenibili più simili (k-nearest neighbours)
+#
+# Ogni prodotto è un vettore normalizzato in [0, 1] con le stesse trasformazioni
+# del comparatore (ESG score, emissioni CO₂ invertite, % attività green) più gli
+# eventuali pilastri E/S/G presenti nell'universo. Le query usano un KD-tree
+# (scipy.spatial.cKDTree) costruito una volta per universo; se scipy non è
+# disponibile si ripiega su un calcolo vettoriale delle distanze a blocchi.
+# Per il vincolo "emissioni inferiori" i prodotti sono ordinati per CO₂ e divisi
+# in CO2_BANDS fasce, ciascuna con il suo KD-tree: i candidati ammessi sono un
+# prefisso dell'ordinamento, quindi si interrogano solo le fasce interamente sotto
+# la soglia più il tratto iniziale della fascia che la contiene (a forza bruta).
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.cache import UniverseCache
+from greeninvest.comparator import index_for
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    cKDTree = None
+
+# Pilastri aggiuntivi (scala 0-100) usati come feature se presenti
+PILLAR_COLUMNS = ('environmental_score', 'social_score', 'governance_score')
+
+# Righe per blocco nel calcolo delle distanze senza KD-tree
+BLOCK_SIZE = 1 << 16
+
+# Fasce di CO₂ (per rango) indicizzate separatamente per il vincolo di emissioni inferiori
+CO2_BANDS = 16
+
+_indexes = UniverseCache(maxsize=8, name='similarity')
+
+
+# Funzione per costruire la matrice delle feature normalizzate
+def feature_matrix(data):
+    index = index_for(data)
+    columns = [
+        index.esg_score / 100,
+        1 - (index.co2_emissions / index.max_co2),  # meno emissioni = valore più alto
+        index.green_activities / 100,
+    ]
+    for col in PILLAR_COLUMNS:
+        if col in data.columns:
+            columns.append(data[col].to_numpy(dtype=np.float32) / 100)
+    return np.ascontiguousarray(np.column_stack(columns), dtype=np.float32)
+
+
+class SimilarityIndex:
+    def __init__(self, data, use_tree=True):
+        self.features = feature_matrix(data)
+        self.co2 = index_for(data).co2_emissions
+        self.greenwashing = data['greenwashing_flag'].to_numpy(dtype=bool)
+        self.use_tree = use_tree and cKDTree is not None
+        # Righe con feature mancanti non vengono mai proposte
+        self._valid = np.isfinite(self.features).all(axis=1)
+        self._subsets = {}
+        self._bands = {}
+
+    # Posizioni proponibili: tutti i prodotti validi o solo quelli senza greenwashing
+    def _candidates(self, exclude_greenwashing):
+        return np.flatnonzero(self._valid & ~self.greenwashing if exclude_greenwashing else self._valid)
+
+    # Sottoinsieme indicizzato: tutti i prodotti validi o solo quelli senza greenwashing
+    def _subset(self, exclude_greenwashing):
+        subset = self._subsets.get(exclude_greenwashing)
+        if subset is None:
+            positions = self._candidates(exclude_greenwashing)
+            tree = cKDTree(self.features[positions]) if self.use_tree and len(positions) else None
+            subset = self._subsets[exclude_greenwashing] = (positions, tree)
+        return subset
+
+    # Sottoinsieme ordinato per CO₂ crescente e diviso in fasce: (posizioni, CO₂, inizi, alberi)
+    def _co2_bands(self, exclude_greenwashing):
+        bands = self._bands.get(exclude_greenwashing)
+        if bands is None:
+            positions = self._candidates(exclude_greenwashing)
+            positions = positions[np.argsort(self.co2[positions], kind='stable')]
+            starts = np.linspace(0, len(positions), CO2_BANDS + 1).astype(np.int64)
+            starts = np.unique(starts)
+            trees = [cKDTree(self.features[positions[start:stop]]) if self.use_tree else None
+                     for start, stop in zip(starts[:-1], starts[1:])]
+            bands = self._bands[exclude_greenwashing] = (positions, self.co2[positions], starts, trees)
+        return bands
+
+    # Primi k vicini tra i prodotti con CO₂ strettamente inferiore a max_co2
+    def _nearest_lower_co2(self, vector, k, max_co2, exclude_greenwashing):
+        positions, co2, starts, trees = self._co2_bands(exclude_greenwashing)
+        n_lower = int(np.searchsorted(co2, max_co2, side='left'))
+        if n_lower == 0 or k <= 0 or np.isnan(max_co2):
+            # Nessun prodotto emette meno (es. il prodotto con la CO₂ minima)
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        accept = lambda candidates: np.ones(len(candidates), dtype=bool)
+        best_pos, best_dist = [], []
+        for start, stop, tree in zip(starts[:-1], starts[1:], trees):
+            if start >= n_lower:
+                break
+            if stop > n_lower:
+                # Fascia a cavallo della soglia: solo il suo tratto iniziale, senza albero
+                stop, tree = n_lower, None
+            found, dist = self._nearest(vector, positions[start:stop], tree, k, accept)
+            best_pos.append(found)
+            best_dist.append(dist)
+        best_pos, best_dist = np.concatenate(best_pos), np.concatenate(best_dist)
+        order = np.argsort(best_dist, kind='stable')[:k]
+        return best_pos[order], best_dist[order]
+
+    # Primi k vicini di un vettore tra le posizioni che rispettano il vincolo
+    def _nearest(self, vector, positions, tree, k, accept):
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if tree is not None:
+            # Il vincolo è applicato dopo la query: si allarga k finché bastano i risultati
+            n_query = min(len(positions), max(4 * k, 16))
+            while True:
+                dist, idx = tree.query(vector, k=n_query)
+                dist, idx = np.atleast_1d(dist), np.atleast_1d(idx)
+                found = positions[idx]
+                keep = accept(found)
+                if keep.sum() >= k or n_query == len(positions):
+                    return found[keep][:k], dist[keep][:k].astype(np.float32)
+                n_query = min(len(positions), n_query * 4)
+
+        best_pos, best_dist = [], []
+        for start in range(0, len(positions), BLOCK_SIZE):
+            block = positions[start:start + BLOCK_SIZE]
+            block = block[accept(block)]
+            if len(block) == 0:
+                continue
+            diff = self.features[block] - vector
+            dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+            if len(dist) > k:
+                part = np.argpartition(dist, k - 1)[:k]
+                block, dist = block[part], dist[part]
+            best_pos.append(block)
+            best_dist.append(dist)
+        if not best_pos:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        best_pos, best_dist = np.concatenate(best_pos), np.concatenate(best_dist)
+        order = np.argsort(best_dist, kind='stable')[:k]
+        return best_pos[order], best_dist[order]
+
+    # Alternative più simili a un prodotto (per posizione), con vincoli di sostenibilità
+    def query(self, position, k=5, exclude_greenwashing=True, lower_co2=True):
+        vector = self.features[position]
+        if not self._valid[position]:
+            # Un prodotto con feature mancanti non ha una distanza dagli altri
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if lower_co2:
+            # Il prodotto stesso non ha CO₂ inferiore alla propria: è escluso dal filtro
+            return self._nearest_lower_co2(vector, k, self.co2[position], exclude_greenwashing)
+
+        positions, tree = self._subset(exclude_greenwashing)
+        return self._nearest(vector, positions, tree, k, lambda candidates: candidates != position)
+
+
+# Funzione per ottenere (o costruire una sola volta) l'indice di similarità di un universo
+def similarity_index_for(data):
+    return _indexes.get(data, 'similarity_index', lambda: SimilarityIndex(data))
+
+
+# Funzione per trovare le alternative più sostenibili e simili a un prodotto
+def greener_alternatives(data, product, k=5, exclude_greenwashing=True, lower_co2=True):
+    position = index_for(data).position(product)
+    found, dist = similarity_index_for(data).query(position, k=k,
+                                                   exclude_greenwashing=exclude_greenwashing,
+                                                   lower_co2=lower_co2)
+    rows = data[['product', 'esg_score', 'co2_emissions', 'green_activities']].iloc[found]
+    alternatives = pd.DataFrame({
+        'product': rows['product'].to_numpy(dtype=object),
+        'esg_score': rows['esg_score'].to_numpy(),
+        'co2_emissions': rows['co2_emissions'].to_numpy(),
+        'green_activities': rows['green_activities'].to_numpy(),
+        'distance': dist,
+    })
+    # Similarità in [0, 1] rispetto alla distanza massima possibile nello spazio delle feature
+    n_features = similarity_index_for(data).features.shape[1]
+    alternatives['similarity'] = 1 - alternatives['distance'] / np.sqrt(n_features)
+    return alternatives
@@ -0,0 +1,219 @@
+# Snapshot in sola lettura dell'universo, condivise tra sessioni e processi
+#
+# Una snapshot è una cartella con un file .npy per colonna (codici per le
+# colonne categoriche, le cui categorie sono salvate come un unico blocco
+# UTF-8 con gli offset, come le colonne di testo) e un manifest.json con schema
+# e statistiche derivate. Nessun file contiene oggetti Python (allow_pickle=False):
+# tutto si può mappare in memoria.
+# I file vengono aperti con np.load(mmap_mode='r'): tutte le sessioni di un
+# processo condividono lo stesso DataFrame e tutti i processi che aprono la
+# stessa versione condividono le stesse pagine della page cache del sistema
+# operativo, senza copie. Sono salvati anche gli array dell'indice prodotti
+# (comparator.ProductIndex) e le statistiche del grafico panoramica.
+#
+#   root/
+#     CURRENT            nome della versione corrente
+#     v000001/           manifest.json, 000.npy, 001.codes.npy, ...
+#
+# publish() scrive la nuova versione in una cartella temporanea, la rinomina, la
+# apre per verificarla e solo allora sostituisce CURRENT con os.replace
+# (atomico): i lettori vedono sempre una versione completa e leggibile. current_snapshot() rilegge CURRENT a ogni chiamata (pochi
+# byte) e passa alla nuova versione; chi usa ancora la precedente continua a
+# leggerla (i file mappati restano validi anche dopo la cancellazione).
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.aggregation import ScoreStats, register_score_stats, score_stats
+from greeninvest.comparator import ProductIndex, index_for, register_index
+
+CURRENT = 'CURRENT'
+MANIFEST = 'manifest.json'
+
+# Versioni tenute su disco oltre alla corrente (per i processi che le stanno ancora leggendo)
+KEEP_VERSIONS = 2
+
+INDEX_COLUMNS = ('esg_score', 'co2_emissions', 'green_activities')
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _version_name(number):
+    return f'v{number:06d}'
+
+
+def _versions(root):
+    names = [name for name in os.listdir(root)
+             if name.startswith('v') and name[1:].isdigit() and os.path.isdir(os.path.join(root, name))]
+    return sorted(names)
+
+
+# Array mappato in sola lettura (come ndarray semplice: la mappa resta viva tramite .base)
+def _map(path):
+    return np.load(path, mmap_mode='r').view(np.ndarray)
+
+
+def _save(path, array):
+    np.save(path, array, allow_pickle=False)
+
+
+# Blocco UTF-8 con gli offset; i valori mancanti (valid False) sono stringhe vuote marcate
+# nel file .valid.npy, scritto solo se ce ne sono
+def _write_strings(path, values, valid=None):
+    if valid is not None:
+        values = [value if ok else '' for value, ok in zip(values, valid)]
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    with open(path + '.strings', 'wb') as f:
+        f.write(b''.join(encoded))
+    _save(path + '.offsets.npy', offsets)
+    if valid is not None and not valid.all():
+        _save(path + '.valid.npy', valid)
+
+
+# Stringhe lette dal blocco UTF-8 mappato (stringhe Arrow senza copia, se pyarrow è disponibile)
+def _read_strings(path):
+    offsets = _map(path + '.offsets.npy')
+    size = int(offsets[-1])
+    blob = np.memmap(path + '.strings', dtype=np.uint8, mode='r') if size else np.zeros(0, dtype=np.uint8)
+    valid = _map(path + '.valid.npy') if os.path.exists(path + '.valid.npy') else None
+    try:
+        import pyarrow as pa
+    except ImportError:  # pragma: no cover - dipende dall'ambiente
+        raw = bytes(blob)
+        values = [raw[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+        if valid is not None:
+            values = [value if ok else np.nan for value, ok in zip(values, valid)]
+        return pd.Index(values, dtype=object)
+    bitmap = None if valid is None else pa.py_buffer(np.packbits(valid, bitorder='little'))
+    array = pa.Array.from_buffers(pa.large_string(), len(offsets) - 1,
+                                  [bitmap, pa.py_buffer(offsets), pa.py_buffer(blob)])
+    return pd.Index(pd.array(array, dtype=pd.StringDtype('pyarrow', na_value=np.nan)))
+
+
+# Colonna di testo (str o object con sole stringhe) da salvare come blocco UTF-8
+def _is_text(series):
+    if pd.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        return True
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty')
+
+
+# Scrive una nuova versione della snapshot e la rende corrente; restituisce il nome della versione
+def publish(data, root, keep=KEEP_VERSIONS):
+    os.makedirs(root, exist_ok=True)
+    versions = _versions(root)
+    name = _version_name(int(versions[-1][1:]) + 1 if versions else 1)
+    tmp = os.path.join(root, f'.{name}.{os.getpid()}.tmp')
+    os.makedirs(tmp)
+    try:
+        columns = []
+        for i, col in enumerate(data.columns):
+            series = data[col]
+            path = os.path.join(tmp, f'{i:03d}')
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                _save(path + '.codes.npy', series.cat.codes.to_numpy())
+                _write_strings(path, series.cat.categories)
+                columns.append({'name': col, 'file': f'{i:03d}', 'kind': 'category',
+                                'ordered': bool(series.cat.ordered)})
+            elif _is_text(series):
+                _write_strings(path, series.to_numpy(dtype=object), series.notna().to_numpy())
+                columns.append({'name': col, 'file': f'{i:03d}', 'kind': 'string'})
+            elif series.dtype == object:
+                raise TypeError(f"Colonna {col}: solo numeri, booleani, testo e categorie "
+                                f"possono essere salvati in una snapshot")
+            else:
+                _save(path + '.npy', series.to_numpy())
+                columns.append({'name': col, 'file': f'{i:03d}', 'kind': 'array'})
+
+        index = index_for(data)
+        for col in INDEX_COLUMNS:
+            _save(os.path.join(tmp, f'index.{col}.npy'), getattr(index, col))
+        stats = score_stats(data)
+        manifest = {
+            'version': name,
+            'rows': len(data),
+            'created': time.time(),
+            'columns': columns,
+            'score_stats': {
+                'bins': stats.bins,
+                'counts': stats.counts.tolist(),
+                'groups': {by: [counts.tolist(), sums.tolist()] for by, (counts, sums) in stats.groups.items()},
+            },
+        }
+        with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.rename(tmp, os.path.join(root, name))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # La versione diventa corrente solo se si riesce ad aprirla
+    try:
+        snapshot = Snapshot(os.path.join(root, name))
+    except BaseException:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        raise
+    pointer = os.path.join(root, f'.{CURRENT}.{os.getpid()}.tmp')
+    with open(pointer, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(root, CURRENT))
+    with _snapshots_lock:
+        _snapshots[os.path.abspath(root)] = snapshot
+
+    for old in _versions(root)[:-(keep + 1)]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return name
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+
+        columns = {}
+        for column in self.manifest['columns']:
+            file = os.path.join(path, column['file'])
+            if column['kind'] == 'category':
+                dtype = pd.CategoricalDtype(_read_strings(file), ordered=column['ordered'])
+                codes = _map(file + '.codes.npy')
+                columns[column['name']] = pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+            elif column['kind'] == 'string':
+                columns[column['name']] = _read_strings(file).array
+            else:
+                columns[column['name']] = _map(file + '.npy')
+        # copy=False: le colonne restano gli array mappati
+        self.data = pd.DataFrame(columns, copy=False)
+
+        # Strutture derivate registrate per questo DataFrame (non vengono ricalcolate)
+        arrays = [_map(os.path.join(path, f'index.{col}.npy')) for col in INDEX_COLUMNS]
+        register_index(self.data, ProductIndex(self.data, arrays))
+        saved = self.manifest['score_stats']
+        register_score_stats(self.data, ScoreStats(
+            saved['bins'],
+            np.array(saved['counts'], dtype=np.int64),
+            {by: (np.array(counts, dtype=np.int64), np.array(sums))
+             for by, (counts, sums) in saved['groups'].items()},
+        ))
+
+
+# Funzione per aprire la snapshot corrente (una volta per versione e processo)
+def current_snapshot(root):
+    root = os.path.abspath(root)
+    with open(os.path.join(root, CURRENT), encoding='utf-8') as f:
+        name = f.read().strip()
+    with _snapshots_lock:
+        snapshot = _snapshots.get(root)
+        if snapshot is None or snapshot.version != name:
+            # Sostituzione atomica: le sessioni che hanno già la versione precedente la tengono
+            snapshot = _snapshots[root] = Snapshot(os.path.join(root, name))
+        return snapshot
@@ -0,0 +1,259 @@
+# Salvataggio non bloccante dei moduli inviati (profilazione, contatti)
+#
+# submit() non tocca il database: aggiunge una riga JSON a un file journal
+# (scrittura in coda, nessun fsync) e mette il record in una coda in memoria.
+# Un thread di sfondo scrive i record su SQLite (modalità WAL) a gruppi: una
+# transazione per blocco, avviata quando la coda raggiunge `batch_size` record
+# oppure dopo `interval` secondi. Nella stessa transazione viene salvata la
+# posizione del journal già scritta, quindi dopo un riavvio (anche dopo un
+# crash del processo) i record non ancora nel database vengono recuperati dal
+# journal esattamente una volta. Il journal ruota in file numerati per
+# generazione; quelli già scritti sul database vengono eliminati.
+# Un file di database deve essere usato da un solo processo dell'app.
+
+import atexit
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), '.local', 'share', 'greeninvest', 'submissions.db')
+
+# Record per transazione e attesa massima prima di scrivere un blocco incompleto
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+
+# Dimensione oltre la quale il journal passa a un nuovo file
+JOURNAL_BYTES = 4 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    form TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_form ON submissions (form, submitted_at);
+CREATE TABLE IF NOT EXISTS journal_position (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # Con WAL, NORMAL non perde transazioni in caso di crash del processo
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# Righe complete del journal a partire da offset: (offset finale, record)
+def _journal_records(path, offset):
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # riga scritta a metà prima di un crash
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records.append((record['form'], record['at'], record['payload']))
+    return offset, records
+
+
+class SubmissionQueue:
+    def __init__(self, path=DEFAULT_DB, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.committed = 0
+        self.batches = 0
+        self.recovered = 0
+        # Transazioni non riuscite (i loro record restano in coda e vengono ritentati)
+        self.failures = 0
+        self.last_commit = None
+        self.last_error = None
+        self._queue = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = _connect(path)
+        self._generation = self._committed_generation = self._recover()
+        self._journal = open(self._journal_path(self._generation), 'ab')
+        self._thread = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _journal_path(self, generation):
+        return f'{self.path}.{generation}.journal'
+
+    def _journals(self):
+        found = {}
+        for path in glob.glob(glob.escape(self.path) + '.*.journal'):
+            generation = path[len(self.path) + 1:-len('.journal')]
+            if generation.isdigit():
+                found[int(generation)] = path
+        return sorted(found.items())
+
+    # Scrive sul database i record del journal non ancora salvati e apre una nuova generazione
+    def _recover(self):
+        row = self._conn.execute('SELECT generation, offset FROM journal_position').fetchone()
+        generation, offset = row if row else (0, 0)
+        journals = self._journals()
+        records = []
+        for number, path in journals:
+            if number >= generation:
+                records += _journal_records(path, offset if number == generation else 0)[1]
+        new_generation = max([generation] + [n for n, _ in journals]) + 1
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany(
+                'INSERT INTO submissions (form, submitted_at, payload) VALUES (?, ?, ?)', records)
+            self._conn.execute('INSERT OR REPLACE INTO journal_position VALUES (0, ?, 0)',
+                               (new_generation,))
+        for _, path in journals:
+            os.remove(path)
+        self.recovered = len(records)
+        return new_generation
+
+    # Registra un modulo inviato; ritorna subito (la scrittura su SQLite avviene in seguito)
+    def submit(self, form, payload):
+        now = time.time()
+        payload = json.dumps(payload, ensure_ascii=False, default=str)
+        line = json.dumps({'form': form, 'at': now, 'payload': payload},
+                          ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._journal.tell() + len(line) > JOURNAL_BYTES:
+                self._journal.close()
+                self._generation += 1
+                self._journal = open(self._journal_path(self._generation), 'ab')
+            self._journal.write(line)
+            self._journal.flush()
+            self._queue.append((self._generation, self._journal.tell(), (form, now, payload)))
+            if len(self._queue) >= self.batch_size:
+                self._wake.set()
+
+    # Record inviati ma non ancora salvati nel database
+    @property
+    def backlog(self):
+        return len(self._queue) + self._in_flight
+
+    def stats(self):
+        return {
+            'backlog': self.backlog, 'committed': self.committed, 'batches': self.batches,
+            'recovered': self.recovered, 'failures': self.failures, 'last_commit': self.last_commit,
+            'last_error': self.last_error,
+        }
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            stopping = self._stop
+            self._write_pending()
+            if stopping:
+                return
+
+    def _write_pending(self):
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+                self._in_flight = len(batch)
+            if not batch:
+                return
+            try:
+                self._commit(batch)
+            except sqlite3.Error as e:
+                # Database non disponibile: i record restano in coda (e nel journal)
+                self.last_error = str(e)
+                self.failures += 1
+                with self._lock:
+                    self._queue = batch + self._queue
+                    self._in_flight = 0
+                return
+            self._in_flight = 0
+            if len(batch) < self.batch_size:
+                return
+
+    # Una transazione per blocco: record e posizione del journal insieme
+    def _commit(self, batch):
+        start = time.perf_counter()
+        generation, offset, _ = batch[-1]
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany(
+                'INSERT INTO submissions (form, submitted_at, payload) VALUES (?, ?, ?)',
+                [row for _, _, row in batch])
+            self._conn.execute('UPDATE journal_position SET generation = ?, offset = ? WHERE id = 0',
+                               (generation, offset))
+        self.committed += len(batch)
+        self.batches += 1
+        self.last_commit = {'at': time.time(), 'records': len(batch),
+                            'duration': time.perf_counter() - start}
+        self.last_error = None
+        # Le generazioni precedenti sono ormai tutte nel database
+        if generation > self._committed_generation:
+            for number, path in self._journals():
+                if number < generation:
+                    os.remove(path)
+            self._committed_generation = generation
+
+    # Scrive subito quanto in coda e attende il termine
+    def flush(self, timeout=None):
+        self._wake.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.backlog and self._thread.is_alive():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.005)
+        return not self.backlog
+
+    def close(self):
+        if self._stop:
+            return
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            self._journal.close()
+        self._conn.close()
+
+    # Ultimi moduli salvati (es. per il pannello amministrativo)
+    def recent(self, form=None, limit=100):
+        conn = _connect(self.path)
+        try:
+            query = 'SELECT form, submitted_at, payload FROM submissions'
+            args = ()
+            if form is not None:
+                query += ' WHERE form = ?'
+                args = (form,)
+            rows = conn.execute(query + ' ORDER BY id DESC LIMIT ?', args + (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [{'form': f, 'submitted_at': at, **json.loads(payload)} for f, at, payload in rows]
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+# Funzione per ottenere (una volta per file di database) la coda di salvataggio
+def submission_queue(path=None):
+    path = os.path.abspath(path or DEFAULT_DB)
+    with _queues_lock:
+        queue = _queues.get(path)
+        if queue is None:
+            queue = _queues[path] = SubmissionQueue(path)
+        return queue
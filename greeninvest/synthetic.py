@@ -0,0 +1,194 @@
+# Generatore vettoriale di universi ESG simulati per test di carico
+#
+# Ogni prodotto ha un fattore latente di "qualità ESG" da cui dipendono, con
+# rumore, ESG score e % di attività green (correlati positivamente) e le
+# emissioni CO₂ (lognormali, correlate negativamente), intorno ai valori tipici
+# del settore. Una quota `greenwashing_rate` di prodotti ha ESG score alto e
+# attività green basse (la regola 'score_alto_green_basso' del motore); gli
+# altri prodotti non la soddisfano mai, quindi la quota di quella regola è
+# controllata esattamente (a meno del campionamento).
+# I dati sono prodotti a blocchi di GENERATION_BLOCK righe, ciascuno con un
+# generatore derivato da (seed, blocco): l'output dipende solo da seed e numero
+# di prodotti, non dalla dimensione dei blocchi richiesti, e la memoria usata
+# è limitata dal blocco.
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.rules import GREENWASHING_MAX_GREEN, GREENWASHING_MIN_SCORE
+
+GENERATION_BLOCK = 1 << 16
+
+# Settore: (peso, ESG medio, CO₂ mediana in tonnellate, % attività green media)
+SECTOR_PROFILES = {
+    'Energia': (0.10, 52, 420.0, 30),
+    'Utilities': (0.08, 60, 300.0, 45),
+    'Industria': (0.14, 58, 220.0, 28),
+    'Materiali': (0.07, 50, 350.0, 22),
+    'Finanza': (0.16, 66, 40.0, 35),
+    'Tecnologia': (0.15, 70, 60.0, 40),
+    'Sanità': (0.10, 68, 55.0, 33),
+    'Consumi': (0.12, 62, 110.0, 30),
+    'Immobiliare': (0.08, 64, 90.0, 38),
+}
+
+PARTNERS = ('Intesa Sanpaolo', 'Clarity AI', 'Coop')
+KINDS = ('ETF', 'Fondo', 'Bond', 'Indice', 'Trust')
+
+# Passi giornalieri delle passeggiate casuali dello storico
+HISTORY_STEPS = {'esg_score': 0.4, 'co2_emissions': 0.01, 'green_activities': 0.2}
+
+
+# Nomi dei prodotti dati i loro indici nell'universo (deterministici, univoci)
+def _names(index):
+    kinds = np.asarray(KINDS, dtype=object)[index % len(KINDS)]
+    return 'GI ' + kinds + ' ' + np.char.zfill(index.astype(str), 8).astype(object)
+
+
+# Nomi dei prodotti con indice in [start, stop)
+def product_names(start, stop):
+    return _names(np.arange(start, stop))
+
+
+def _rng(seed, block):
+    return np.random.default_rng([seed, block])
+
+
+# Blocco di GENERATION_BLOCK prodotti, con generatore derivato da (seed, blocco)
+def _generate_block(seed, block, greenwashing_rate):
+    start = block * GENERATION_BLOCK
+    rng = _rng(seed, block)
+    n = GENERATION_BLOCK
+    sectors = list(SECTOR_PROFILES)
+    profiles = np.array([SECTOR_PROFILES[s] for s in sectors], dtype=np.float64)
+    weights = profiles[:, 0] / profiles[:, 0].sum()
+
+    sector = rng.choice(len(sectors), size=n, p=weights)
+    quality = rng.standard_normal(n)
+    esg = profiles[sector, 1] + 11 * quality + rng.normal(0, 6, n)
+    green = profiles[sector, 3] + 12 * quality + rng.normal(0, 10, n)
+    co2 = profiles[sector, 2] * np.exp(-0.35 * quality + rng.normal(0, 0.6, n))
+
+    esg = np.clip(np.rint(esg), 0, 100)
+    green = np.clip(np.rint(green), 0, 100)
+
+    # Greenwashing: ESG sopra la soglia e attività green sotto la soglia
+    washing = rng.random(n) < greenwashing_rate
+    esg[washing] = rng.integers(GREENWASHING_MIN_SCORE + 1, 101, washing.sum())
+    green[washing] = rng.integers(0, GREENWASHING_MAX_GREEN, washing.sum())
+    honest = ~washing & (esg > GREENWASHING_MIN_SCORE)
+    green[honest] = np.maximum(green[honest], GREENWASHING_MAX_GREEN)
+
+    return pd.DataFrame({
+        'product': product_names(start, start + n),
+        'esg_score': esg.astype(np.int16),
+        'co2_emissions': np.round(co2, 1).astype(np.float32),
+        'green_activities': green.astype(np.int16),
+        'sector': pd.Categorical.from_codes(sector, categories=sectors),
+        'partner': pd.Categorical.from_codes(rng.integers(0, len(PARTNERS), n), categories=PARTNERS),
+    })
+
+
+# Genera l'universo a blocchi di `chunksize` righe (memoria limitata dal blocco)
+def iter_universe(n, seed=0, greenwashing_rate=0.05, chunksize=100_000):
+    buffer = None
+    for block in range(-(-n // GENERATION_BLOCK)):
+        frame = _generate_block(seed, block, greenwashing_rate).iloc[:n - block * GENERATION_BLOCK]
+        buffer = frame if buffer is None else pd.concat([buffer, frame], ignore_index=True)
+        while len(buffer) >= chunksize:
+            yield buffer.iloc[:chunksize].reset_index(drop=True)
+            buffer = buffer.iloc[chunksize:]
+    if buffer is not None and len(buffer):
+        yield buffer.reset_index(drop=True)
+
+
+# Universo simulato completo in memoria
+def generate_universe(n, seed=0, greenwashing_rate=0.05):
+    return pd.concat(list(iter_universe(n, seed, greenwashing_rate, chunksize=max(n, 1))),
+                     ignore_index=True)
+
+
+# Posizioni dei clienti (client, product, amount) a blocchi di clienti
+def iter_holdings(n_products, n_clients, positions=8, seed=0, chunksize=100_000):
+    rng = np.random.default_rng([seed, 1 << 32])
+    per_client = max(1, chunksize // (positions + 1))
+    for start in range(0, n_clients, per_client):
+        stop = min(start + per_client, n_clients)
+        counts = rng.poisson(positions - 1, stop - start) + 1
+        clients = np.repeat(np.arange(start, stop), counts)
+        # Popolarità dei prodotti decrescente (pochi prodotti molto detenuti)
+        products = np.minimum((rng.pareto(1.2, len(clients)) * n_products / 50).astype(np.int64),
+                              n_products - 1)
+        yield pd.DataFrame({
+            'client': 'Cliente ' + np.char.zfill(clients.astype(str), 7).astype(object),
+            'product': _names(products),
+            'amount': np.round(rng.lognormal(9, 1, len(clients)), 0),
+        })
+
+
+# Passeggiate casuali all'indietro che terminano nei valori attuali (prodotti x giorni)
+def history_walks(rng, values, days, steps=HISTORY_STEPS):
+    walks = {}
+    for metric, current in values.items():
+        current = np.asarray(current, dtype=np.float32)
+        step = steps[metric]
+        if metric == 'co2_emissions':
+            # Variazioni relative per le emissioni (sempre positive)
+            log_walk = np.cumsum(rng.normal(0, step, (len(current), days)), axis=1, dtype=np.float32)
+            walk = current[:, None] * np.exp(log_walk - log_walk[:, -1:])
+        else:
+            walk = np.cumsum(rng.normal(0, step, (len(current), days)), axis=1, dtype=np.float32)
+            walk = np.clip(current[:, None] + walk - walk[:, -1:], 0, 100)
+        walks[metric] = walk.astype(np.float32)
+    return walks
+
+
+# Scrive su disco lo storico giornaliero simulato dell'universo (a blocchi di prodotti)
+def write_history(directory, n, days=365, seed=0, greenwashing_rate=0.05, end=None):
+    from greeninvest.history import BLOCK_PRODUCTS, HistoryStore
+    end = pd.Timestamp(end or pd.Timestamp.today()).normalize()
+    start = end - pd.Timedelta(days=days - 1)
+    store = HistoryStore.create(directory, product_names(0, n).tolist(), start, capacity=days)
+    rng = np.random.default_rng([seed, 1 << 33])
+    for chunk in iter_universe(n, seed, greenwashing_rate, chunksize=BLOCK_PRODUCTS):
+        walks = history_walks(rng, {m: chunk[m].to_numpy() for m in HISTORY_STEPS}, days)
+        store.append_days(start, chunk['product'], walks)
+    store.flush()
+    return store
+
+
+# Temi e descrizioni d'impatto delle offerte simulate del marketplace
+LISTING_THEMES = (
+    ('Green Bond', 'Finanziamento progetti energie rinnovabili'),
+    ('Ocean', 'Protezione ecosistemi marini'),
+    ('Community Impact', 'Sviluppo comunità locali sostenibili'),
+    ('Solar', 'Impianti fotovoltaici su tetti e terreni marginali'),
+    ('Wind', 'Parchi eolici onshore e offshore'),
+    ('Clean Water', 'Accesso all\'acqua potabile e depurazione'),
+    ('Forest', 'Riforestazione e gestione sostenibile delle foreste'),
+    ('Circular Economy', 'Riciclo e riduzione dei rifiuti industriali'),
+    ('Smart City', 'Mobilità elettrica ed efficienza energetica urbana'),
+    ('Social Housing', 'Edilizia sociale ad alta efficienza energetica'),
+    ('Agritech', 'Agricoltura rigenerativa e filiere corte'),
+    ('Health Access', 'Servizi sanitari nelle aree svantaggiate'),
+)
+LISTING_KINDS = ('Fund', 'ETF', 'Bond', 'Facility', 'Note', 'Portfolio')
+
+
+# Offerte simulate del marketplace (record per Catalog.from_records)
+def generate_listings(n, seed=0, n_partners=50):
+    rng = np.random.default_rng([seed, 1 << 34])
+    partners = np.array(PARTNERS + tuple(f'Partner {i:03d}' for i in range(max(0, n_partners - len(PARTNERS)))),
+                        dtype=object)
+    theme = rng.integers(0, len(LISTING_THEMES), n)
+    kind = rng.integers(0, len(LISTING_KINDS), n)
+    partner = partners[rng.integers(0, len(partners), n)]
+    minimum = np.choose(rng.integers(0, 6, n), [500, 1000, 2500, 5000, 10000, 50000])
+    expected = np.round(np.clip(rng.normal(3.0, 1.2, n), 0.1, 9.0), 1)
+    names = np.asarray([t[0] for t in LISTING_THEMES], dtype=object)[theme] + ' ' + \
+        np.asarray(LISTING_KINDS, dtype=object)[kind] + ' ' + np.char.zfill(np.arange(n).astype(str), 6).astype(object)
+    impacts = np.asarray([t[1] for t in LISTING_THEMES], dtype=object)[theme]
+    return [
+        {'name': name, 'partner': p, 'min_investment': int(m), 'expected_return': float(r), 'impact': impact}
+        for name, p, m, r, impact in zip(names, partner, minimum, expected, impacts)
+    ]
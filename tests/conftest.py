@@ -0,0 +1,17 @@
+# Fixture condivisa dei test: un piccolo universo simulato con i flag di greenwashing
+#
+# Lo stesso DataFrame è condiviso da tutti i test (le cache per versione
+# dell'universo restano valide tra un test e l'altro): i test che lo modificano
+# devono lavorare su una copia.
+
+import pytest
+
+from greeninvest.rules import default_engine
+from greeninvest.synthetic import generate_universe
+
+UNIVERSE_SIZE = 2000
+
+
+@pytest.fixture(scope='session')
+def universe():
+    return default_engine().apply(generate_universe(UNIVERSE_SIZE, seed=7))
@@ -0,0 +1,92 @@
+# Indice dei prodotti del comparatore: ricerca per prefisso, prodotti aggiunti o cancellati
+# dai feed (indice aggiornato per differenza) e limite dei prodotti confrontabili
+
+import numpy as np
+import pytest
+
+from greeninvest import comparator
+from greeninvest.comparator import (MAX_COMPARE, MAX_SEARCH_RESULTS, ProductIndex, comparison_frame,
+                                    index_for)
+from greeninvest.ingest import LiveUniverse
+from greeninvest.loader import to_columnar
+
+NEW_FIELDS = {'esg_score': 50, 'co2_emissions': 10.0, 'green_activities': 40}
+
+
+def expected_search(data, text, limit=MAX_SEARCH_RESULTS):
+    prefix = text.strip().lower()
+    products = data['product'].astype(str)
+    return sorted((p for p in products if p.lower().startswith(prefix)), key=str.lower)[:limit]
+
+
+def assert_index_matches_data(index, data):
+    products = data['product'].astype(object).tolist()
+    np.testing.assert_array_equal(index.find(products), np.arange(len(data)))
+    assert len(index) == len(data)
+    fresh = ProductIndex(data)
+    for col in ('esg_score', 'co2_emissions', 'green_activities'):
+        np.testing.assert_array_equal(getattr(index, col), getattr(fresh, col))
+    assert index.max_co2 == fresh.max_co2 and index.min_co2 == fresh.min_co2
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_search_by_prefix(universe, columnar):
+    data = to_columnar(universe) if columnar else universe
+    index = ProductIndex(data)
+    first = data['product'].iloc[0]
+    for text in ('GI', 'gi etf', '  GI Bond 0000001 ', first, first.upper(), '', 'nessun prodotto'):
+        for limit in (1, 5, MAX_SEARCH_RESULTS, 10_000):
+            assert index.search(text, limit) == expected_search(data, text, limit)
+    assert len(index.search('')) == MAX_SEARCH_RESULTS
+
+
+def test_products_added_and_deleted_by_feeds(universe, monkeypatch):
+    data = to_columnar(universe)
+    live = LiveUniverse(data)
+    added = ['Nuovo Fondo B', 'nuovo fondo a', 'GI ETF Nuovo']
+    data = live.ingest([{'product': p, **NEW_FIELDS} for p in added]
+                       + [{'product': data['product'].iloc[5], 'co2_emissions': 1e6}])
+    # Indice aggiornato per differenza: i prodotti nuovi stanno in _extra
+    index = index_for(data)
+    assert set(index._extra) == set(added)
+    assert_index_matches_data(index, data)
+    assert index.search('nuovo') == ['nuovo fondo a', 'Nuovo Fondo B']
+    for text in ('GI ETF', 'gi etf n', 'N'):
+        assert index.search(text) == expected_search(data, text)
+
+    # Cancellazione: l'indice ricostruito ha la categoria del prodotto ma nessuna riga
+    deleted = [data['product'].iloc[7], 'Nuovo Fondo B']
+    data = live.ingest([{'op': 'delete', 'product': p} for p in deleted])
+    index = index_for(data)
+    assert_index_matches_data(index, data)
+    for product in deleted:
+        assert product not in index and product not in index.search(product)
+        with pytest.raises(KeyError):
+            index.positions([product])
+    assert index.search('nuovo') == ['nuovo fondo a']
+
+    # Reinserimento: il prodotto torna nei risultati una volta sola
+    data = live.ingest([{'product': p, **NEW_FIELDS} for p in deleted])
+    index = index_for(data)
+    assert_index_matches_data(index, data)
+    for product in deleted:
+        assert index.search(product).count(product) == 1
+    assert index.search('nuovo') == ['nuovo fondo a', 'Nuovo Fondo B']
+
+    # Oltre MAX_EXTRA_KEYS le chiavi aggiunte vengono compattate nell'indice principale
+    monkeypatch.setattr(comparator, 'MAX_EXTRA_KEYS', 2)
+    data = live.ingest([{'product': 'Compattato', **NEW_FIELDS}])
+    index = index_for(data)
+    assert index._extra == {}
+    assert_index_matches_data(index, data)
+    assert index.search('compatt') == ['Compattato']
+    assert index.search('nuovo') == ['nuovo fondo a', 'Nuovo Fondo B']
+    assert index.search(deleted[0]) == expected_search(data, deleted[0])
+
+
+def test_comparison_is_limited_to_max_compare(universe):
+    products = universe['product'].iloc[:MAX_COMPARE + 1].tolist()
+    frame = comparison_frame(universe, products[:MAX_COMPARE])
+    assert frame['product'].tolist() == products[:MAX_COMPARE]
+    with pytest.raises(ValueError):
+        comparison_frame(universe, products)
@@ -0,0 +1,193 @@
+# Recupero dai partner contro un server locale: ETag e 304, keep-alive, timeout,
+# tentativi, latenza iniettata, feed non validi e aggiornamento in sfondo
+
+import asyncio
+import json
+import socket
+import time
+
+import pytest
+
+from greeninvest.fetcher import BackgroundRefresher, Partner, PartnerFetcher, ResponseCache
+from greeninvest.ingest import LiveUniverse, serve_feed_directory
+from greeninvest.rules import default_engine
+
+from tests.test_ingest import assert_same_rows, brute_force, random_records
+
+
+@pytest.fixture
+def serve(tmp_path):
+    # Avvia server sulla cartella dei feed (con latenza ed errori iniettabili)
+    directory = tmp_path / 'feeds'
+    directory.mkdir()
+    servers = []
+
+    def start(**options):
+        server = serve_feed_directory(str(directory), **options)
+        servers.append(server)
+        return directory, f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def feed_server(serve):
+    return serve()
+
+
+def make_fetcher(tmp_path, url, **options):
+    partner = Partner('Partner', [url], **options)
+    return PartnerFetcher([partner], ResponseCache(str(tmp_path / 'cache'))), partner
+
+
+# Esegue più recuperi nello stesso event loop (le connessioni del pool appartengono al loop)
+def fetch_all(fetcher, partner, url, steps):
+    async def run():
+        results = []
+        for step in steps:
+            step()
+            start = time.perf_counter()
+            result = await fetcher.fetch(partner, url)
+            results.append((result, time.perf_counter() - start))
+        fetcher.pool.close()
+        return results
+    return asyncio.run(run())
+
+
+def write_feed(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Condizione non raggiunta in tempo"
+        time.sleep(0.01)
+
+
+def test_etag_revalidation_reuses_the_connection(universe, feed_server, tmp_path):
+    directory, base = feed_server
+    path = directory / 'feed.jsonl'
+    records = random_records(universe, 5, seed=6)
+    url = f'{base}/feed.jsonl'
+    fetcher, partner = make_fetcher(tmp_path, url, ttl=0)
+
+    # Il secondo recupero rivalida con If-None-Match, il terzo trova il feed cambiato
+    steps = [lambda: write_feed(path, records), lambda: None, lambda: write_feed(path, records[:2])]
+    (first, _), (second, _), (third, _) = fetch_all(fetcher, partner, url, steps)
+    assert first['status'] == 'fetched' and first['changed']
+    assert second['status'] == 'not_modified' and not second['changed']
+    assert third['status'] == 'fetched' and third['changed']
+    assert [r['product'] for r in fetcher.records(url)] == [r['product'] for r in records[:2]]
+    # Tre richieste su una sola connessione keep-alive
+    assert fetcher.pool.opened == 1 and fetcher.pool.reused == 2
+
+    # Entro il TTL la risposta in cache si usa senza interrogare il partner
+    fetcher, partner = make_fetcher(tmp_path, url, ttl=60)
+    (cached, _), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert cached['status'] == 'cache' and fetcher.pool.opened == 0
+
+
+def test_injected_latency_and_timeouts(serve, tmp_path):
+    directory, base = serve(latency=0.3)
+    write_feed(directory / 'feed.jsonl', [{'product': 'GI ETF 00000001', 'esg_score': 5}])
+    url = f'{base}/feed.jsonl'
+
+    fetcher, partner = make_fetcher(tmp_path, url, ttl=0, timeout=5)
+    (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['status'] == 'fetched' and elapsed >= 0.3
+
+    # Timeout più breve della latenza: ogni tentativo scade, restano i dati precedenti
+    fetcher, partner = make_fetcher(tmp_path, url, ttl=0, timeout=0.05, retries=1, backoff=0.01)
+    (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['status'] == 'stale' and result['error'] == 'TimeoutError'
+    assert elapsed < 0.3
+
+    fetcher, partner = make_fetcher(tmp_path / 'vuota', url, timeout=0.05, retries=0)
+    (result, _), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['status'] == 'error'
+
+
+def test_retries_with_backoff_on_server_errors(serve, tmp_path):
+    directory, base = serve(error_rate=1.0)
+    write_feed(directory / 'feed.jsonl', [{'product': 'GI ETF 00000001', 'esg_score': 5}])
+    url = f'{base}/feed.jsonl'
+    fetcher, partner = make_fetcher(tmp_path, url, retries=2, backoff=0.1)
+    (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['status'] == 'error' and result['error'] == 'HTTP 503'
+    # Tre tentativi sulla stessa connessione, con attese di 0.1 e 0.2 secondi
+    assert fetcher.pool.opened == 1 and fetcher.pool.reused == 2
+    assert elapsed >= 0.3
+
+    # Errori non temporanei: nessun nuovo tentativo
+    _, base = serve()
+    url = f'{base}/assente.jsonl'
+    fetcher, partner = make_fetcher(tmp_path, url, retries=2, backoff=0.1)
+    (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['error'] == 'HTTP 404' and elapsed < 0.1
+
+
+def test_unsupported_url_is_not_retried(tmp_path):
+    url = 'ftp://127.0.0.1/feed.jsonl'
+    fetcher, partner = make_fetcher(tmp_path, url, retries=3, backoff=0.5)
+    (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+    assert result['status'] == 'error' and result['error'].startswith('ValueError')
+    assert elapsed < 0.5 and fetcher.pool.opened == 0
+
+
+def test_request_send_is_bounded_by_the_timeout(tmp_path):
+    # Server che accetta le connessioni ma non legge mai: l'invio di una richiesta
+    # grande si blocca quando i buffer del socket sono pieni
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    try:
+        url = f'http://127.0.0.1:{server.getsockname()[1]}/feed.jsonl'
+        fetcher, partner = make_fetcher(tmp_path, url, timeout=0.2, retries=0,
+                                        headers={'X-Filler': 'x' * (32 << 20)})
+        (result, elapsed), = fetch_all(fetcher, partner, url, [lambda: None])
+        assert result['status'] == 'error' and result['error'] == 'TimeoutError'
+        assert elapsed < 2
+    finally:
+        server.close()
+
+
+def test_malformed_feed_does_not_stop_the_refresher(universe, feed_server, tmp_path):
+    directory, base = feed_server
+    records = random_records(universe, 10, seed=4)
+    write_feed(directory / 'good.jsonl', records)
+    # Array JSON troncato: body_records solleva JSONDecodeError
+    (directory / 'bad.jsonl').write_text('[{"product": "GI ETF 00000001", "esg_score": 5', encoding='utf-8')
+
+    partner = Partner('Partner', [f'{base}/bad.jsonl', f'{base}/good.jsonl'], ttl=0, backoff=0.01)
+    fetcher = PartnerFetcher([partner], ResponseCache(str(tmp_path / 'cache')))
+    live = LiveUniverse(universe)
+    refresher = BackgroundRefresher(fetcher, interval=60, on_update=live.ingest).start()
+    try:
+        wait_for(lambda: refresher.snapshot['version'] >= 1)
+        snapshot = refresher.snapshot
+        statuses = {e['url'].rsplit('/', 1)[1]: e for e in snapshot['endpoints']}
+        assert statuses['bad.jsonl']['status'] == 'invalid'
+        assert 'JSONDecodeError' in statuses['bad.jsonl']['error']
+        assert statuses['good.jsonl']['status'] == 'fetched'
+        assert snapshot['error'] is None
+        expected = brute_force(universe, records, default_engine().quantiles(universe))
+        assert_same_rows(live.data, expected)
+
+        # Il thread è ancora attivo: il feed corretto dal partner viene applicato
+        fixed = [{'product': 'GI ETF 00000001', 'esg_score': 5}]
+        write_feed(directory / 'bad.jsonl', fixed)
+        refresher.refresh_now()
+        wait_for(lambda: refresher.snapshot['version'] >= 2)
+        statuses = {e['url'].rsplit('/', 1)[1]: e for e in refresher.snapshot['endpoints']}
+        assert statuses['bad.jsonl']['status'] == 'fetched'
+        assert statuses['good.jsonl']['status'] == 'not_modified'
+        assert_same_rows(live.data, brute_force(universe, records + fixed,
+                                                default_engine().quantiles(universe)))
+    finally:
+        refresher.stop(timeout=5)
@@ -0,0 +1,145 @@
+# Storico delle metriche: indicatori vettoriali confrontati con np.polyfit e pandas,
+# crescita oltre la capacità e riapertura dei file mappati in memoria
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.history import HistoryStore, _slopes, history_indicators, load_history
+
+N_PRODUCTS = 25
+N_DAYS = 160
+
+
+def random_history(seed=0, directory=None, capacity=N_DAYS):
+    rng = np.random.default_rng(seed)
+    products = [f'P{i}' for i in range(N_PRODUCTS)]
+    values = {}
+    for metric, scale in (('esg_score', 100), ('co2_emissions', 1000), ('green_activities', 100)):
+        matrix = (rng.uniform(0, scale, (N_PRODUCTS, 1))
+                  + np.cumsum(rng.normal(0, scale / 50, (N_PRODUCTS, N_DAYS)), axis=1)).astype(np.float32)
+        matrix[rng.random(matrix.shape) < 0.2] = np.nan
+        values[metric] = matrix
+    values['esg_score'][3] = np.nan            # prodotto senza osservazioni
+    values['esg_score'][4, :-1] = np.nan       # una sola osservazione
+    history = HistoryStore.create(directory, products, '2023-01-01', capacity=capacity)
+    history.append_days('2023-01-01', products, values)
+    return history, values
+
+
+# Pendenza della regressione sulle osservazioni valide di una riga (NaN se sono troppo poche)
+def polyfit_slope(row, x, min_periods):
+    valid = ~np.isnan(row)
+    if valid.sum() < max(min_periods, 2):
+        return np.nan
+    return np.polyfit(x[valid], row[valid].astype(np.float64), 1)[0]
+
+
+def test_slopes_match_polyfit():
+    _, values = random_history()
+    block = values['co2_emissions']
+    x = np.arange(N_DAYS, dtype=np.float64) + 10
+    expected = [polyfit_slope(row, x, 5) for row in block]
+    np.testing.assert_allclose(_slopes(block, x, min_periods=5), expected, rtol=1e-6, atol=1e-9)
+
+
+def test_trend_and_rolling_trend_match_polyfit_and_pandas():
+    history, values = random_history()
+    window, min_periods = 60, 20
+    for metric in history.metrics:
+        matrix = values[metric]
+        x = np.arange(window, dtype=np.float64)
+        expected = [polyfit_slope(row[-window:], x, min_periods) for row in matrix]
+        np.testing.assert_allclose(history.trend(metric, window, min_periods=min_periods), expected,
+                                   rtol=1e-4, atol=1e-5)
+
+    positions = np.array([7, 0, 3, 4, 12])
+    rolling = history.rolling_trend('esg_score', positions, window=30, min_periods=8)
+    assert rolling.shape == (len(positions), N_DAYS)
+    for out, pos in zip(rolling, positions):
+        series = pd.Series(values['esg_score'][pos].astype(np.float64))
+        expected = series.rolling(30, min_periods=8).apply(
+            lambda w: polyfit_slope(w, np.arange(len(w), dtype=np.float64), 8), raw=True)
+        np.testing.assert_allclose(out, expected.to_numpy(), rtol=1e-4, atol=1e-5)
+
+
+def test_drawdown_matches_pandas_cummax():
+    history, values = random_history()
+    worst, current = history.drawdown('esg_score')
+    for pos, row in enumerate(values['esg_score']):
+        series = pd.Series(row)
+        drop = series.cummax() - series
+        observed = series.dropna()
+        if observed.empty:
+            assert np.isnan(worst[pos]) and np.isnan(current[pos])
+            continue
+        assert worst[pos] == np.float32(drop.max())
+        assert current[pos] == np.float32(observed.max() - observed.iloc[-1])
+    positions = [9, 2]
+    np.testing.assert_array_equal(history.drawdown('esg_score', positions)[0], worst[positions])
+
+
+def test_sparklines_average_each_interval():
+    history, values = random_history()
+    positions = np.arange(0, N_PRODUCTS, 3)
+    points = 12
+    lines = history.sparklines('green_activities', positions, points=points)
+    edges = np.linspace(0, N_DAYS, points + 1).astype(np.int64)[:-1]
+    bins = np.searchsorted(edges, np.arange(N_DAYS), side='right') - 1
+    frame = pd.DataFrame(values['green_activities'][positions].T.astype(np.float64))
+    expected = frame.groupby(bins).mean().to_numpy().T
+    np.testing.assert_allclose(lines, expected, rtol=1e-5)
+
+    # Serie più corte dei punti richiesti: restituite così come sono
+    short = history.sparklines('green_activities', positions, points=points, days=10)
+    np.testing.assert_array_equal(short, values['green_activities'][positions, -10:])
+
+
+def test_history_indicators_full_and_by_position():
+    history, values = random_history()
+    indicators = history_indicators(history, window=120)
+    assert history_indicators(history, window=120) is indicators
+    assert list(indicators.index) == list(history.products)
+    score = history.trend('esg_score', 120)
+    co2 = history.trend('co2_emissions', 120)
+    np.testing.assert_allclose(indicators['score_trend'], score * 365, rtol=1e-6)
+    np.testing.assert_allclose(indicators['co2_trend'], co2 * 365, rtol=1e-6)
+    np.testing.assert_array_equal(indicators['improved_while_emitting'], (score > 0) & (co2 > 0))
+    np.testing.assert_array_equal(indicators['max_drawdown'], history.drawdown()[0])
+    assert np.isnan(indicators.loc['P3', 'score_trend']) and np.isnan(indicators.loc['P4', 'score_trend'])
+
+    positions = [5, 1, 20]
+    subset = history_indicators(history, window=120, positions=positions)
+    pd.testing.assert_frame_equal(subset, indicators.iloc[positions])
+
+
+def test_growing_past_capacity_and_reopening(tmp_path):
+    directory = str(tmp_path / 'storico')
+    history, values = random_history(directory=directory, capacity=16)
+    # Capacità raddoppiata da 16 fino a coprire i giorni scritti
+    assert history._meta['capacity'] == 256 and history.n_days == N_DAYS
+
+    # Nuovi prodotti (righe in coda al file) e giorni oltre la capacità (nuovo file più largo)
+    new_rows = np.full((2, 1), 42.0, dtype=np.float32)
+    history.append_days('2023-01-01', ['Nuovo A', 'Nuovo B'], {'esg_score': new_rows})
+    late = np.arange(N_PRODUCTS + 2, dtype=np.float32)
+    products = list(history.products)
+    history.append_day(pd.Timestamp('2023-01-01') + pd.Timedelta(days=300), products, {'esg_score': late})
+    history.flush()
+    assert history._meta['capacity'] == 512 and history.n_days == 301
+
+    reopened = load_history(directory)
+    assert reopened is not history and list(reopened.products) == products
+    assert reopened.n_days == 301 and reopened.dates[-1] == pd.Timestamp('2023-10-28')
+    for metric in reopened.metrics:
+        stored = reopened.values(metric)
+        assert isinstance(reopened._arrays[metric], np.memmap)
+        np.testing.assert_array_equal(stored[:N_PRODUCTS, :N_DAYS], values[metric])
+        # Giorni mai scritti e nuovi prodotti senza osservazioni restano NaN
+        assert np.isnan(stored[:, N_DAYS:300]).all()
+        if metric != 'esg_score':
+            assert np.isnan(stored[N_PRODUCTS:]).all() and np.isnan(stored[:, 300]).all()
+    score = reopened.values('esg_score')
+    np.testing.assert_array_equal(score[N_PRODUCTS:, 0], [42.0, 42.0])
+    assert np.isnan(score[N_PRODUCTS:, 1:300]).all()
+    np.testing.assert_array_equal(score[:, 300], late)
+    assert load_history(directory) is reopened
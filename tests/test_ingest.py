@@ -0,0 +1,226 @@
+# Ingestione dei feed (upsert, insert, delete a lotti) confrontata con l'applicazione diretta in pandas
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from greeninvest.aggregation import ScoreStats, score_stats
+from greeninvest.comparator import index_for
+from greeninvest.ingest import PROCESSED_DIR, REJECTED_DIR, FeedPoller, LiveUniverse
+from greeninvest.loader import REQUIRED_COLUMNS, to_columnar
+from greeninvest.rules import DEFAULT_RULES, RuleEngine, default_engine
+
+# Regola sui quantili (opzionale, vedi GREENINVEST_RULES) per verificare le soglie fisse e il loro ricalcolo
+PERCENTILE_RULES = DEFAULT_RULES + [{
+    'name': 'score_top_decile_co2_alta',
+    'conditions': [('esg_score', 'pct>=', 0.9), ('co2_emissions', 'pct>=', 0.75)],
+    'severity': 0.5,
+}]
+
+COLUMNS = ['product', 'esg_score', 'co2_emissions', 'green_activities', 'sector', 'partner',
+           'greenwashing_flag', 'greenwashing_rules']
+
+
+# Applica i record uno alla volta a un dizionario prodotto -> riga e ricalcola i flag
+def brute_force(data, records, quantiles=None, engine=None):
+    rows = {row['product']: row for row in data[COLUMNS[:6]].astype(object).to_dict('records')}
+    for record in records:
+        product, op = record['product'], record.get('op', 'upsert')
+        fields = {k: v for k, v in record.items() if k not in ('op', 'product')}
+        if op == 'delete':
+            rows.pop(product, None)
+        elif product in rows:
+            rows[product].update(fields)
+        elif all(col in fields for col in REQUIRED_COLUMNS if col != 'product'):
+            rows[product] = {'product': product, **fields}
+    frame = pd.DataFrame(list(rows.values()))
+    for col in ('esg_score', 'co2_emissions', 'green_activities'):
+        frame[col] = frame[col].astype(np.float32)
+    (engine or default_engine()).apply(frame, quantiles)
+    return frame
+
+
+def assert_same_rows(actual, expected):
+    actual = actual[COLUMNS].sort_values('product').reset_index(drop=True)
+    expected = expected[COLUMNS].sort_values('product').reset_index(drop=True)
+    assert actual['product'].astype(object).tolist() == expected['product'].tolist()
+    for col in ('esg_score', 'co2_emissions', 'green_activities'):
+        np.testing.assert_allclose(actual[col].to_numpy(dtype=np.float64),
+                                   expected[col].to_numpy(dtype=np.float64), rtol=1e-6)
+    for col in ('sector', 'partner'):
+        assert actual[col].astype(object).tolist() == expected[col].astype(object).tolist()
+    for col in ('greenwashing_flag', 'greenwashing_rules'):
+        np.testing.assert_array_equal(actual[col].to_numpy(), expected[col].to_numpy())
+
+
+# Strutture derivate aggiornate per differenza uguali a quelle ricalcolate da zero
+def assert_consistent(data):
+    index = index_for(data)
+    np.testing.assert_array_equal(index.find(data['product'].tolist()), np.arange(len(data)))
+    stats, fresh = score_stats(data), ScoreStats.from_data(data)
+    np.testing.assert_array_equal(stats.counts, fresh.counts)
+    for by, (counts, sums) in fresh.groups.items():
+        np.testing.assert_array_equal(stats.groups[by][0], counts)
+        np.testing.assert_allclose(stats.groups[by][1], sums)
+
+
+def random_records(universe, n, seed):
+    rng = np.random.default_rng(seed)
+    products = universe['product'].to_numpy(dtype=object)
+    records = []
+    # Un record per prodotto: l'ordine dei record dello stesso prodotto è verificato a parte
+    for i, product in enumerate(products[rng.choice(len(products), n, replace=False)]):
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            records.append({'op': 'delete', 'product': product})
+        elif kind == 1:
+            records.append({'product': f'GI Nuovo {seed}-{i}', 'esg_score': int(rng.integers(0, 101)),
+                            'co2_emissions': float(rng.integers(1, 5000)) / 10,
+                            'green_activities': int(rng.integers(0, 101)), 'sector': 'Energia',
+                            'partner': 'Partner Nuovo'})
+        else:
+            records.append({'op': 'upsert', 'product': product, 'esg_score': int(rng.integers(0, 101)),
+                            'green_activities': int(rng.integers(0, 101))})
+    return records
+
+
+def test_small_batches_keep_fixed_thresholds(universe):
+    size = len(universe)
+    records = random_records(universe, 12, seed=1)
+    # Più upsert dello stesso prodotto si uniscono; una cancellazione successiva vince
+    records += [
+        {'product': 'GI ETF 00000010', 'esg_score': 99},
+        {'product': 'GI ETF 00000010', 'green_activities': 1},
+        {'product': 'GI Bond 00000012', 'esg_score': 10},
+        {'op': 'delete', 'product': 'GI Bond 00000012'},
+    ]
+    rejected = [
+        {'op': 'replace', 'product': 'GI ETF 00000000'},
+        {'product': ''},
+        {'product': 'GI Incompleto', 'esg_score': 50},
+        {'product': 'GI ETF 00000005', 'esg_score': 'n.d.'},
+    ]
+    engine = RuleEngine(PERCENTILE_RULES)
+    start = engine.apply(universe.copy())
+    live = LiveUniverse(start, engine)
+    data = live.ingest(records + rejected, batch_size=5)
+    assert live.counters['batches'] == 4
+    assert live.counters['rejected'] == 4
+    assert_same_rows(data, brute_force(universe, records, engine.quantiles(start), engine))
+    assert_consistent(data)
+    # La versione di partenza non viene modificata
+    assert len(universe) == size and 'GI Incompleto' not in set(universe['product'])
+
+
+def test_large_batch_recomputes_thresholds(universe):
+    records = random_records(universe, 300, seed=2)
+    engine = RuleEngine(PERCENTILE_RULES)
+    live = LiveUniverse(engine.apply(universe.copy()), engine)
+    data = live.ingest(records)
+    assert_same_rows(data, brute_force(universe, records, engine=engine))
+    assert_consistent(data)
+
+
+def test_poller_applies_deposited_files(universe, tmp_path):
+    records = random_records(universe, 10, seed=3)
+    with open(tmp_path / 'feed.jsonl', 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+    live = LiveUniverse(universe)
+    poller = FeedPoller(str(tmp_path), interval=0.05).start().attach(live)
+    try:
+        deadline = time.time() + 10
+        while not os.path.exists(tmp_path / PROCESSED_DIR / 'feed.jsonl') and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        poller.stop(timeout=5)
+    assert poller.error is None
+    assert_same_rows(live.data, brute_force(universe, records, default_engine().quantiles(universe)))
+
+
+def test_deleted_product_can_be_reinserted_and_updated(universe):
+    # Come negli universi caricati da file: i nomi dei prodotti sono categorici
+    universe = to_columnar(universe)
+    product = universe['product'].iloc[3]
+    fields = {'esg_score': 40, 'co2_emissions': 12.5, 'green_activities': 20,
+              'sector': 'Energia', 'partner': 'Partner Nuovo'}
+    live = LiveUniverse(universe)
+    data = live.ingest([{'op': 'delete', 'product': product}])
+    # La categoria del prodotto cancellato resta, ma il prodotto non è più nell'indice
+    index = index_for(data)
+    assert product not in index and index.find([product])[0] == -1
+    with pytest.raises(KeyError):
+        index.position(product)
+    assert product not in index.search(product)
+    assert len(index) == len(data)
+
+    records = [{'product': product, **fields}]
+    live.ingest(records)
+    records.append({'product': product, 'esg_score': 95})
+    data = live.ingest(records[-1:])
+    assert (data['product'] == product).sum() == 1
+    assert data['esg_score'].iloc[index_for(data).position(product)] == 95
+    expected = brute_force(universe, [{'op': 'delete', 'product': product}] + records,
+                           default_engine().quantiles(universe))
+    assert_same_rows(data, expected)
+    assert_consistent(data)
+
+
+def test_bool_columns_stay_bool(universe):
+    data = universe[list(REQUIRED_COLUMNS)].iloc[:50].copy()
+    data['sfdr_art9'] = np.arange(50) % 2 == 0
+    live = LiveUniverse(to_columnar(data))
+    products = data['product'].tolist()
+    updated = live.ingest([
+        {'product': products[0], 'sfdr_art9': False},
+        {'product': products[1], 'sfdr_art9': 'true'},
+        {'product': products[3], 'sfdr_art9': 1},
+        {'product': products[5], 'sfdr_art9': 'forse'},
+        {'product': 'GI Nuovo bool', 'esg_score': 60, 'co2_emissions': 5.0, 'green_activities': 10,
+         'sfdr_art9': 'sì'},
+        {'product': 'GI Nuovo senza campo', 'esg_score': 60, 'co2_emissions': 5.0, 'green_activities': 10},
+    ])
+    assert updated['sfdr_art9'].dtype == bool
+    assert live.counters['rejected'] == 1
+    values = dict(zip(updated['product'].astype(object), updated['sfdr_art9']))
+    assert [values[p] for p in products[:6]] == [False, True, True, True, True, False]
+    assert values['GI Nuovo bool'] and not values['GI Nuovo senza campo']
+
+
+def test_poller_rejects_unreadable_files_and_keeps_polling(universe, tmp_path):
+    records = random_records(universe, 10, seed=5)
+    # Byte non UTF-8 in un file JSON Lines e CSV in Latin-1: nessuno dei due va applicato
+    with open(tmp_path / 'a.jsonl', 'wb') as f:
+        f.write(json.dumps({'product': 'GI ETF 00000001', 'esg_score': 1}).encode('utf-8') + b'\n')
+        f.write(b'\xff\xfe\n')
+    with open(tmp_path / 'b.csv', 'w', encoding='latin-1') as f:
+        f.write('product,esg_score,sector\nGI ETF 00000002,3,Sanità\n')
+    with open(tmp_path / 'c.jsonl', 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+    live = LiveUniverse(universe)
+    poller = FeedPoller(str(tmp_path), interval=0.05).start().attach(live)
+    try:
+        deadline = time.time() + 10
+        while not os.path.exists(tmp_path / PROCESSED_DIR / 'c.jsonl') and time.time() < deadline:
+            time.sleep(0.01)
+        assert sorted(os.listdir(tmp_path / REJECTED_DIR)) == ['a.jsonl', 'b.csv']
+        assert [name for name, _ in poller.rejected] == ['a.jsonl', 'b.csv']
+        assert 'UnicodeDecodeError' in poller.rejected[0][1]
+        assert poller.error is not None
+
+        # Il thread continua a controllare la cartella
+        later = [{'product': 'GI ETF 00000003', 'esg_score': 7}]
+        with open(tmp_path / 'd.jsonl', 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + '\n' for record in later)
+        poller.poll_now()
+        while not os.path.exists(tmp_path / PROCESSED_DIR / 'd.jsonl') and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+    finally:
+        poller.stop(timeout=5)
+    assert poller.error is None
+    assert_same_rows(live.data, brute_force(universe, records + later,
+                                            default_engine().quantiles(universe)))
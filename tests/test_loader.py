@@ -0,0 +1,57 @@
+# Cache degli universi caricati da file: letture concorrenti di file diversi e dello stesso file
+
+import threading
+
+import numpy as np
+
+from greeninvest import loader
+from greeninvest.loader import REQUIRED_COLUMNS, clear_cache, load_universe
+
+
+def write_universes(universe, tmp_path, n_files):
+    paths = []
+    for i in range(n_files):
+        path = tmp_path / f'universo_{i}.csv'
+        universe[list(REQUIRED_COLUMNS)].iloc[i * 100:(i + 1) * 100].to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+def test_slow_read_does_not_block_other_files(universe, tmp_path, monkeypatch):
+    slow, fast = write_universes(universe, tmp_path, 2)
+    started, release = threading.Event(), threading.Event()
+    read_table = loader.read_table
+    reads = []
+
+    def blocking_read(path, **options):
+        reads.append(path)
+        if path == slow:
+            started.set()
+            assert release.wait(10)
+        return read_table(path, **options)
+
+    monkeypatch.setattr(loader, 'read_table', blocking_read)
+    try:
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.setdefault(i, load_universe(slow)))
+                   for i in range(3)]
+        threads[0].start()
+        assert started.wait(10)
+        for thread in threads[1:]:
+            thread.start()
+
+        # Mentre il primo file è in lettura, un altro file si carica (e si trova in cache)
+        data = load_universe(fast)
+        assert load_universe(fast) is data and len(data) == 100
+        assert threads[0].is_alive()
+
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        # Le letture concorrenti dello stesso file attendono la prima e ne riusano il risultato
+        assert reads.count(slow) == 1 and reads.count(fast) == 1
+        assert results[0] is results[1] is results[2]
+        np.testing.assert_array_equal(results[0]['esg_score'], universe['esg_score'].iloc[:100])
+    finally:
+        release.set()
+        clear_cache()
@@ -0,0 +1,66 @@
+# Look-through: universo aggiornato solo nei fondi cambiati confrontato con il ricalcolo completo
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.aggregation import ScoreStats, score_stats
+from greeninvest.comparator import index_for
+from greeninvest.loader import to_columnar
+from greeninvest.lookthrough import ISSUER_METRICS, LookThroughEngine, lookthrough_universe
+
+N_FUNDS = 60
+N_ISSUERS = 300
+
+
+def make_engine(universe, seed=0):
+    rng = np.random.default_rng(seed)
+    issuers = pd.DataFrame({'issuer': [f'Emittente {i}' for i in range(N_ISSUERS)]})
+    for metric in ISSUER_METRICS:
+        values = rng.uniform(0, 100, N_ISSUERS)
+        values[rng.random(N_ISSUERS) < 0.05] = np.nan
+        issuers[metric] = values
+    funds = universe['product'].astype(object).iloc[:N_FUNDS].tolist()
+    rows = []
+    for i, fund in enumerate(funds):
+        for issuer in rng.choice(N_ISSUERS, 8, replace=False):
+            rows.append((fund, f'Emittente {issuer}', rng.uniform(0.01, 0.2)))
+        # Fondi di fondi: solo verso fondi successivi (gerarchia aciclica)
+        if i < N_FUNDS - 1 and i % 4 == 0:
+            rows.append((fund, funds[int(rng.integers(i + 1, N_FUNDS))], 0.3))
+    constituents = pd.DataFrame(rows, columns=['fund', 'holding', 'weight'])
+    return LookThroughEngine(issuers, constituents), issuers
+
+
+def test_issuer_updates_patch_only_affected_funds(universe):
+    data = to_columnar(universe)
+    engine, issuers = make_engine(data)
+    before = lookthrough_universe(data, engine)
+    assert lookthrough_universe(data, engine) is before
+
+    rng = np.random.default_rng(1)
+    for step in range(3):
+        updates = issuers.iloc[rng.choice(N_ISSUERS, 5, replace=False)][['issuer', 'esg_score']].copy()
+        updates['esg_score'] = 95.0 if step % 2 == 0 else np.nan
+        engine.update_issuers(updates)
+    patched = lookthrough_universe(data, engine)
+    expected = engine.apply_to_universe(data)
+
+    assert patched is not before
+    assert patched['product'].astype(object).tolist() == expected['product'].astype(object).tolist()
+    for col in ('esg_score', 'co2_emissions', 'green_activities'):
+        np.testing.assert_allclose(patched[col].to_numpy(dtype=np.float64),
+                                   expected[col].to_numpy(dtype=np.float64), rtol=1e-6)
+    for col in ('greenwashing_flag', 'greenwashing_rules'):
+        np.testing.assert_array_equal(patched[col].to_numpy(), expected[col].to_numpy())
+
+    # Strutture derivate aggiornate per differenza uguali a quelle ricalcolate
+    np.testing.assert_array_equal(index_for(patched).co2_emissions,
+                                  expected['co2_emissions'].to_numpy(dtype=np.float32))
+    np.testing.assert_array_equal(score_stats(patched).counts, ScoreStats.from_data(patched).counts)
+
+    # Dopo un ricalcolo completo l'universo viene ricostruito
+    engine.recompute()
+    rebuilt = lookthrough_universe(data, engine)
+    assert rebuilt is not patched
+    np.testing.assert_allclose(rebuilt['esg_score'].to_numpy(dtype=np.float64),
+                               expected['esg_score'].to_numpy(dtype=np.float64), rtol=1e-6)
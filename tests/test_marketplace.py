@@ -0,0 +1,93 @@
+# Ricerca nel catalogo del marketplace e nell'indice prodotti, confrontata con la forza bruta
+
+import numpy as np
+import pytest
+
+from greeninvest.comparator import index_for
+from greeninvest.marketplace import (MIN_PREFIX, SORT_INVESTMENT, SORT_RETURN, Catalog,
+                                     tokenize)
+from greeninvest.synthetic import generate_listings
+
+
+# Offerte che soddisfano i filtri (token in AND, l'ultimo anche come prefisso)
+def brute_force(listings, text='', partners=None, max_investment=None, return_range=None):
+    tokens = list(dict.fromkeys(tokenize(text)))
+    found = []
+    for listing in listings:
+        words = set(tokenize(f"{listing['name']} {listing['partner']} {listing['impact']}"))
+        ok = all(token in words for token in tokens[:-1])
+        if tokens:
+            last = tokens[-1]
+            ok = ok and (last in words or (len(last) >= MIN_PREFIX and any(w.startswith(last) for w in words)))
+        if partners and listing['partner'] not in partners:
+            ok = False
+        if max_investment is not None and listing['min_investment'] > max_investment:
+            ok = False
+        if return_range is not None and not return_range[0] <= listing['expected_return'] <= return_range[1]:
+            ok = False
+        if ok:
+            found.append(listing)
+    return found
+
+
+def listing_ids(listings):
+    return sorted(f"{listing['partner']}/{listing['name']}" for listing in listings)
+
+
+QUERIES = [
+    {'text': 'solar'},
+    {'text': 'sol'},
+    {'text': 'green bond'},
+    {'text': 'wind etf', 'max_investment': 5000},
+    {'text': 'acqua', 'return_range': (2.0, 4.0)},
+    {'partners': ['Coop', 'Clarity AI'], 'return_range': (3.0, 9.0)},
+    {'max_investment': 1000},
+    {'text': 'nessuna corrispondenza'},
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_matches_brute_force(query):
+    listings = generate_listings(3000, seed=3)
+    catalog = Catalog.from_records(listings)
+    expected = brute_force(listings, **query)
+    page, total = catalog.search(**query, page_size=len(listings))
+    assert total == len(expected)
+    assert listing_ids(page) == listing_ids(expected)
+
+
+def test_sorted_pages_follow_the_field_order():
+    listings = generate_listings(1000, seed=4)
+    catalog = Catalog.from_records(listings)
+    pages = [catalog.search(sort=SORT_RETURN, page=page, page_size=100)[0] for page in range(1, 11)]
+    returns = [listing['expected_return'] for page in pages for listing in page]
+    assert returns == sorted((listing['expected_return'] for listing in listings), reverse=True)
+    cheapest, _ = catalog.search(sort=SORT_INVESTMENT, page_size=10)
+    assert [listing['min_investment'] for listing in cheapest] == \
+        sorted(listing['min_investment'] for listing in listings)[:10]
+
+
+def test_search_after_removals_and_replacements():
+    listings = generate_listings(2500, seed=5)
+    catalog = Catalog.from_records(listings)
+    catalog.search(sort=SORT_RETURN)
+    rng = np.random.default_rng(0)
+    removed = set(rng.choice(len(listings), 1500, replace=False).tolist())
+    for i in removed:
+        assert catalog.remove(f"{listings[i]['partner']}/{listings[i]['name']}")
+    kept = [listing for i, listing in enumerate(listings) if i not in removed]
+    kept[0] = {**kept[0], 'impact': 'Torbiere alpine', 'expected_return': 8.5}
+    catalog.add(kept[0])
+    for query in QUERIES + [{'text': 'torbiere'}]:
+        page, total = catalog.search(**query, page_size=len(listings))
+        assert listing_ids(page) == listing_ids(brute_force(kept, **query))
+    assert catalog.search(sort=SORT_RETURN, page_size=1)[0][0]['impact'] == 'Torbiere alpine'
+
+
+def test_product_search_matches_brute_force(universe):
+    index = index_for(universe)
+    names = universe['product'].astype(object).tolist()
+    for text in ('gi etf 0000001', 'GI Bond', 'gi fondo 00001', 'zz'):
+        expected = sorted((name for name in names if name.lower().startswith(text.lower())), key=str.lower)
+        assert index.search(text, limit=len(names)) == expected
+        assert index.search(text, limit=5) == expected[:5]
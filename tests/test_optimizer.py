@@ -0,0 +1,90 @@
+# Ottimizzatore per generazione di colonne contro linprog sull'intero universo
+
+import itertools
+
+import numpy as np
+import pytest
+from scipy.optimize import linprog
+
+from greeninvest.optimizer import optimize, optimize_batch, problem_arrays
+
+
+# Stesso problema risolto direttamente con tutti i prodotti ammessi
+def brute_force(arrays, constraints):
+    eligible = np.isfinite(arrays['esg_score']) & np.isfinite(arrays['co2_emissions']) & \
+        np.isfinite(arrays['green_activities'])
+    if constraints['exclude_greenwashing']:
+        eligible &= ~arrays['greenwashing_flag']
+    rows, bounds = [], []
+    if constraints['co2_budget'] is not None:
+        rows.append(arrays['co2_emissions'][eligible])
+        bounds.append(constraints['co2_budget'])
+    if constraints['min_green'] is not None:
+        rows.append(-arrays['green_activities'][eligible])
+        bounds.append(-constraints['min_green'])
+    n = int(eligible.sum())
+    return linprog(-arrays['esg_score'][eligible], A_ub=np.array(rows) if rows else None,
+                   b_ub=bounds or None, A_eq=np.ones((1, n)), b_eq=[1],
+                   bounds=(0, constraints['max_weight']), method='highs')
+
+
+def constraint_grid(arrays):
+    co2 = np.nanpercentile(arrays['co2_emissions'], [0.5, 3, 20, 50])
+    green = np.nanpercentile(arrays['green_activities'], [50, 80, 97])
+    return [
+        {'co2_budget': budget, 'min_green': min_green, 'max_weight': max_weight,
+         'exclude_greenwashing': exclude}
+        for budget, min_green, max_weight, exclude in itertools.product(
+            [None, *co2], [None, *green], [0.02, 0.2], [True, False])
+    ]
+
+
+def test_matches_full_linprog(universe):
+    arrays = problem_arrays(universe)
+    statuses = set()
+    for constraints in constraint_grid(arrays):
+        result = optimize(arrays, constraints)
+        reference = brute_force(arrays, constraints)
+        statuses.add(result['status'])
+        if reference.status == 2:
+            assert result['status'] == 'infeasible', constraints
+            continue
+        assert result['status'] == 'optimal', constraints
+        assert result['esg_score'] == pytest.approx(-reference.fun, rel=1e-7)
+
+        # La soluzione rispetta tutti i vincoli
+        weights, positions = result['weights'], result['positions']
+        assert weights.sum() == pytest.approx(1)
+        assert weights.max() <= constraints['max_weight'] + 1e-9
+        if constraints['co2_budget'] is not None:
+            assert result['co2_emissions'] <= constraints['co2_budget'] + 1e-6
+        if constraints['min_green'] is not None:
+            assert result['green_activities'] >= constraints['min_green'] - 1e-6
+        if constraints['exclude_greenwashing']:
+            assert not arrays['greenwashing_flag'][positions].any()
+    assert statuses == {'optimal', 'infeasible'}
+
+
+def test_warm_start_from_another_version(universe):
+    arrays = problem_arrays(universe)
+    constraints = {'co2_budget': float(np.nanpercentile(arrays['co2_emissions'], 20)), 'min_green': 40.0,
+                   'max_weight': 0.05, 'exclude_greenwashing': True}
+    cold = optimize(arrays, constraints)
+    # Posizioni di una versione precedente: alcune fuori dall'universo attuale
+    warm_start = np.concatenate([cold['positions'], [-1, len(universe) + 5]])
+    warm = optimize(arrays, constraints, warm_start)
+    assert warm['status'] == 'optimal'
+    assert warm['esg_score'] == pytest.approx(cold['esg_score'], rel=1e-7)
+    assert warm['iterations'] <= cold['iterations']
+
+
+def test_batch_matches_single_runs(universe):
+    arrays = problem_arrays(universe)
+    constraint_sets = [{**constraints, 'client': f'Cliente {i}'}
+                       for i, constraints in enumerate(constraint_grid(arrays)[::7])]
+    results = optimize_batch(universe, constraint_sets, max_workers=1)
+    for constraints, result in zip(constraint_sets, results):
+        single = optimize(arrays, constraints)
+        assert result['client'] == constraints['client']
+        assert result['status'] == single['status']
+        np.testing.assert_array_equal(result['positions'], single['positions'])
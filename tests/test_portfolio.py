@@ -0,0 +1,78 @@
+# Portafogli: modifiche puntuali (somme per cliente e CSR aggiornate per differenza)
+# confrontate con W @ P ricalcolato da zero su una matrice densa
+
+import numpy as np
+import pandas as pd
+
+from greeninvest.portfolio import CO2_INVESTMENT_UNIT, PortfolioBook, product_matrix
+
+
+def assert_matches_dense(book, dense, clients, products):
+    value = dense.sum(axis=1)
+    sums = dense @ products
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted = np.where(value[:, None] > 0, sums / value[:, None], np.nan)
+    metrics = book.metrics()
+    assert metrics['client'].tolist() == clients
+    np.testing.assert_allclose(metrics['value'], value, rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(metrics['co2_financed'], sums[:, 1] / CO2_INVESTMENT_UNIT, rtol=1e-9, atol=1e-9)
+    for col, j in (('esg_score', 0), ('green_share', 2), ('greenwashing_exposure', 3)):
+        np.testing.assert_allclose(metrics[col], weighted[:, j], rtol=1e-7, atol=1e-7)
+
+
+def test_set_holding_matches_dense_recomputation(universe):
+    rng = np.random.default_rng(11)
+    products = universe['product'].tolist()
+    n_clients = 40
+    clients = [f'C{i}' for i in range(n_clients)]
+    records = [(clients[rng.integers(n_clients)], products[rng.integers(len(products))],
+                float(rng.uniform(1e3, 1e6))) for _ in range(600)]
+    book = PortfolioBook.from_records(universe, records)
+    matrix = product_matrix(universe)
+    clients = list(book.clients)  # ordine di prima comparsa nei record
+    n_clients = len(clients)
+
+    dense = np.zeros((n_clients, len(products)))
+    for client, product, amount in records:
+        dense[clients.index(client), products.index(product)] += amount
+    assert_matches_dense(book, dense, clients, matrix)
+
+    held = list(zip(*np.nonzero(dense)))
+    for step in range(400):
+        kind = rng.integers(4)
+        if kind == 0:
+            # Posizione casuale (nuova o esistente)
+            row, col = rng.integers(len(clients)), rng.integers(len(products))
+            amount = float(rng.uniform(0, 1e6))
+        elif kind == 1:
+            # Azzeramento di una posizione esistente
+            row, col = held[rng.integers(len(held))]
+            amount = 0.0
+        elif kind == 2:
+            # Sovrascritture ripetute della stessa posizione prima del flush
+            row, col = held[rng.integers(len(held))]
+            book.set_holding(clients[row], products[col], float(rng.uniform(0, 1e6)))
+            amount = float(rng.uniform(0, 1e6))
+        else:
+            # Cliente nuovo
+            clients.append(f'Nuovo {step}')
+            dense = np.vstack([dense, np.zeros((1, len(products)))])
+            row, col = len(clients) - 1, rng.integers(len(products))
+            amount = float(rng.uniform(1e3, 1e6))
+        book.set_holding(clients[row], products[col], amount)
+        dense[row, col] = amount
+
+        if step % 50 == 49:
+            assert_matches_dense(book, dense, clients, matrix)
+            # Il flush applica le modifiche alla CSR senza lasciare zeri espliciti
+            csr = book.matrix
+            assert csr.has_canonical_format and not (csr.data == 0).any()
+            np.testing.assert_allclose(csr.toarray(), dense, rtol=1e-12)
+
+    assert_matches_dense(book, dense, clients, matrix)
+    book.recompute()
+    assert_matches_dense(book, dense, clients, matrix)
+
+    subset = [clients[3], clients[-1]]
+    pd.testing.assert_frame_equal(book.metrics(subset),
+                                  book.metrics().set_index('client').loc[subset].reset_index())
@@ -0,0 +1,45 @@
+# Classifiche delle raccomandazioni (calcolo in batch e riporto dopo i feed) contro la forza bruta
+
+import numpy as np
+
+from greeninvest import recommendations
+from greeninvest.ingest import LiveUniverse
+from greeninvest.recommendations import BUCKETS, TOP_N, bucket_weights, features, precompute, recommend
+
+
+# Primi n prodotti di una fascia ricalcolando il punteggio di tutto l'universo
+def brute_force(data, bucket, n=TOP_N):
+    scores = features(data) @ bucket_weights(bucket)
+    products = data['product'].to_numpy(dtype=object)
+    return list(products[np.lexsort((products, -scores))[:n]])
+
+
+def test_precomputed_rankings_match_brute_force(universe):
+    rankings = precompute(universe)
+    for bucket in BUCKETS:
+        assert rankings[bucket].top() == brute_force(universe, bucket)
+        assert recommend(universe, bucket) == brute_force(universe, bucket)
+
+
+def test_rankings_carried_over_feed_batches(universe):
+    precompute(universe)
+    first, second = BUCKETS[0], BUCKETS[-1]
+    leaders = brute_force(universe, first, 3)
+    records = [{'op': 'upsert', 'product': product, 'esg_score': 0, 'green_activities': 0}
+               for product in leaders]
+    records.append({'op': 'delete', 'product': brute_force(universe, second, 1)[0]})
+    records.append({'op': 'upsert', 'product': universe['product'].iloc[1234],
+                    'esg_score': 100, 'green_activities': 100, 'co2_emissions': 0.5})
+    records.append({'op': 'upsert', 'product': 'GI Test 00000001', 'esg_score': 99,
+                    'co2_emissions': 1.0, 'green_activities': 95, 'sector': 'Energia',
+                    'partner': 'Coop'})
+
+    live = LiveUniverse(universe)
+    data = live.ingest(records)
+    assert live.counters['batches'] == 1
+    for bucket in BUCKETS:
+        # Ogni classifica è stata riportata sulla nuova versione, senza ricalcolo
+        assert recommendations._rankings.peek(data, ('recommendations', bucket)) is not None
+        assert recommend(data, bucket) == brute_force(data, bucket)
+    assert not set(leaders) & set(recommend(data, first))
+    assert set(recommend(data, first)[:2]) == {'GI Test 00000001', universe['product'].iloc[1234]}
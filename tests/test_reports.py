@@ -0,0 +1,136 @@
+# Report XLSX e PDF scritti a mano: struttura del pacchetto OOXML e tabella xref del PDF
+
+import io
+import math
+import re
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+import numpy as np
+
+from greeninvest.reports import comparison_reports, render_pdf, render_xlsx
+
+NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'ct': 'http://schemas.openxmlformats.org/package/2006/content-types',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+}
+
+TRICKY = 'A<b> & "c" \'d\' \x01 (e) \\ f ₂ – €'
+
+
+def tricky_report(n_rows=300):
+    rows = [(f'Prodotto {i}', i, i / 3, np.float32(i / 7), np.int64(i), i % 2 == 0,
+             None if i % 5 == 0 else TRICKY, math.nan if i % 4 == 0 else 1.5)
+            for i in range(n_rows)]
+    columns = ['Nome', 'Intero', 'Decimale', 'float32', 'int64', 'Flag', 'Testo', 'NaN']
+    return {
+        'name': 'prova',
+        'title': f'Titolo {TRICKY}',
+        'notes': [TRICKY, 'Nota semplice'],
+        'tables': [
+            ('Valori', columns, rows),
+            ('VALORI', ['a'], [(1,)]),
+            ('Riepilogo', ['b'], [(2,)]),
+            ('Un titolo di tabella molto lungo: oltre 31 caratteri A', ['c'], [(3,)]),
+            ('Un titolo di tabella molto lungo: oltre 31 caratteri B', ['c'], [(4,)]),
+            ("'Citato'", ['d'], [(5,)]),
+        ],
+    }
+
+
+def sheet_cells(root):
+    cells = {}
+    for cell in root.iter(f'{{{NS["main"]}}}c'):
+        value = cell.find('main:v', NS)
+        text = cell.find('main:is/main:t', NS)
+        cells[cell.get('r')] = value.text if value is not None else text.text
+    return cells
+
+
+def test_xlsx_parts_are_well_formed_and_linked():
+    report = tricky_report()
+    archive = zipfile.ZipFile(io.BytesIO(render_xlsx(report)))
+    assert archive.testzip() is None
+    parts = {name: ElementTree.fromstring(archive.read(name)) for name in archive.namelist()}
+
+    # Ogni parte XML ha un content type (estensione o override), ogni foglio ha il suo override
+    types = parts['[Content_Types].xml']
+    defaults = {d.get('Extension') for d in types.findall('ct:Default', NS)}
+    overrides = {o.get('PartName').lstrip('/') for o in types.findall('ct:Override', NS)}
+    assert all(name in overrides or name.rsplit('.', 1)[1] in defaults for name in parts)
+    assert overrides <= set(parts)
+
+    # Le relazioni puntano a parti esistenti
+    root_rels = parts['_rels/.rels'].findall('rel:Relationship', NS)
+    assert [r.get('Target') for r in root_rels] == ['xl/workbook.xml']
+    rels = {r.get('Id'): 'xl/' + r.get('Target')
+            for r in parts['xl/_rels/workbook.xml.rels'].findall('rel:Relationship', NS)}
+    sheets = parts['xl/workbook.xml'].findall('main:sheets/main:sheet', NS)
+    assert len(sheets) == len(report['tables']) + 1 == len(rels)
+    targets = [rels[s.get(f'{{{NS["r"]}}}id')] for s in sheets]
+    assert all(target in parts for target in targets)
+
+    # Nomi validi per Excel: univoci senza distinguere le maiuscole, al più 31 caratteri
+    names = [s.get('name') for s in sheets]
+    assert len({name.casefold() for name in names}) == len(names)
+    assert all(0 < len(name) <= 31 and not name.startswith("'") and not name.endswith("'")
+               for name in names)
+    assert names[:3] == ['Riepilogo', 'Valori', 'VALORI (2)'] and names[3] == 'Riepilogo (2)'
+
+    # Valori: stringhe con escape, numeri, booleani; None e NaN lasciano la cella vuota
+    summary = sheet_cells(parts[targets[0]])
+    assert summary['A1'] == 'Titolo ' + TRICKY.replace('\x01', '')
+    values = sheet_cells(parts[targets[1]])
+    assert values['A1'] == 'Nome' and values['H1'] == 'NaN'
+    assert values['A2'] == 'Prodotto 0' and values['F2'] == 'Sì' and values['F3'] == 'No'
+    assert float(values['C5']) == 1.0 and float(values['D9']) == float(np.float32(1.0))
+    assert values['E301'] == '299'
+    assert 'G2' not in values and values['G3'] == TRICKY.replace('\x01', '')
+    assert 'H2' not in values and values['H3'] == '1.5'
+
+
+def test_pdf_xref_offsets_and_page_count():
+    report = tricky_report()
+    pdf = render_pdf(report)
+    assert pdf.startswith(b'%PDF-1.4\n') and pdf.endswith(b'%%EOF\n')
+
+    startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', pdf).group(1))
+    assert pdf[startxref:].startswith(b'xref\n')
+    header = re.match(rb'xref\n0 (\d+)\n', pdf[startxref:])
+    size = int(header.group(1))
+    entries = pdf[startxref + header.end():].split(b'trailer')[0].splitlines()
+    assert len(entries) == size and entries[0] == b'0000000000 65535 f '
+    for number, entry in enumerate(entries[1:], start=1):
+        # Ogni voce è lunga 20 byte (fine riga compresa) e punta all'inizio del suo oggetto
+        assert len(entry) + 1 == 20 and entry.endswith(b' 00000 n ')
+        assert pdf[int(entry[:10]):].startswith(b'%d 0 obj\n' % number)
+    assert re.search(rb'/Size %d /Root 1 0 R' % size, pdf)
+
+    objects = dict(re.findall(rb'(?ms)^(\d+) 0 obj\n(.*?)\nendobj\n', pdf))
+    pages = [n for n, body in objects.items() if body.startswith(b'<< /Type /Page ')]
+    kids = re.search(rb'/Kids \[([^\]]*)\] /Count (\d+)', objects[b'2'])
+    assert int(kids.group(2)) == len(pages) > 1
+    assert sorted(re.findall(rb'(\d+) 0 R', kids.group(1))) == sorted(pages)
+
+    # Contenuti compressi leggibili, testo in WinAnsi con parentesi e barre protette
+    text = b''
+    for body in objects.values():
+        stream = re.match(rb'<< /Length (\d+) /Filter /FlateDecode >>\nstream\n', body)
+        if stream:
+            data = body[stream.end():stream.end() + int(stream.group(1))]
+            assert body[stream.end() + len(data):] == b'\nendstream'
+            text += zlib.decompress(data)
+    assert b'Titolo A<b> & "c" \'d\' \x01 \\(e\\) \\\\ f 2 - \x80' in text
+    assert b'Prodotto 299' in text
+
+
+def test_comparison_reports_render(universe):
+    products = universe['product'].iloc[:3].tolist()
+    for report in comparison_reports(universe, [products, products[:1]]):
+        archive = zipfile.ZipFile(io.BytesIO(render_xlsx(report)))
+        for name in archive.namelist():
+            ElementTree.fromstring(archive.read(name))
+        assert render_pdf(report).count(b'/Type /Page ') >= 1
@@ -0,0 +1,121 @@
+# Motore di regole del greenwashing: condizioni, severità, bitmap e riuso delle maschere
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from greeninvest.ingest import LiveUniverse
+from greeninvest.loader import to_columnar
+from greeninvest.rules import (DEFAULT_RULES, GREENWASHING_MAX_GREEN, GREENWASHING_MIN_SCORE, RuleEngine,
+                               column_versions)
+
+RULES = DEFAULT_RULES + [
+    {'name': 'co2_per_punto', 'conditions': [('co2_emissions/esg_score', '>', 5.0)], 'severity': 0.25},
+    {'name': 'top_decile_co2_alta', 'conditions': [('esg_score', 'pct>=', 0.9), ('co2_emissions', 'pct>=', 0.75)],
+     'severity': 0.5},
+    {'name': 'verde_non_zero', 'conditions': [('green_activities', '!=', 0)]},
+]
+
+
+def frame(n=5000, seed=3):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'product': [f'P{i}' for i in range(n)],
+        'esg_score': rng.integers(0, 101, n).astype(np.int16),
+        'co2_emissions': rng.uniform(0, 1000, n).astype(np.float32),
+        'green_activities': rng.integers(0, 101, n).astype(np.int16),
+    })
+
+
+def test_default_rules_match_the_historical_flag(universe):
+    result = RuleEngine().evaluate(universe)
+    expected = ((universe['esg_score'] > GREENWASHING_MIN_SCORE)
+                & (universe['green_activities'] < GREENWASHING_MAX_GREEN)).to_numpy()
+    assert expected.any()
+    np.testing.assert_array_equal(result.flags, expected)
+    np.testing.assert_array_equal(universe['greenwashing_flag'].to_numpy(), expected)
+    np.testing.assert_array_equal(result.codes, expected.astype(np.uint64))
+
+
+def test_conditions_severity_codes_and_bitmaps():
+    data = frame()
+    data.loc[:9, 'esg_score'] = 0  # rapporto con divisione per zero: inf o NaN, nessun errore
+    result = RuleEngine(RULES).evaluate(data)
+    score = data['esg_score'].to_numpy(dtype=np.float64)
+    co2 = data['co2_emissions'].to_numpy(dtype=np.float64)
+    green = data['green_activities'].to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = co2 / score > 5.0
+    expected = np.array([
+        (score > GREENWASHING_MIN_SCORE) & (green < GREENWASHING_MAX_GREEN),
+        ratio,
+        (score >= np.quantile(score, 0.9)) & (co2 >= np.quantile(co2.astype(np.float32), 0.75)),
+        green != 0,
+    ])
+    assert all(row.any() and not row.all() for row in expected)
+    np.testing.assert_array_equal(result.masks, expected)
+    for i, rule in enumerate(RULES):
+        np.testing.assert_array_equal(result.hits(rule['name']), expected[i])
+
+    np.testing.assert_array_equal(result.flags, expected.any(axis=0))
+    np.testing.assert_allclose(result.severity, np.array([1.0, 0.25, 0.5, 1.0]) @ expected)
+    codes = sum(expected[i].astype(np.uint64) << np.uint64(i) for i in range(len(RULES)))
+    np.testing.assert_array_equal(result.codes, codes)
+    for name, bitmap in result.bitmaps().items():
+        unpacked = np.unpackbits(bitmap)[:len(data)].astype(bool)
+        np.testing.assert_array_equal(unpacked, result.hits(name))
+
+    engine = RuleEngine(RULES)
+    assert engine.messages(codes[np.flatnonzero(codes == 0b1011)[0]]) == [
+        engine.rules[0].message, engine.rules[1].message, engine.rules[3].message]
+
+
+def test_fixed_quantiles_are_used_as_given():
+    data = frame()
+    engine = RuleEngine(RULES)
+    quantiles = engine.quantiles(data)
+    # Soglie calcolate sull'intero universo e applicate a un blocco di righe
+    block = data.iloc[:100]
+    np.testing.assert_array_equal(engine.evaluate(block, quantiles).masks,
+                                  engine.evaluate(data, quantiles).masks[:, :100])
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        RuleEngine([{'name': 'vuota', 'conditions': []}])
+    with pytest.raises(ValueError):
+        RuleEngine([{'name': 'op', 'conditions': [('esg_score', '=>', 1)]}])
+    with pytest.raises(ValueError):
+        RuleEngine([{'name': 'q', 'conditions': [('esg_score', 'pct>', 1.5)]}])
+    with pytest.raises(ValueError):
+        RuleEngine([DEFAULT_RULES[0], DEFAULT_RULES[0]])
+
+
+def test_unchanged_columns_skip_evaluation():
+    engine = RuleEngine(RULES)
+    data = to_columnar(frame(), engine)
+    first = data['greenwashing_rules'].to_numpy().copy()
+    assert column_versions(data)
+    engine.apply(data)
+    assert engine.last_evaluated == []
+    np.testing.assert_array_equal(data['greenwashing_rules'].to_numpy(), first)
+
+    # Una copia modificata non eredita le versioni: tutte le regole vengono rivalutate
+    changed = data.copy()
+    assert column_versions(changed) == {} == column_versions(pickle.loads(pickle.dumps(data)))
+    changed['esg_score'] = 99
+    result = engine.evaluate(changed)
+    assert engine.last_evaluated == [rule['name'] for rule in RULES]
+    assert result.hits('top_decile_co2_alta').sum() > 0
+
+    # Dopo un aggiornamento dai feed si rivalutano solo le regole sulle colonne scritte
+    live = LiveUniverse(data, engine)
+    updated = live.ingest([{'product': 'P1', 'green_activities': 1}])
+    engine.evaluate(data, live._quantiles)
+    engine.evaluate(updated, live._quantiles)
+    assert engine.last_evaluated == ['score_alto_green_basso', 'verde_non_zero']
+    expected = RuleEngine(RULES).evaluate(updated, live._quantiles)
+    np.testing.assert_array_equal(updated['greenwashing_rules'].to_numpy(), expected.codes)
@@ -0,0 +1,77 @@
+# Perdite di transizione per prodotto, scenario e portafoglio contro il calcolo diretto percorso per percorso
+
+import numpy as np
+import pandas as pd
+
+from greeninvest import scenarios
+from greeninvest.portfolio import CO2_INVESTMENT_UNIT, PortfolioBook
+from greeninvest.scenarios import (BASE_ABATEMENT, CONFIDENCE, DEFAULT_PASS_THROUGH, DISCOUNT_RATE,
+                                   GREEN_ABATEMENT, SECTOR_PASS_THROUGH, portfolio_losses, price_paths,
+                                   product_losses, scenario_losses, scenario_paths)
+from greeninvest.synthetic import iter_holdings
+
+
+# Perdite (percorsi x prodotti) in float64, un prodotto e un anno alla volta
+def brute_force(data, paths):
+    losses = np.zeros((len(paths), len(data)))
+    for i, row in enumerate(data.itertuples(index=False)):
+        co2 = 0.0 if pd.isna(row.co2_emissions) else row.co2_emissions / CO2_INVESTMENT_UNIT
+        green = 0.0 if pd.isna(row.green_activities) else row.green_activities / 100
+        pass_through = SECTOR_PASS_THROUGH.get(row.sector, DEFAULT_PASS_THROUGH)
+        abatement = min(max(BASE_ABATEMENT + GREEN_ABATEMENT * green, 0), 1)
+        for year in range(1, paths.shape[1] + 1):
+            cost = co2 * (1 - pass_through) * (1 - abatement) ** year / (1 + DISCOUNT_RATE) ** year
+            losses[:, i] += paths[:, year - 1] * cost
+    return np.clip(losses, 0, 1)
+
+
+# Perdita attesa, VaR ed expected shortfall per colonna ordinando tutti i percorsi
+def brute_tail(losses, confidence=CONFIDENCE):
+    ordered = np.sort(losses, axis=0)
+    k = min(int(confidence * len(losses)), len(losses) - 1)
+    return losses.mean(axis=0), ordered[k], ordered[k:].mean(axis=0)
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(np.asarray(actual, dtype=np.float64), expected, rtol=1e-4, atol=1e-7)
+
+
+def test_scenario_losses(universe):
+    frame = scenario_losses(universe)
+    expected = brute_force(universe, scenario_paths())
+    assert frame['product'].tolist() == universe['product'].tolist()
+    for column, name in enumerate(scenarios.SCENARIOS):
+        assert_close(frame[name], expected[column])
+
+
+def test_product_losses(universe, monkeypatch):
+    # Blocchi piccoli: più blocchi di prodotti, ricomposti nell'ordine dell'universo
+    monkeypatch.setattr(scenarios, 'BLOCK_ELEMENTS', 300 * 256)
+    paths = price_paths(300, seed=1)
+    frame = product_losses(universe, paths, workers=1)
+    for column, expected in zip(('expected_loss', 'var', 'expected_shortfall'),
+                                brute_tail(brute_force(universe, paths))):
+        assert_close(frame[column], expected)
+    parallel = product_losses(universe.iloc[:600], paths, workers=2)
+    pd.testing.assert_frame_equal(parallel, frame.iloc[:600])
+
+
+def test_portfolio_losses(universe):
+    holdings = pd.concat(list(iter_holdings(len(universe), 40, seed=2)))
+    book = PortfolioBook.from_records(universe, holdings)
+    paths = price_paths(200, scenario='Transizione ritardata', seed=3)
+    clients, book_losses = portfolio_losses(universe, book, paths, workers=1)
+
+    losses = brute_force(universe, paths)
+    positions = dict(zip(universe['product'], range(len(universe))))
+    amounts = holdings.groupby(['client', 'product'])['amount'].sum()
+    totals = {}
+    for (client, product), amount in amounts.items():
+        totals[client] = totals.get(client, 0) + amount * losses[:, positions[product]]
+    values = holdings.groupby('client')['amount'].sum()
+    fractions = np.column_stack([totals[client] / values[client] for client in clients['client']])
+
+    assert_close(clients['value'], values[clients['client']].to_numpy())
+    for column, expected in zip(('expected_loss', 'var', 'expected_shortfall'), brute_tail(fractions)):
+        assert_close(clients[column], expected)
+    assert_close(book_losses, sum(totals.values()) / values.sum())
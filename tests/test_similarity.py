@@ -0,0 +1,65 @@
+# Alternative più simili (KD-tree e fasce di CO₂) contro le distanze calcolate su tutto l'universo
+
+import numpy as np
+import pytest
+
+from greeninvest.comparator import index_for
+from greeninvest.similarity import SimilarityIndex, feature_matrix, greener_alternatives
+
+OPTIONS = [(exclude, lower) for exclude in (True, False) for lower in (True, False)]
+
+
+# Primi k vicini esaminando ogni prodotto ammesso
+def brute_force(data, position, k, exclude_greenwashing, lower_co2):
+    features = feature_matrix(data).astype(np.float64)
+    co2 = index_for(data).co2_emissions
+    allowed = np.isfinite(features).all(axis=1)
+    if not allowed[position]:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    if exclude_greenwashing:
+        allowed &= ~data['greenwashing_flag'].to_numpy(dtype=bool)
+    if lower_co2:
+        allowed &= co2 < co2[position]
+    allowed[position] = False
+    candidates = np.flatnonzero(allowed)
+    dist = np.linalg.norm(features[candidates] - features[position], axis=1)
+    order = np.argsort(dist, kind='stable')[:k]
+    return candidates[order], dist[order]
+
+
+def with_missing_values(universe):
+    data = universe.copy()
+    data['esg_score'] = data['esg_score'].astype(np.float32)
+    data.loc[::11, 'esg_score'] = np.nan
+    data.loc[5::13, 'co2_emissions'] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('use_tree', [True, False])
+@pytest.mark.parametrize('missing', [False, True])
+def test_neighbours_match_brute_force(universe, use_tree, missing):
+    data = with_missing_values(universe) if missing else universe
+    index = SimilarityIndex(data, use_tree=use_tree)
+    co2 = index_for(data).co2_emissions
+    flags = data['greenwashing_flag'].to_numpy(dtype=bool)
+    valid = np.isfinite(feature_matrix(data)).all(axis=1)
+    for position in range(0, len(data), 9):
+        for exclude, lower in OPTIONS:
+            found, dist = index.query(position, k=5, exclude_greenwashing=exclude, lower_co2=lower)
+            expected, expected_dist = brute_force(data, position, 5, exclude, lower)
+            # Stesse distanze (a parità di distanza l'ordine dei prodotti può cambiare)
+            np.testing.assert_allclose(dist, expected_dist, rtol=1e-5, atol=1e-6)
+            assert valid[found].all() and position not in found
+            if exclude:
+                assert not flags[found].any()
+            if lower:
+                assert (co2[found] < co2[position]).all()
+
+
+def test_greener_alternatives(universe):
+    product = universe['product'].iloc[42]
+    alternatives = greener_alternatives(universe, product, k=3)
+    expected, expected_dist = brute_force(universe, 42, 3, True, True)
+    assert alternatives['product'].tolist() == universe['product'].iloc[expected].tolist()
+    np.testing.assert_allclose(alternatives['distance'], expected_dist, rtol=1e-5, atol=1e-6)
+    assert ((alternatives['similarity'] > 0) & (alternatives['similarity'] <= 1)).all()
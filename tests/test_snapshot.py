@@ -0,0 +1,69 @@
+# Snapshot dell'universo: andata e ritorno su disco, cambio di versione, niente pickle
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from greeninvest.aggregation import ScoreStats, score_stats
+from greeninvest.comparator import index_for
+from greeninvest.snapshot import CURRENT, current_snapshot, publish
+
+
+def assert_same_frame(actual, expected):
+    assert list(actual.columns) == list(expected.columns)
+    for col in expected.columns:
+        left, right = actual[col], expected[col]
+        if isinstance(right.dtype, pd.CategoricalDtype):
+            assert actual[col].dtype == right.dtype
+        assert left.isna().tolist() == right.isna().tolist()
+        assert left.astype(object).dropna().tolist() == right.astype(object).dropna().tolist()
+
+
+def test_round_trip(universe, tmp_path):
+    data = universe.copy()
+    data['notes'] = pd.Series(['nota è' if i % 3 else None for i in range(len(data))], dtype=object)
+    data.loc[::7, 'co2_emissions'] = np.nan
+    name = publish(data, tmp_path)
+    snapshot = current_snapshot(tmp_path)
+    assert snapshot.version == name
+    assert_same_frame(snapshot.data, data)
+
+    # Strutture derivate salvate con la snapshot, uguali a quelle ricalcolate
+    for col in ('esg_score', 'co2_emissions', 'green_activities'):
+        np.testing.assert_array_equal(getattr(index_for(snapshot.data), col), getattr(index_for(data), col))
+    saved, fresh = score_stats(snapshot.data), ScoreStats.from_data(data)
+    np.testing.assert_array_equal(saved.counts, fresh.counts)
+    for by, (counts, sums) in fresh.groups.items():
+        np.testing.assert_array_equal(saved.groups[by][0], counts)
+        np.testing.assert_allclose(saved.groups[by][1], sums)
+
+    # Nessun file richiede pickle per essere letto
+    for path in glob.glob(os.path.join(tmp_path, name, '*.npy')):
+        np.load(path, allow_pickle=False)
+
+
+def test_new_version_replaces_current(universe, tmp_path):
+    publish(universe, tmp_path)
+    old = current_snapshot(tmp_path)
+    changed = universe.iloc[:500].copy()
+    changed['esg_score'] = 100
+    publish(changed, tmp_path)
+    new = current_snapshot(tmp_path)
+    assert new.version != old.version
+    assert_same_frame(new.data, changed)
+    # Chi ha ancora la versione precedente continua a leggerla
+    assert_same_frame(old.data, universe)
+
+
+def test_unsupported_column_keeps_current_version(universe, tmp_path):
+    name = publish(universe, tmp_path)
+    data = universe.copy()
+    data['payload'] = [{'a': 1}] * len(data)
+    with pytest.raises(TypeError):
+        publish(data, tmp_path)
+    with open(os.path.join(tmp_path, CURRENT), encoding='utf-8') as f:
+        assert f.read().strip() == name
+    assert current_snapshot(tmp_path).version == name
@@ -0,0 +1,74 @@
+# Salvataggio dei moduli: recupero dal journal dopo un crash e scritture a gruppi da più thread
+
+import os
+import subprocess
+import sys
+import threading
+
+from greeninvest.submissions import SubmissionQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Processo che salva alcuni moduli e termina senza chiudere la coda (come un crash)
+CRASH_SCRIPT = """
+import os, sys
+from greeninvest.submissions import SubmissionQueue
+queue = SubmissionQueue(sys.argv[1], batch_size=10, interval=3600)
+for i in range(25):
+    queue.submit('contact_form', {'i': i})
+assert queue.flush(timeout=10) and queue.committed == 25
+for i in range(25, 32):
+    queue.submit('contact_form', {'i': i})
+# Riga scritta a metà al momento del crash
+queue._journal.write(b'{"form": "contact_form", "at": 1')
+queue._journal.flush()
+os._exit(0)
+"""
+
+
+def test_journal_replay_after_crash(tmp_path):
+    path = str(tmp_path / 'submissions.db')
+    subprocess.run([sys.executable, '-c', CRASH_SCRIPT, path], cwd=ROOT, check=True, timeout=60)
+
+    queue = SubmissionQueue(path)
+    try:
+        # Solo i record non ancora nel database, una volta sola; la riga incompleta si scarta
+        assert queue.recovered == 7
+        saved = sorted(record['i'] for record in queue.recent(limit=1000))
+        assert saved == list(range(32))
+    finally:
+        queue.close()
+
+    queue = SubmissionQueue(path)
+    try:
+        assert queue.recovered == 0
+        assert len(queue.recent(limit=1000)) == 32
+    finally:
+        queue.close()
+
+
+def test_concurrent_writers_share_transactions(tmp_path):
+    n_threads, per_thread = 8, 250
+    queue = SubmissionQueue(str(tmp_path / 'submissions.db'), batch_size=100, interval=0.05)
+    barrier = threading.Barrier(n_threads)
+
+    def writer(t):
+        barrier.wait()
+        for i in range(per_thread):
+            queue.submit('profiling_form', {'thread': t, 'i': i})
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert queue.flush(timeout=30)
+        total = n_threads * per_thread
+        assert queue.committed == total and queue.backlog == 0 and queue.failures == 0
+        # Più moduli per transazione, mai oltre batch_size
+        assert total / queue.batch_size <= queue.batches < total / 10
+        saved = {(record['thread'], record['i']) for record in queue.recent(limit=total + 1)}
+        assert saved == {(t, i) for t in range(n_threads) for i in range(per_thread)}
+    finally:
+        queue.close()